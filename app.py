@@ -1,25 +1,199 @@
 import os
+import json
+import math
+import importlib
+import threading
+from functools import partial
 from urllib.parse import urlparse
+from collections.abc import Callable, Iterator
+from typing import TYPE_CHECKING, Generic, TypeVar
+import time
 import secrets
 
-import voyageai
-from flask import Flask, request
+from flask import Flask, Response, g, request
 from dotenv import load_dotenv
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from pinecone import Pinecone
-from mistralai.client import MistralClient
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, Histogram, generate_latest
+)
 
 from dbbuilder import build_vector_database
+from dbbuilder.build import EMBEDDING_MODEL, new_text_splitter
+from dbbuilder.state import SyncState
+from dbbuilder.checkpoint import BuildCheckpoint
+from dbbuilder.registry import NamespaceRegistry
+from dbbuilder.jobs import BuildJob, BuildJobManager
+from dbbuilder.progress import BuildProgress
+from dbbuilder.connections import new_session
+from dbbuilder.ratelimit import RateLimitedEmbedder, RateLimiter, TenantLimiter
+from dbbuilder.cache import (
+    CachedEmbedder, LRUEmbeddingCache, SQLiteEmbeddingCache, TieredEmbeddingCache
+)
 from rag import WordPressRAG
+from rag.cache import SemanticCache
+from rag.metrics import CacheCollector, record_timings
+from rag.sessions import InMemoryConversationStore, SQLiteConversationStore
+from vectorstore import BM25Index, LocalVectorStore
+
+if TYPE_CHECKING:
+    from mistralai.client import MistralClient
+    import voyageai
+
+T = TypeVar("T")
+
+
+class Lazy(Generic[T]):
+    """
+    Stands in for an object created when first used, so that starting the
+    server neither imports its library nor connects to its service.
+    """
+    def __init__(self, factory: Callable[[], T]):
+        self._factory = factory
+        self._value: T | None = None
+        self._lock = threading.Lock()
+
+    def get(self) -> T:
+        if self._value is None:
+            with self._lock:
+                if self._value is None:
+                    self._value = self._factory()
+        return self._value
+
+    def __getattr__(self, name: str):
+        return getattr(self.get(), name)
+
+
+def new_pinecone_index(api_key: str):
+    from pinecone import Pinecone
+    return Pinecone(api_key).Index("wordpress-chatbot")
+
+
+def new_voyage_client(api_key: str) -> "voyageai.Client":
+    import voyageai
+    # Keep the connections to the Voyage API alive, for all the threads
+    voyageai.requestssession = new_session(
+        int(os.environ.get("HTTP_POOL_SIZE") or 32), max_retries=2
+    )
+    return voyageai.Client(api_key)
+
+
+def new_mistral_client(api_key: str) -> "MistralClient":
+    from mistralai.client import MistralClient
+    return MistralClient(api_key)
 
 
 load_dotenv()
 app = Flask(__name__)
 app.secret_key = secrets.token_hex()
-DATABASE = Pinecone(os.environ["PINECONE_API_KEY"]).Index("wordpress-chatbot")
-EMBEDDER = voyageai.Client(os.environ["VOYAGE_API_KEY"])
-LLM_CLIENT = MistralClient(os.environ["MISTRAL_API_KEY"])
-CHATBOT = WordPressRAG(LLM_CLIENT, "open-mistral-7b", EMBEDDER, DATABASE)
+if (os.environ.get("VECTOR_STORE") or "pinecone") == "local":
+    DATABASE = LocalVectorStore(
+        os.environ.get("LOCAL_VECTOR_STORE_PATH") or "vector_store"
+    )
+else:
+    DATABASE = Lazy(partial(new_pinecone_index, os.environ["PINECONE_API_KEY"]))
+EMBEDDING_RATE_LIMITER = RateLimiter(*(
+    float(os.environ[key]) if os.environ.get(key) else None
+    for key in ["VOYAGE_REQUESTS_PER_MINUTE", "VOYAGE_TOKENS_PER_MINUTE"]
+))
+EMBEDDER = CachedEmbedder(
+    RateLimitedEmbedder(
+        Lazy(partial(new_voyage_client, os.environ["VOYAGE_API_KEY"])),
+        EMBEDDING_RATE_LIMITER,
+    ),
+    TieredEmbeddingCache([
+        LRUEmbeddingCache(),
+        SQLiteEmbeddingCache(
+            os.environ.get("EMBEDDING_CACHE_PATH") or "embedding_cache.db"
+        ),
+    ]),
+)
+LLM_CLIENT = Lazy(partial(new_mistral_client, os.environ["MISTRAL_API_KEY"]))
+if os.environ.get("RESPONSE_CACHE_THRESHOLD"):
+    RESPONSE_CACHE = SemanticCache(float(os.environ["RESPONSE_CACHE_THRESHOLD"]))
+else:
+    RESPONSE_CACHE = None
+if os.environ.get("BM25_INDEX_PATH"):
+    SPARSE_INDEX = BM25Index(os.environ["BM25_INDEX_PATH"])
+else:
+    SPARSE_INDEX = None
+CHATBOT = WordPressRAG(
+    LLM_CLIENT, "open-mistral-7b", EMBEDDER, DATABASE,
+    response_cache=RESPONSE_CACHE, sparse_index=SPARSE_INDEX,
+    prompt_token_budget=int(os.environ.get("PROMPT_TOKEN_BUDGET") or 4000),
+    min_score=(float(os.environ["RETRIEVAL_MIN_SCORE"])
+               if os.environ.get("RETRIEVAL_MIN_SCORE") else None),
+)
+if os.environ.get("CONVERSATION_STORE_PATH"):
+    CONVERSATIONS = SQLiteConversationStore(os.environ["CONVERSATION_STORE_PATH"])
+else:
+    CONVERSATIONS = InMemoryConversationStore()
+SYNC_STATE = SyncState(os.environ.get("SYNC_STATE_PATH") or "sync_state.db")
+CHECKPOINT_DIR = os.environ.get("CHECKPOINT_DIR") or "checkpoints"
+NAMESPACES = NamespaceRegistry(
+    DATABASE, os.environ.get("NAMESPACE_REGISTRY_PATH") or "namespaces.db"
+)
+CHAT_LIMITER = TenantLimiter(
+    int(os.environ["SITE_MAX_CONCURRENT_CHATS"])
+    if os.environ.get("SITE_MAX_CONCURRENT_CHATS") else None,
+    float(os.environ["SITE_CHATS_PER_MINUTE"])
+    if os.environ.get("SITE_CHATS_PER_MINUTE") else None,
+)
+DB_LIMITER = TenantLimiter(
+    int(os.environ["SITE_MAX_CONCURRENT_DB_REQUESTS"])
+    if os.environ.get("SITE_MAX_CONCURRENT_DB_REQUESTS") else None,
+    float(os.environ["SITE_DB_REQUESTS_PER_MINUTE"])
+    if os.environ.get("SITE_DB_REQUESTS_PER_MINUTE") else None,
+)
+BUILD_JOBS = BuildJobManager(int(os.environ.get("MAX_CONCURRENT_BUILDS") or 2))
+SERVER_TIMING = (os.environ.get("SERVER_TIMING") or "false").lower() == "true"
+# Shared by the builds, and only loaded by the first one
+TEXT_SPLITTER = Lazy(new_text_splitter)
+
+REQUEST_SECONDS = Histogram(
+    "wordpress_assistant_http_request_seconds",
+    "Time taken to respond to HTTP requests. For streamed responses, the "
+    "time until the response starts.",
+    ["endpoint", "method", "status"],
+)
+_caches = {f"embedding_tier{i}": tier for i, tier in enumerate(EMBEDDER.cache.tiers)}
+_caches["embedding"] = EMBEDDER.cache
+if RESPONSE_CACHE is not None:
+    _caches["response"] = RESPONSE_CACHE
+REGISTRY.register(CacheCollector(_caches))
+
+
+def warm_up() -> None:
+    """
+    Load what answering chats needs, so that the first ones aren't slow: the
+    libraries of the API clients and the tokenizer. The clients are created
+    by the first request instead, since connections opened before the
+    server forks its workers would be shared by them.
+
+    Runs at startup if the WARM_UP environment variable is "true". With
+    `gunicorn --preload`, it then runs once before the workers are forked,
+    and they share what it loaded.
+    """
+    for module in ["voyageai", "mistralai.client"]:
+        importlib.import_module(module)
+    if not isinstance(DATABASE, LocalVectorStore):
+        importlib.import_module("pinecone")
+    CHATBOT.token_counter.count_text("")
+
+
+if (os.environ.get("WARM_UP") or "false").lower() == "true":
+    warm_up()
+
+
+@app.before_request
+def start_timer():
+    g.start_time = time.perf_counter()
+
+
+@app.after_request
+def observe_request(response: Response) -> Response:
+    REQUEST_SECONDS.labels(
+        request.endpoint or "", request.method, response.status_code
+    ).observe(time.perf_counter() - g.start_time)
+    return response
 
 
 def authorize():
@@ -29,17 +203,38 @@ def authorize():
     return {"message": "Authorization successful."}, 200
 
 
+def too_many_requests(site_domain: str | None, retry_after: float):
+    if site_domain:
+        message = f"Too many requests for '{site_domain}', retry later."
+    else:
+        message = "Too many requests, retry later."
+    return {"message": message}, 429, {"Retry-After": str(math.ceil(retry_after))}
+
+
 @app.route("/db", methods=["POST", "DELETE"])
 def db_ops():
     """
     Request Body:
         {
             "site_url": "https://www.example.com",
-            "create_if_not_present": true
+            "create_if_not_present": true,
+            "update_if_present": true
         }
 
     Optional:
         "create_if_not_present": false (Default)
+        "update_if_present": false (Default). If true, an existing database
+            is updated with the content changed since it was last built.
+
+    Builds run in the background. The response to a request starting one
+    has status 202 and a "job_id", to be used with `GET /db/jobs/<job_id>`.
+    While a build of the site runs, the response has its "job_id", with
+    status 202 if the request asked for a build, and 200 otherwise. A
+    database whose build was interrupted is not present; either option
+    resumes its build.
+
+    Requests over the limits of their site have status 429 and a
+    Retry-After header.
     """
     auth_res = authorize()
     if auth_res[1] == 401:
@@ -51,22 +246,65 @@ def db_ops():
     if not site_domain:
         return {"message": "'site_url' is not a url."}, 400
 
+    retry_after = DB_LIMITER.try_acquire(site_domain)
+    if retry_after:
+        return too_many_requests(site_domain, retry_after)
+    try:
+        return change_database(site_domain)
+    finally:
+        DB_LIMITER.release(site_domain)
+
+
+def change_database(site_domain: str):
     match request.method:
         case "POST":
-            EMBEDDING_SIZE = 1024
-            match = DATABASE.query(
-                namespace=site_domain,
-                vector=[0]*EMBEDDING_SIZE,
-                top_k=1,
-            )["matches"]
-            if len(match) == 1:
+            job = BUILD_JOBS.active_job(site_domain)
+            if job is not None:
+                namespace = NAMESPACES.get(site_domain)
+                present = namespace is not None and namespace.present
+                asked_build = request.json.get("update_if_present", False) or (
+                    not present and request.json.get("create_if_not_present", False)
+                )
+                return {
+                    "message": f"Database build in progress for '{site_domain}'",
+                    "database_present": present,
+                    "database_created": False,
+                    "job_id": job.id,
+                }, 202 if asked_build else 200
+
+            if BuildCheckpoint.is_pending(checkpoint_path(site_domain)):
+                if not (request.json.get("create_if_not_present", False)
+                        or request.json.get("update_if_present", False)):
+                    return {
+                        "message": f"Database build interrupted for '{site_domain}'",
+                        "database_present": False,
+                        "database_created": False,
+                    }
+                job = start_build(request.json["site_url"], site_domain,
+                                  incremental=True)
+                return {
+                    "message": f"Database build resumed for '{site_domain}'",
+                    "database_present": False,
+                    "database_created": False,
+                    "job_id": job.id,
+                }, 202
+
+            namespace = NAMESPACES.get(site_domain)
+            if namespace is not None and namespace.present:
+                if request.json.get("update_if_present", False):
+                    job = start_build(request.json["site_url"], site_domain,
+                                      incremental=True)
+                    return {
+                        "message": f"Database update started for '{site_domain}'",
+                        "database_present": True,
+                        "database_created": False,
+                        "job_id": job.id,
+                    }, 202
                 return {
                     "message": f"Database already present for '{site_domain}'",
                     "database_present": True,
                     "database_created": False,
                 }
-            elif len(match) > 1:
-                raise AssertionError("Only one match should've been returned.")
 
             if not request.json.get("create_if_not_present", False):
                 return {
@@ -75,25 +313,150 @@ def db_ops():
                     "database_created": False,
                 }
 
-            build_vector_database(
-                request.json["site_url"],
-                RecursiveCharacterTextSplitter.from_tiktoken_encoder(
-                    encoding_name="cl100k_base", chunk_size=200, chunk_overlap=40
-                ),
-                EMBEDDER,
-                DATABASE,
-            )
+            job = start_build(request.json["site_url"], site_domain,
+                              incremental=False)
             return {
-                "message": f"Database created for '{site_domain}'",
-                "database_present": True,
-                "database_created": True,
-            }
+                "message": f"Database build started for '{site_domain}'",
+                "database_present": False,
+                "database_created": False,
+                "job_id": job.id,
+            }, 202
 
         case "DELETE":
+            if BUILD_JOBS.active_job(site_domain) is not None:
+                return {
+                    "message": f"Database build in progress for '{site_domain}'"
+                }, 409
             DATABASE.delete(delete_all=True, namespace=site_domain)
+            if SPARSE_INDEX is not None:
+                SPARSE_INDEX.delete(delete_all=True, namespace=site_domain)
+            SYNC_STATE.clear(site_domain)
+            BuildCheckpoint.remove(checkpoint_path(site_domain))
+            NAMESPACES.remove(site_domain)
+            if RESPONSE_CACHE is not None:
+                RESPONSE_CACHE.invalidate(site_domain)
             return {"message": f"Database deleted for '{site_domain}'"}
 
 
+def checkpoint_path(site_domain: str) -> str:
+    return os.path.join(CHECKPOINT_DIR, f"{site_domain}.jsonl")
+
+
+def start_build(site_url: str, site_domain: str, incremental: bool) -> BuildJob:
+    def build(progress: BuildProgress) -> None:
+        os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+        checkpoint = BuildCheckpoint(checkpoint_path(site_domain))
+        # A build being resumed needs the state it started from
+        if not incremental and not checkpoint.started:
+            SYNC_STATE.clear(site_domain)
+        NAMESPACES.start_build(site_domain, EMBEDDING_MODEL)
+        try:
+            build_vector_database(
+                site_url,
+                TEXT_SPLITTER,
+                EMBEDDER,
+                DATABASE,
+                state=SYNC_STATE,
+                progress=progress,
+                checkpoint=checkpoint,
+                sparse_index=SPARSE_INDEX,
+                count_tokens=CHATBOT.token_counter.count_text,
+            )
+        except Exception:
+            NAMESPACES.finish_build(site_domain, succeeded=False)
+            raise
+        finally:
+            checkpoint.close()
+        NAMESPACES.finish_build(site_domain, succeeded=True)
+        if RESPONSE_CACHE is not None:
+            RESPONSE_CACHE.invalidate(site_domain)
+    job, _ = BUILD_JOBS.submit(site_domain, build)
+    return job
+
+
+@app.route("/db", methods=["GET"])
+def db_status():
+    """
+    Query Parameters:
+        site_url: If present, only the database of this site is described.
+
+    Response Body:
+        {
+            "databases": [
+                {
+                    "namespace": "www.example.com",
+                    "database_present": true,
+                    "vector_count": 5120,
+                    "status": "complete",
+                    "built_at": 1717171717.0,
+                    "embedding_model": "voyage-large-2-instruct",
+                    "job_id": null
+                }
+            ]
+        }
+
+    "status" is that of the latest build: "building", "complete" or
+    "failed". "built_at" is the Unix time at which the last successful
+    build finished. "job_id" is that of the build in progress, if any.
+    Vector counts are refreshed from the index every few minutes.
+    """
+    auth_res = authorize()
+    if auth_res[1] == 401:
+        return auth_res
+
+    if "site_url" in request.args:
+        site_domain = urlparse(request.args["site_url"]).hostname
+        if not site_domain:
+            return {"message": "'site_url' is not a url."}, 400
+        namespace = NAMESPACES.get(site_domain)
+        if namespace is None:
+            return {"message": f"Database not present for '{site_domain}'"}, 404
+        namespaces = [namespace]
+    else:
+        namespaces = NAMESPACES.all()
+
+    databases = []
+    for namespace in namespaces:
+        job = BUILD_JOBS.active_job(namespace.namespace)
+        databases.append(namespace.to_dict()
+                         | {"job_id": job.id if job is not None else None})
+    return {"databases": databases}
+
+
+@app.route("/db/jobs/<job_id>", methods=["GET"])
+def db_job_status(job_id: str):
+    """
+    Response Body:
+        {
+            "job_id": "0123456789abcdef0123456789abcdef",
+            "site_domain": "www.example.com",
+            "status": "running",
+            "error": null,
+            "documents_total": 1200,
+            "documents_fetched": 300,
+            "chunks_embedded": 1024,
+            "vectors_upserted": 896,
+            "vectors_deleted": 0,
+            "elapsed_seconds": 12.5,
+            "documents_per_second": 24.0,
+            "eta_seconds": 37.5,
+            "stage_seconds": {}
+        }
+
+    "status" is one of "queued", "running", "succeeded" or "failed".
+    "stage_seconds" has the time spent in every stage of the build (e.g.
+    "fetch", "extract", "embed"), once they finish.
+    """
+    auth_res = authorize()
+    if auth_res[1] == 401:
+        return auth_res
+
+    job = BUILD_JOBS.get(job_id)
+    if job is None:
+        return {"message": f"No build job with ID '{job_id}'"}, 404
+    return job.to_dict()
+
+
 @app.route("/chat", methods=["POST"])
 def chat():
     """
@@ -104,11 +467,39 @@ def chat():
                 {"role": "assistant", "content": "message1"},
                 {"role": "system", "content": "message2"},
                 {"role": "user", "content": "message3"}
-            ]
+            ],
+            "stream": true
+        }
+
+    Or, in a session created with `POST /chat/sessions`:
+        {
+            "site_url": "https://www.example.com",
+            "session_id": "0123456789abcdef0123456789abcdef",
+            "message": {"role": "user", "content": "message3"},
+            "stream": true
         }
 
     Optional:
         "site_url": If not present, RAG is not performed.
+        "stream": false (Default). If true, the response is streamed as
+            server-sent events: a "context" event with the retrieved texts,
+            a "token" event for every piece of the generated message, and a
+            "done" event with the response body. If the response fails once
+            streaming has started, an "error" event with a "message" ends it
+            instead of "done".
+
+    The response body has the chat messages, the new one appended. In a
+    session it is only the new message instead, as
+    {"session_id": ..., "message": {"role": "assistant", "content": ...}}.
+    If another request changed the session during the turn, the turn isn't
+    saved and the status is 409 (or the stream ends with an "error" event).
+
+    If the SERVER_TIMING environment variable is "true", responses which
+    aren't streamed have a Server-Timing header with the milliseconds spent
+    in every stage, e.g. "embed;dur=85.2, retrieve;dur=40.1, llm;dur=812.7".
+
+    Requests over the limits of their site have status 429 and a
+    Retry-After header.
     """
     auth_res = authorize()
     if auth_res[1] == 401:
@@ -118,4 +509,140 @@ def chat():
         site_domain = urlparse(request.json["site_url"]).hostname
     else:
         site_domain = None
-    return CHATBOT.generate(site_domain, request.json["messages"])
+
+    session_id, version = request.json.get("session_id"), None
+    if session_id is None:
+        messages = request.json["messages"]
+    else:
+        entry = CONVERSATIONS.get_versioned(session_id)
+        if entry is None:
+            return {"message": f"No chat session with ID '{session_id}'"}, 404
+        messages, version = entry
+        if "message" not in request.json:
+            return {"message": "'message' is not present in the request body."}, 400
+        messages.append(request.json["message"])
+
+    tenant = site_domain or ""
+    retry_after = CHAT_LIMITER.try_acquire(tenant)
+    if retry_after:
+        return too_many_requests(site_domain, retry_after)
+
+    if request.json.get("stream", False):
+        events = CHATBOT.generate_stream(site_domain, messages)
+        if session_id is not None:
+            events = session_events(session_id, version, events)
+        response = Response(server_sent_events(events),
+                            mimetype="text/event-stream",
+                            headers={"Cache-Control": "no-cache",
+                                     "X-Accel-Buffering": "no"})
+        # The request is in flight until the stream ends or is cut
+        response.call_on_close(lambda: CHAT_LIMITER.release(tenant))
+        return response
+    try:
+        with record_timings() as timings:
+            chat = CHATBOT.generate(site_domain, messages)
+    finally:
+        CHAT_LIMITER.release(tenant)
+    headers = {}
+    if SERVER_TIMING:
+        headers["Server-Timing"] = ", ".join(
+            f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items()
+        )
+    if session_id is not None:
+        body = save_session(session_id, version, chat)
+        if body is None:
+            return session_conflict(session_id), 409
+        return body, headers
+    return chat, headers
+
+
+@app.route("/chat/sessions", methods=["POST"])
+def create_chat_session():
+    """
+    Request Body:
+        {
+            "messages": [
+                {"role": "system", "content": "message1"}
+            ]
+        }
+
+    Optional:
+        "messages": Messages the chat starts with. Empty by default.
+
+    Response Body:
+        {"session_id": "0123456789abcdef0123456789abcdef"}
+    """
+    auth_res = authorize()
+    if auth_res[1] == 401:
+        return auth_res
+
+    body = request.get_json(silent=True) or {}
+    return {"session_id": CONVERSATIONS.create(body.get("messages", []))}, 201
+
+
+@app.route("/chat/sessions/<session_id>", methods=["GET", "DELETE"])
+def chat_session(session_id: str):
+    """
+    GET returns the messages of the session, as {"messages": [...]}.
+    DELETE ends the session.
+    """
+    auth_res = authorize()
+    if auth_res[1] == 401:
+        return auth_res
+
+    match request.method:
+        case "GET":
+            messages = CONVERSATIONS.get(session_id)
+            if messages is None:
+                return {"message": f"No chat session with ID '{session_id}'"}, 404
+            return {"messages": messages}
+        case "DELETE":
+            CONVERSATIONS.delete(session_id)
+            return {"message": f"Chat session '{session_id}' deleted"}
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    "Metrics of the server in the Prometheus text format."
+    auth_res = authorize()
+    if auth_res[1] == 401:
+        return auth_res
+    return Response(generate_latest(REGISTRY), content_type=CONTENT_TYPE_LATEST)
+
+
+def save_session(
+    session_id: str,
+    version: int,
+    chat: list[dict[str, str]],
+) -> dict | None:
+    """
+    Store the chat of a session, returning the response body of `/chat`.
+    Returns None instead if the session changed since `version` was read.
+    """
+    if not CONVERSATIONS.put(session_id, chat, version):
+        return None
+    return {"session_id": session_id, "message": chat[-1]}
+
+
+def session_conflict(session_id: str) -> dict:
+    return {"message": f"Chat session '{session_id}' was changed or ended "
+                       "during the turn, which wasn't saved."}
+
+
+def session_events(
+    session_id: str,
+    version: int,
+    events: Iterator[tuple[str, object]],
+) -> Iterator[tuple[str, object]]:
+    for name, data in events:
+        if name == "done":
+            data = save_session(session_id, version, data)
+            if data is None:
+                yield "error", session_conflict(session_id)
+                return
+        yield name, data
+
+
+def server_sent_events(events: Iterator[tuple[str, object]]) -> Iterator[str]:
+    for name, data in events:
+        yield f"event: {name}\ndata: {json.dumps(data)}\n\n"
@@ -0,0 +1,69 @@
+"""
+Benchmark of the extraction of text from HTML, in documents per second.
+
+    python -m benchmarks.extract_html --documents 2000 --processes 4
+"""
+import os
+import time
+import random
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from dbbuilder.utils import (
+    extract_text_from_html, extract_texts_from_html, _bs4_extract_text_from_html
+)
+
+
+def synthetic_post(rand: random.Random) -> str:
+    "HTML resembling the rendered content of a WordPress post."
+    words = ["lorem", "ipsum", "dolor", "sit", "amet", "consectetur",
+             "adipiscing", "elit", "sed", "do", "eiusmod", "tempor"]
+
+    def sentence() -> str:
+        return " ".join(rand.choices(words, k=rand.randint(6, 20))).capitalize() + "."
+
+    html = ""
+    for _ in range(rand.randint(3, 8)):
+        html += f'<h2 class="wp-block-heading" id="h-{rand.randint(0, 999)}">{sentence()}</h2>\n'
+        for _ in range(rand.randint(2, 6)):
+            html += (f"<p>{sentence()} <a href=\"https://example.com/{rand.randint(0, 999)}\">"
+                     f"{sentence()}</a> <strong>{sentence()}</strong> &amp; &#8220;{sentence()}&#8221;</p>\n")
+        if rand.random() < 0.3:
+            html += "<ul>" + "".join(f"<li>{sentence()}</li>" for _ in range(5)) + "</ul>\n"
+        if rand.random() < 0.2:
+            html += '<script type="text/javascript">window.dataLayer = window.dataLayer || [];</script>\n'
+    html += "<style>.wp-block-group { margin: 0 auto; }</style>"
+    return f'<div class="entry-content">\n{html}</div>'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--documents", type=int, default=1000)
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rand = random.Random(args.seed)
+    htmls = [synthetic_post(rand) for _ in range(args.documents)]
+    mb = sum(map(len, htmls)) / 2**20
+    print(f"{args.documents} documents, {mb:.1f} MB of HTML")
+
+    def run(name, extract):
+        start = time.perf_counter()
+        texts = extract()
+        seconds = time.perf_counter() - start
+        print(f"{name:<32} {args.documents / seconds:>10.1f} docs/s")
+        return texts
+
+    before = run("BeautifulSoup", lambda: [_bs4_extract_text_from_html(h) for h in htmls])
+    after = run("streaming", lambda: [extract_text_from_html(h) for h in htmls])
+    with ProcessPoolExecutor(args.processes) as pool:
+        # Start the processes before timing
+        list(pool.map(extract_text_from_html, [""] * args.processes))
+        batched = run(f"streaming, {args.processes} processes",
+                      lambda: list(extract_texts_from_html(htmls, pool)))
+    assert before == after == batched
+
+
+if __name__ == "__main__":
+    main()
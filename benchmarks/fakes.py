@@ -0,0 +1,278 @@
+"""
+Local stand-ins for the services used by the backend, to benchmark it
+offline: a WordPress site and the Voyage, Pinecone and Mistral clients.
+Latency and rate limits of the services can be injected.
+"""
+import json
+import time
+import random
+import hashlib
+import threading
+from types import SimpleNamespace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+from mistralai.models.chat_completion import ChatMessage
+
+from vectorstore import VectorStore
+
+
+WORDS = ("the of and to in is for on that with as this by be are at from or "
+         "an it your can we more you all our new site page post store opening "
+         "hours product price delivery order account help contact support "
+         "service guide update feature event news team plugin theme").split()
+
+
+class RateLimiter:
+    """
+    Token bucket allowing `rate` calls per second on average, with bursts of
+    up to `burst` calls. Calls over the limit wait for their turn, as they
+    would after the retries of a throttled client.
+    """
+    def __init__(self, rate: float | None, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.throttled_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        if self.rate is None:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            self.throttled_seconds += wait
+        time.sleep(wait)
+
+
+class SyntheticWordPressSite:
+    """
+    A WordPress site served over HTTP on localhost, with generated pages,
+    posts and comments. Use as a context manager; `url` is the site's URL.
+    """
+    def __init__(
+        self,
+        posts: int = 1000,
+        pages: int = 50,
+        comments: int = 2000,
+        paragraphs: int = 8,
+        latency: float = 0.05,
+        seed: int = 0,
+    ):
+        """
+        Args:
+            posts, pages, comments: Number of items of every content type.
+            paragraphs: Average number of paragraphs of posts and pages.
+            latency: Seconds added to every response of the REST API.
+            seed: Seed of the generated content.
+        """
+        self.counts = {"posts": posts, "pages": pages, "comments": comments}
+        self.paragraphs = paragraphs
+        self.latency = latency
+        self.seed = seed
+        self.requests = 0
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                site.requests += 1
+                status, body, headers = site._respond(self.path)
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._server.server_port}/"
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        daemon=True)
+
+    def __enter__(self) -> "SyntheticWordPressSite":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    @property
+    def documents(self) -> int:
+        return sum(self.counts.values())
+
+    def item(self, content_type: str, id: int) -> dict:
+        "Generate an item of the REST API, always the same for the same ID."
+        rand = random.Random(f"{self.seed}/{content_type}/{id}")
+        kind = content_type[:-1]
+        if content_type == "comments":
+            html = f"<p>{_sentences(rand, rand.randint(1, 6))}</p>\n"
+        else:
+            html = ""
+            for _ in range(rand.randint(1, 2 * self.paragraphs)):
+                if rand.random() < 0.2:
+                    html += f"<h2>{_sentences(rand, 1)}</h2>\n"
+                html += f"<p>{_sentences(rand, rand.randint(2, 6))}</p>\n"
+        item = {
+            "id": id,
+            "type": kind,
+            "link": f"{self.url}{kind}/{id}/",
+            "content": {"rendered": html},
+            "modified": f"2024-01-01T00:00:{id % 60:02}",
+            "modified_gmt": f"2024-01-01T00:00:{id % 60:02}",
+        }
+        if content_type != "comments":
+            item["title"] = {"rendered": _sentences(rand, 1)[:-1]}
+        return item
+
+    def _respond(self, path: str) -> tuple[int, object, dict[str, str]]:
+        url = urlparse(path)
+        if not url.path.startswith("/wp-json"):
+            return 200, {}, {"Link": f'<{self.url}wp-json/>; rel="https://api.w.org/"'}
+        if not url.path.startswith("/wp-json/wp/v2/"):
+            return 200, {"namespaces": ["wp/v2"], "gmt_offset": 0}, {}
+
+        time.sleep(self.latency)
+        content_type = url.path.rstrip("/").split("/")[-1]
+        if content_type not in self.counts:
+            return 404, {"code": "rest_no_route"}, {}
+        qs = parse_qs(url.query)
+        per_page = int(qs.get("per_page", ["10"])[0])
+        page = int(qs.get("page", ["1"])[0])
+        total = self.counts[content_type]
+        ids = range((page - 1) * per_page + 1, min(page * per_page, total) + 1)
+        items = [self.item(content_type, id) for id in ids]
+        if "_fields" in qs:
+            fields = qs["_fields"][0].split(",")
+            items = [{f: item[f] for f in fields} for item in items]
+        return 200, items, {
+            "X-WP-Total": str(total),
+            "X-WP-TotalPages": str(max(1, -(-total // per_page))),
+        }
+
+
+class FakeEmbedder:
+    """
+    Stand-in for `voyageai.Client`. Embeddings are random unit vectors
+    derived from the texts, so equal texts have equal embeddings.
+    """
+    def __init__(
+        self,
+        dimension: int = 1024,
+        latency: float = 0.1,
+        latency_per_text: float = 0.001,
+        requests_per_second: float | None = None,
+    ):
+        self.dimension = dimension
+        self.latency = latency
+        self.latency_per_text = latency_per_text
+        self.limiter = RateLimiter(requests_per_second)
+        self.requests = 0
+        self.texts = 0
+
+    def embed(self, texts: list[str], model: str, input_type: str | None = None,
+              **kwargs) -> SimpleNamespace:
+        self.limiter.acquire()
+        time.sleep(self.latency + self.latency_per_text * len(texts))
+        self.requests += 1
+        self.texts += len(texts)
+        return SimpleNamespace(embeddings=[self.embedding(t) for t in texts])
+
+    def embedding(self, text: str) -> list[float]:
+        seed = int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest())
+        x = np.random.default_rng(seed).standard_normal(self.dimension)
+        return (x / np.linalg.norm(x)).tolist()
+
+
+class FakeVectorStore:
+    """
+    Stand-in for a Pinecone index, adding the latency and rate limit of the
+    service to a local vector store.
+    """
+    def __init__(
+        self,
+        store: VectorStore,
+        latency: float = 0.05,
+        requests_per_second: float | None = None,
+    ):
+        self.store = store
+        self.latency = latency
+        self.limiter = RateLimiter(requests_per_second)
+
+    def upsert(self, vectors, namespace=None, **kwargs):
+        return self._call(self.store.upsert, vectors, namespace, **kwargs)
+
+    def query(self, **kwargs):
+        return self._call(self.store.query, **kwargs)
+
+    def delete(self, **kwargs):
+        return self._call(self.store.delete, **kwargs)
+
+    def describe_index_stats(self, **kwargs):
+        return self._call(self.store.describe_index_stats, **kwargs)
+
+    def _call(self, method, *args, **kwargs):
+        self.limiter.acquire()
+        time.sleep(self.latency)
+        return method(*args, **kwargs)
+
+
+class FakeLLMClient:
+    """
+    Stand-in for `MistralClient`. Responses are random text generated at
+    `tokens_per_second` after `time_to_first_token`.
+    """
+    def __init__(
+        self,
+        time_to_first_token: float = 0.3,
+        tokens_per_second: float = 100,
+        response_tokens: int = 100,
+        requests_per_second: float | None = None,
+    ):
+        self.time_to_first_token = time_to_first_token
+        self.tokens_per_second = tokens_per_second
+        self.response_tokens = response_tokens
+        self.limiter = RateLimiter(requests_per_second)
+        self.requests = 0
+
+    def chat(self, messages, model, temperature=None, safe_prompt=False, **kwargs):
+        tokens = list(self._generate(messages))
+        message = ChatMessage(role="assistant", content="".join(tokens))
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+    def chat_stream(self, messages, model, temperature=None, safe_prompt=False, **kwargs):
+        for token in self._generate(messages):
+            delta = SimpleNamespace(content=token)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+
+    def _generate(self, messages):
+        self.limiter.acquire()
+        self.requests += 1
+        rand = random.Random(messages[-1].content)
+        time.sleep(self.time_to_first_token)
+        for i in range(self.response_tokens):
+            if i:
+                time.sleep(1 / self.tokens_per_second)
+            yield (" " if i else "") + rand.choice(WORDS)
+
+
+def _sentences(rand: random.Random, n: int) -> str:
+    sentences = []
+    for _ in range(n):
+        words = rand.choices(WORDS, k=rand.randint(6, 24))
+        sentences.append(" ".join(words).capitalize() + ".")
+    return " ".join(sentences)
@@ -0,0 +1,372 @@
+"""
+Benchmarks of the indexing and chat paths, run offline against the local
+stand-ins of `benchmarks.fakes`. Every run saves a JSON report.
+
+    python -m benchmarks.suite index --posts 2000 --comments 5000
+    python -m benchmarks.suite index --trace-memory
+    python -m benchmarks.suite chat --requests 200 --concurrency 8
+    python -m benchmarks.suite startup --runs 5
+    python -m benchmarks.suite compare before.json after.json
+
+Peak RSS covers the whole process, so run one benchmark per process.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+import tracemalloc
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from dbbuilder import build_vector_database
+from dbbuilder.progress import BuildProgress
+from rag import WordPressRAG
+from vectorstore import LocalVectorStore
+from .fakes import (
+    FakeEmbedder, FakeLLMClient, FakeVectorStore, SyntheticWordPressSite, WORDS
+)
+
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Modules which only database builds need
+BUILD_MODULES = ["langchain_text_splitters", "tiktoken", "bs4"]
+
+# Run in a new interpreter by the startup benchmark
+_STARTUP_SCRIPT = """
+import sys, json, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.warm_up()
+warmed = time.perf_counter()
+print(json.dumps({
+    "import_seconds": imported - start,
+    "warm_up_seconds": warmed - imported,
+    "modules": sorted({name.split(".")[0] for name in sys.modules}),
+}))
+"""
+
+
+def benchmark_index(args: argparse.Namespace) -> dict:
+    "Build the database of a synthetic site."
+    embedder = FakeEmbedder(args.dimension, args.embed_latency,
+                            requests_per_second=args.embed_rps)
+    with tempfile.TemporaryDirectory() as tmpdir, SyntheticWordPressSite(
+        args.posts, args.pages, args.comments,
+        latency=args.wp_latency, seed=args.seed,
+    ) as site:
+        database = FakeVectorStore(LocalVectorStore(tmpdir), args.db_latency,
+                                   args.db_rps)
+        progress = BuildProgress()
+        if args.trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        build_vector_database(
+            site.url, new_text_splitter(args.splitter), embedder, database,
+            fetch_workers=args.fetch_workers,
+            extract_processes=args.extract_processes,
+            embed_workers=args.embed_workers,
+            upsert_workers=args.upsert_workers,
+            progress=progress,
+        )
+        seconds = time.perf_counter() - start
+        traced_peak = None
+        if args.trace_memory:
+            traced_peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        stats = database.describe_index_stats()
+
+    counts = progress.to_dict()
+    results = {
+        "seconds": seconds,
+        "documents": counts["documents_fetched"],
+        "chunks": counts["chunks_embedded"],
+        "vectors": sum(ns["vector_count"] for ns in stats["namespaces"].values()),
+        "documents_per_second": counts["documents_fetched"] / seconds,
+        "chunks_per_second": counts["chunks_embedded"] / seconds,
+        "stage_seconds": counts["stage_seconds"],
+        "wordpress_requests": site.requests,
+        "embedding_requests": embedder.requests,
+        "embedding_throttled_seconds": embedder.limiter.throttled_seconds,
+        "database_throttled_seconds": database.limiter.throttled_seconds,
+        "peak_rss_bytes": peak_rss_bytes(),
+    }
+    if traced_peak is not None:
+        # Python objects only, so it isn't skewed by the extraction processes
+        results["traced_peak_bytes"] = traced_peak
+        results["traced_peak_bytes_per_chunk"] = traced_peak / max(
+            1, counts["chunks_embedded"]
+        )
+    return results
+
+
+def benchmark_chat(args: argparse.Namespace) -> dict:
+    "Send chat requests to the chatbot, with a database of random chunks."
+    namespace = "www.example.com"
+    rand = random.Random(args.seed)
+    embedder = FakeEmbedder(args.dimension, args.embed_latency,
+                            requests_per_second=args.embed_rps)
+    llm = FakeLLMClient(args.llm_ttft, args.llm_tokens_per_second,
+                        args.llm_response_tokens, args.llm_rps)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        store = LocalVectorStore(tmpdir)
+        for i in range(0, args.chunks, 1000):
+            store.upsert([{
+                "id": f"posts/{j}#chunk0",
+                "values": embedder.embedding(str(j)),
+                "metadata": {"title": f"Post {j}", "text": _text(rand, 150),
+                             "link": f"https://{namespace}/post/{j}/"},
+            } for j in range(i, min(i + 1000, args.chunks))], namespace)
+        database = FakeVectorStore(store, args.db_latency, args.db_rps)
+        rag = WordPressRAG(llm, "open-mistral-7b", embedder, database)
+
+        chats = [_chat(rand, rand.randint(0, args.history_turns))
+                 for _ in range(args.requests)]
+
+        def request(chat: list[dict[str, str]]) -> tuple[float, float]:
+            start = time.perf_counter()
+            if not args.stream:
+                rag.generate(namespace, chat)
+                latency = time.perf_counter() - start
+                return latency, latency
+            first_token = None
+            for name, _ in rag.generate_stream(namespace, chat):
+                if name == "token" and first_token is None:
+                    first_token = time.perf_counter() - start
+            return time.perf_counter() - start, first_token
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.concurrency) as executor:
+            results = list(executor.map(request, chats))
+        seconds = time.perf_counter() - start
+
+    latencies = np.array([r[0] for r in results])
+    output = {
+        "seconds": seconds,
+        "requests_per_second": args.requests / seconds,
+        "latency_seconds": _percentiles(latencies),
+        "llm_requests": llm.requests,
+        "embedding_requests": embedder.requests,
+        "llm_throttled_seconds": llm.limiter.throttled_seconds,
+        "peak_rss_bytes": peak_rss_bytes(),
+    }
+    if args.stream:
+        output["time_to_first_token_seconds"] = _percentiles(
+            np.array([r[1] for r in results])
+        )
+    return output
+
+
+def benchmark_startup(args: argparse.Namespace) -> dict:
+    "Start the server's app in new processes, with a local vector store."
+    runs = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        env = os.environ | {
+            "PYTHONPATH": REPO_DIR, "VECTOR_STORE": "local",
+            "VOYAGE_API_KEY": "-", "MISTRAL_API_KEY": "-",
+            "PINECONE_API_KEY": "-", "AUTH_KEY": "-",
+        }
+        env.pop("WARM_UP", None)
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            # The app's files are created in the working directory
+            output = subprocess.run(
+                [sys.executable, "-c", _STARTUP_SCRIPT], cwd=tmpdir, env=env,
+                capture_output=True, text=True, check=True,
+            ).stdout
+            run = json.loads(output.splitlines()[-1])
+            run["process_seconds"] = time.perf_counter() - start
+            runs.append(run)
+
+    def median(key: str) -> float:
+        return float(np.median([run[key] for run in runs]))
+
+    return {
+        "import_seconds": median("import_seconds"),
+        "warm_up_seconds": median("warm_up_seconds"),
+        "process_seconds": median("process_seconds"),
+        "modules_loaded": len(runs[-1]["modules"]),
+        "build_modules_loaded": [m for m in BUILD_MODULES if m in runs[-1]["modules"]],
+        "peak_rss_bytes": peak_rss_bytes(),
+    }
+
+
+def compare(before_path: str, after_path: str) -> None:
+    "Print the results of two reports side by side."
+    with open(before_path) as f:
+        before = _flatten(json.load(f)["results"])
+    with open(after_path) as f:
+        after = _flatten(json.load(f)["results"])
+    for key in sorted(before.keys() | after.keys()):
+        a, b = before.get(key), after.get(key)
+        change = f"{(b - a) / a:+.1%}" if a and b is not None else ""
+        print(f"{key:<45} {_format(a):>14} {_format(b):>14} {change:>9}")
+
+
+def new_text_splitter(kind: str) -> RecursiveCharacterTextSplitter:
+    if kind == "tiktoken":
+        # Same as the server's, but the encoding must be downloaded once
+        return RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+            encoding_name="cl100k_base", chunk_size=200, chunk_overlap=40
+        )
+    # About 4 characters per token
+    return RecursiveCharacterTextSplitter(chunk_size=800, chunk_overlap=160)
+
+
+def peak_rss_bytes() -> int:
+    "Peak resident set size of this process plus that of its children."
+    rss = sum(resource.getrusage(who).ru_maxrss
+              for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN))
+    # Reported in kilobytes on Linux, in bytes on macOS
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def save_report(name: str, args: argparse.Namespace, results: dict) -> str:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+            text=True, cwd=os.path.dirname(__file__),
+        ).stdout.strip() or None
+    except OSError:
+        commit = None
+    now = datetime.now(timezone.utc)
+    report = {
+        "benchmark": name,
+        "created_at": now.isoformat(timespec="seconds"),
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "config": {k: v for k, v in vars(args).items()
+                   if k not in ("command", "output")},
+        "results": results,
+    }
+    path = args.output
+    if path is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f"{name}-{now:%Y%m%dT%H%M%S}.json")
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[1],
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def add_command(name: str, help: str) -> argparse.ArgumentParser:
+        command = commands.add_parser(
+            name, help=help, formatter_class=argparse.ArgumentDefaultsHelpFormatter
+        )
+        command.add_argument("--output", help="Path of the JSON report. "
+                             f"Defaults to a new file in {RESULTS_DIR}.")
+        command.add_argument("--seed", type=int, default=0)
+        command.add_argument("--dimension", type=int, default=1024)
+        command.add_argument("--embed-latency", type=float, default=0.1)
+        command.add_argument("--embed-rps", type=float, default=None,
+                             help="Rate limit of embedding requests per second.")
+        command.add_argument("--db-latency", type=float, default=0.05)
+        command.add_argument("--db-rps", type=float, default=None,
+                             help="Rate limit of database requests per second.")
+        return command
+
+    index = add_command("index", benchmark_index.__doc__)
+    index.add_argument("--posts", type=int, default=1000)
+    index.add_argument("--pages", type=int, default=50)
+    index.add_argument("--comments", type=int, default=2000)
+    index.add_argument("--wp-latency", type=float, default=0.05)
+    index.add_argument("--splitter", choices=["characters", "tiktoken"],
+                       default="characters")
+    index.add_argument("--fetch-workers", type=int, default=8)
+    index.add_argument("--extract-processes", type=int, default=None)
+    index.add_argument("--embed-workers", type=int, default=2)
+    index.add_argument("--upsert-workers", type=int, default=2)
+    index.add_argument("--trace-memory", action="store_true",
+                       help="Measure the peak memory of Python objects during "
+                       "the build. Makes it slower.")
+
+    chat = add_command("chat", benchmark_chat.__doc__)
+    chat.add_argument("--chunks", type=int, default=10_000)
+    chat.add_argument("--requests", type=int, default=100)
+    chat.add_argument("--concurrency", type=int, default=8)
+    chat.add_argument("--history-turns", type=int, default=10,
+                      help="Maximum number of previous turns of a chat.")
+    chat.add_argument("--stream", action="store_true")
+    chat.add_argument("--llm-ttft", type=float, default=0.3,
+                      help="Time to first token of the LLM.")
+    chat.add_argument("--llm-tokens-per-second", type=float, default=100)
+    chat.add_argument("--llm-response-tokens", type=int, default=100)
+    chat.add_argument("--llm-rps", type=float, default=None,
+                      help="Rate limit of LLM requests per second.")
+
+    startup = add_command("startup", benchmark_startup.__doc__)
+    startup.add_argument("--runs", type=int, default=5)
+
+    comparison = commands.add_parser("compare", help=compare.__doc__)
+    comparison.add_argument("before")
+    comparison.add_argument("after")
+
+    args = parser.parse_args()
+    if args.command == "compare":
+        compare(args.before, args.after)
+        return
+    benchmark = {
+        "index": benchmark_index, "chat": benchmark_chat, "startup": benchmark_startup,
+    }[args.command]
+    results = benchmark(args)
+    path = save_report(args.command, args, results)
+    print(json.dumps(results, indent=2))
+    print(f"Report saved to {path}")
+
+
+def _percentiles(values: np.ndarray) -> dict[str, float]:
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"p50": p50, "p95": p95, "p99": p99, "mean": float(values.mean()),
+            "max": float(values.max())}
+
+
+def _text(rand: random.Random, words: int) -> str:
+    return " ".join(rand.choices(WORDS, k=words))
+
+
+def _chat(rand: random.Random, turns: int) -> list[dict[str, str]]:
+    chat = [{"role": "system", "content": "You are an AI assistant who helps "
+             "users to get information from the current website."}]
+    for _ in range(turns):
+        chat.append({"role": "user", "content": _text(rand, rand.randint(5, 30)) + "?"})
+        chat.append({"role": "assistant", "content": _text(rand, rand.randint(20, 150))})
+    chat.append({"role": "user", "content": _text(rand, rand.randint(5, 30)) + "?"})
+    return chat
+
+
+def _flatten(results: dict, prefix: str = "") -> dict[str, float]:
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat |= _flatten(value, f"{prefix}{key}.")
+        elif isinstance(value, (int, float)):
+            flat[prefix + key] = value
+    return flat
+
+
+def _format(value: float | None) -> str:
+    if value is None:
+        return "-"
+    return f"{value:.4g}" if isinstance(value, float) else str(value)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""
+Build the database of a WordPress site offline, as a portable index bundle.
+The site's content is read from an export of the site (WXR), from saved
+responses of its REST API, or from the site itself. The bundle is then
+loaded into the vector store in one step.
+
+    python -m dbbuilder build export.xml --site-url https://www.example.com -o bundle
+    python -m dbbuilder build dumps/ --site-url https://www.example.com -o bundle
+    python -m dbbuilder build https://www.example.com -o bundle
+    python -m dbbuilder load bundle
+
+The Voyage API key and rate limits, the embedding cache, the vector store
+and the files of the server are configured with the same environment
+variables (or .env file) as the server.
+"""
+import os
+import sys
+import json
+import argparse
+import threading
+from urllib.parse import urlparse
+
+from dotenv import load_dotenv
+
+from . import build_vector_database, load_index_bundle
+from .build import EMBEDDING_MODEL, new_text_splitter
+from .cache import (
+    CachedEmbedder, LRUEmbeddingCache, SQLiteEmbeddingCache, TieredEmbeddingCache
+)
+from .checkpoint import BuildCheckpoint
+from .exports import read_rest_dumps, read_wxr
+from .progress import BuildProgress
+from .ratelimit import RateLimitedEmbedder, RateLimiter
+from .registry import NamespaceRegistry
+from .state import SyncState
+
+
+def build(args: argparse.Namespace) -> None:
+    "Build the index bundle of a site."
+    if args.source.startswith(("http://", "https://")):
+        site_url, documents = args.site_url or args.source, None
+    elif args.site_url is None:
+        sys.exit("--site-url is required to build from an export")
+    elif os.path.isdir(args.source):
+        site_url, documents = args.site_url, read_rest_dumps(args.source)
+    else:
+        site_url, documents = args.site_url, read_wxr(args.source)
+    namespace = urlparse(site_url).hostname
+    if not namespace:
+        sys.exit(f"'{site_url}' is not a url")
+
+    import voyageai
+    from rag.tokens import TokenCounter
+    from vectorstore import BundleWriter
+
+    embedder = CachedEmbedder(
+        RateLimitedEmbedder(voyageai.Client(os.environ["VOYAGE_API_KEY"]),
+                            RateLimiter(*(
+                                float(os.environ[key]) if os.environ.get(key) else None
+                                for key in ["VOYAGE_REQUESTS_PER_MINUTE",
+                                            "VOYAGE_TOKENS_PER_MINUTE"]
+                            ))),
+        TieredEmbeddingCache([
+            LRUEmbeddingCache(),
+            SQLiteEmbeddingCache(
+                os.environ.get("EMBEDDING_CACHE_PATH") or "embedding_cache.db"
+            ),
+        ]),
+    )
+    bundle = BundleWriter(args.output, namespace, {
+        "embedding_model": EMBEDDING_MODEL, "site_url": site_url,
+    })
+    # Saved in the bundle, to update the database incrementally once loaded
+    state = SyncState(os.path.join(args.output, "sync_state.db"))
+    state.clear(namespace)
+    progress = BuildProgress()
+    progress.start()
+    done = threading.Event()
+    reporter = threading.Thread(target=_report, args=(progress, done), daemon=True)
+    reporter.start()
+    try:
+        build_vector_database(
+            site_url,
+            new_text_splitter(),
+            embedder,
+            bundle,
+            extract_processes=args.extract_processes,
+            embed_workers=args.embed_workers,
+            state=state,
+            progress=progress,
+            count_tokens=TokenCounter().count_text,
+            documents=documents,
+        )
+    except BaseException as e:
+        progress.finish(e)
+        raise
+    else:
+        progress.finish()
+        bundle.close()
+    finally:
+        done.set()
+        reporter.join()
+    print(json.dumps(progress.to_dict(), indent=2))
+    print(f"Bundle of {bundle.count} vectors saved to {args.output}")
+
+
+def load(args: argparse.Namespace) -> None:
+    "Replace the database of a site with an index bundle."
+    from vectorstore import BM25Index, IndexBundle, LocalVectorStore
+
+    bundle = IndexBundle(args.bundle)
+    namespace = bundle.namespace
+    if (os.environ.get("VECTOR_STORE") or "pinecone") == "local":
+        database = LocalVectorStore(
+            os.environ.get("LOCAL_VECTOR_STORE_PATH") or "vector_store"
+        )
+    else:
+        from pinecone import Pinecone
+        database = Pinecone(os.environ["PINECONE_API_KEY"]).Index("wordpress-chatbot")
+    sparse_index = None
+    if os.environ.get("BM25_INDEX_PATH"):
+        sparse_index = BM25Index(os.environ["BM25_INDEX_PATH"])
+    registry = NamespaceRegistry(
+        database, os.environ.get("NAMESPACE_REGISTRY_PATH") or "namespaces.db"
+    )
+    state = SyncState(os.environ.get("SYNC_STATE_PATH") or "sync_state.db")
+
+    registry.start_build(namespace, bundle.manifest.get("embedding_model"))
+    try:
+        # The vectors of the previous build which the bundle doesn't replace
+        # are deleted once all of its vectors are upserted
+        load_index_bundle(bundle, database, state.documents(namespace).values(),
+                          sparse_index=sparse_index)
+    except BaseException:
+        registry.finish_build(namespace, succeeded=False)
+        raise
+
+    state.clear(namespace)
+    bundle_state = os.path.join(args.bundle, "sync_state.db")
+    if os.path.exists(bundle_state):
+        bundle_state = SyncState(bundle_state)
+        state.update(namespace, bundle_state.documents(namespace).values(),
+                     modified_after=bundle_state.modified_after(namespace))
+    BuildCheckpoint.remove(os.path.join(
+        os.environ.get("CHECKPOINT_DIR") or "checkpoints", f"{namespace}.jsonl"
+    ))
+    registry.finish_build(namespace, succeeded=True)
+    print(f"Loaded {len(bundle)} vectors into namespace '{namespace}'")
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(
+        prog="python -m dbbuilder", description=__doc__.splitlines()[1],
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build_command = commands.add_parser(
+        "build", help=build.__doc__,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    build_command.add_argument(
+        "source", help="WXR export file, directory of REST API responses "
+        "(JSON), or URL of the site."
+    )
+    build_command.add_argument(
+        "--site-url", help="URL of the site, naming its database. Required "
+        "for exports."
+    )
+    build_command.add_argument("-o", "--output", required=True,
+                               help="Directory of the bundle.")
+    build_command.add_argument("--extract-processes", type=int, default=None,
+                               help="Defaults to the number of CPUs.")
+    build_command.add_argument("--embed-workers", type=int, default=2)
+
+    load_command = commands.add_parser(
+        "load", help=load.__doc__,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    load_command.add_argument("bundle", help="Directory of the bundle.")
+
+    args = parser.parse_args()
+    {"build": build, "load": load}[args.command](args)
+
+
+def _report(progress: BuildProgress, done: threading.Event) -> None:
+    "Print the progress of a build every few seconds, until `done` is set."
+    while not done.wait(5):
+        counts = progress.to_dict()
+        print(f"{counts['documents_fetched']} documents, "
+              f"{counts['chunks_embedded']} chunks embedded", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,106 +1,618 @@
+import os
+import time
+import logging
+import hashlib
+import threading
+import multiprocessing
+from datetime import datetime, timedelta, timezone
 from urllib.parse import urlparse
-from collections.abc import Iterator
-from typing import TYPE_CHECKING
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, TypeVar
 
-from .utils import extract_text_from_html
-from .discover import find_api_root, supports_wp_v2
-from .data import fetch_wordpress_site_content
+import numpy as np
+
+from .utils import extract_texts_from_html
+from .discover import find_api_root, get_gmt_offset, supports_wp_v2
+from .data import PER_PAGE, fetch_wordpress_site_content, fetch_wordpress_site_ids
 from .exceptions import WordPressAPIException
+from .pipeline import Stage, run_pipeline
+from .state import DocumentState, SyncState
+from .checkpoint import BuildCheckpoint
+from .progress import BuildProgress
+from .metrics import BUILD_STAGE_SECONDS
+from .ratelimit import estimate_tokens
 
 if TYPE_CHECKING:
-    from langchain_text_splitters import TextSplitter
+    from langchain_text_splitters import RecursiveCharacterTextSplitter, TextSplitter
     import voyageai
-    from pinecone import Index
+    from vectorstore import BM25Index, IndexBundle, VectorStore
+
+
+EMBEDDING_MODEL = "voyage-large-2-instruct"
+# Limits of a request to the embedding API, in texts and tokens
+EMBEDDING_BATCH_SIZE = 128
+EMBEDDING_BATCH_TOKENS = 100_000
+# Limits of an upsert request to the vector database, in vectors and bytes
+UPSERT_BATCH_SIZE = 1000
+UPSERT_BATCH_BYTES = 2_000_000
+DELETE_BATCH_SIZE = 1000
+# Subtracted from the start of a build to get the date after which the next
+# build fetches modified items, for the clock skew with the site and changes
+# of its UTC offset (daylight saving time)
+MODIFIED_AFTER_MARGIN = timedelta(hours=2)
+
+_logger = logging.getLogger(__name__)
+T = TypeVar("T")
+
+# Pools of processes extracting text, by size, shared by all the builds
+_extract_pools: dict[int, ProcessPoolExecutor] = {}
+_extract_pools_lock = threading.Lock()
+
+
+def new_text_splitter() -> "RecursiveCharacterTextSplitter":
+    "Create the text splitter of the server's builds."
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    return RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+        encoding_name="cl100k_base", chunk_size=200, chunk_overlap=40
+    )
 
 
 def build_vector_database(
     site_url: str,
     splitter: "TextSplitter",
     embedder: "voyageai.Client",
-    database: "Index",
+    database: "VectorStore",
+    fetch_workers: int = 8,
+    extract_processes: int | None = None,
+    embed_workers: int = 2,
+    upsert_workers: int = 2,
+    queue_size: int = 8,
+    state: SyncState | None = None,
+    progress: BuildProgress | None = None,
+    max_retries: int = 4,
+    backoff: float = 1.0,
+    checkpoint: BuildCheckpoint | None = None,
+    sparse_index: "BM25Index | None" = None,
+    count_tokens: Callable[[str], int] | None = None,
+    documents: Iterable[dict[str, str]] | None = None,
 ) -> None:
     """
     Build vector database from WordPress site content.
 
+    Fetching, text extraction, splitting, embedding and uploading run as
+    concurrent stages connected by bounded queues, so memory use does not
+    grow with the size of the site.
+
+    If a `state` is given, the database is updated incrementally: only items
+    modified since the last build started are fetched, only chunks whose
+    text has changed are embedded again, and the vectors of chunks which no
+    longer exist are deleted.
+
+    Chunks are embedded in batches limited by their number of tokens as well
+    as of texts, and their vectors are upserted in batches small enough for
+    one request each. Every request is retried on failure, so an error only
+    costs the batch it happened in. Embeddings are kept as float32 arrays
+    until they are upserted.
+
+    If a `checkpoint` is given, the progress of the build is recorded in it,
+    and a build interrupted before it finished resumes from it: the pages of
+    documents already done are not fetched again, and the chunks already
+    embedded are not embedded again.
+
     Args:
         site_url: URL of the form 'https://www.example.com/'.
         splitter: A text splitter for chunking.
         embedder: A text embedder to generate embeddings.
         database: The database object to upload the data.
+        fetch_workers: Number of REST API requests sent concurrently.
+        extract_processes: Number of processes extracting text from HTML.
+            Defaults to the number of CPUs. If 0, text is extracted in
+            the current process. The processes are started with the first
+            build, and shared by the builds which follow.
+        embed_workers: Number of embedding requests sent concurrently.
+        upsert_workers: Number of upload requests sent concurrently.
+        queue_size: Maximum number of items waiting between two stages.
+        state: Record of what has already been indexed. It is updated
+            once the build succeeds.
+        progress: Counters updated as the build progresses.
+        max_retries: Retries of a failed embedding, upsert or delete request.
+        backoff: Delay (in seconds) before the first retry. It is doubled
+            after every retry.
+        checkpoint: Checkpoint of the build. It is cleared once the build
+            succeeds.
+        sparse_index: Full-text index of the chunks, for hybrid retrieval.
+            It is updated along with the database.
+        count_tokens: Tokenizer of the LLM, counting the tokens of a text.
+            If given, the number of tokens of every chunk is stored in its
+            metadata as "tokens", so that it isn't tokenized again to fit
+            the prompt.
+        documents: Items of the site, as yielded by
+            `fetch_wordpress_site_content`, e.g. read from an export with
+            `read_wxr`. If given, they are indexed instead of the items of
+            the site's REST API, and `site_url` only names the namespace.
+            They must be all the items of the site: those of the previous
+            build which aren't among them are removed.
     """
-    api_root: str = find_api_root(site_url)
-    if not supports_wp_v2(api_root):
-        raise WordPressAPIException(
-            "Site does not support core (wp/v2) endpoints."
+    site_domain = urlparse(site_url).hostname
+    if documents is None:
+        api_root: str = find_api_root(site_url)
+        if not supports_wp_v2(api_root):
+            raise WordPressAPIException(
+                "Site does not support core (wp/v2) endpoints."
+            )
+
+    if checkpoint is not None and checkpoint.committed:
+        # The last build finished, but didn't get to save its state
+        if state is not None:
+            state.update(site_domain, checkpoint.documents.values(),
+                         checkpoint.removed, checkpoint.next_modified_after)
+        checkpoint.clear()
+
+    previous: dict[str, DocumentState] = {}
+    removed: list[str] = []
+    modified_after = None
+    next_modified_after = None
+    if state is not None:
+        previous = state.documents(site_domain)
+        if documents is None:
+            # Items modified while this build runs are fetched by the next
+            # one. The REST API compares dates in the site's time zone.
+            site_time = datetime.now(timezone.utc).replace(tzinfo=None) \
+                + timedelta(hours=get_gmt_offset(api_root))
+            next_modified_after = _iso_date(site_time - MODIFIED_AFTER_MARGIN)
+    if previous and documents is None:
+        modified_after = state.modified_after(site_domain)
+        site_keys = set(fetch_wordpress_site_ids(api_root, fetch_workers))
+        removed = [key for key in previous if key not in site_keys]
+
+    start_pages: dict[str, int] = {}
+    if checkpoint is not None:
+        checkpoint.start(site_domain, modified_after, next_modified_after)
+        next_modified_after = checkpoint.next_modified_after
+        # Documents of the last page done move to it if others are deleted.
+        # Documents given are read from the start, skipping those done.
+        if documents is None:
+            start_pages = {content_type: max(1, page - 1)
+                           for content_type, page in checkpoint.cursors.items()}
+    tracker = _DocumentTracker(start_pages, checkpoint)
+
+    if progress is None:
+        progress = BuildProgress()
+    if documents is None:
+        site_contents: Iterable[dict[str, str]] = fetch_wordpress_site_content(
+            api_root, fetch_workers, modified_after=modified_after,
+            on_total=lambda n: progress.add("documents_total", n),
+            start_pages=start_pages,
         )
-    site_contents: Iterator[dict[str, str]] = fetch_wordpress_site_content(api_root)
+    else:
+        site_contents = documents
+    # Keys of the documents given, to find those removed, and the latest
+    # modification date of their pages and posts
+    read_keys: set[str] = set()
+    last_modified = ""
 
-    EMBEDDING_BATCH_SIZE = 128
-    site_domain = urlparse(site_url).hostname
-    chunk_dicts: list[dict] = []
-    for item in site_contents:
-        item["content"] = extract_text_from_html(item["content"])
-        # Extremely short comments are not helpful, hence removing them
-        if len(item["content"]) <= 200:
-            continue
-        chunks = splitter.split_text(item["content"])
-        chunk_dicts += _create_chunk_dicts(item, chunks)
-        if len(chunk_dicts) < EMBEDDING_BATCH_SIZE:
-            continue
-        _embed_and_upload(chunk_dicts[:EMBEDDING_BATCH_SIZE],
-                          embedder, database, site_domain)
-        chunk_dicts = chunk_dicts[EMBEDDING_BATCH_SIZE:]
-    if chunk_dicts:
-        _embed_and_upload(chunk_dicts, embedder, database, site_domain)
-
-
-def _create_chunk_dicts(item: dict[str, str], chunks: list[str]) -> list[dict]:
-    chunk_dicts: list[dict] = []
-    for i, chunk in enumerate(chunks):
-        chunk_dict = item.copy()
-        del chunk_dict["content"]
-        chunk_dict["chunk_idx"] = i
-        chunk_dict["chunk"] = chunk
-        chunk_dicts.append(chunk_dict)
-    return chunk_dicts
-
-
-def _embed_and_upload(
-    chunk_dicts: list[dict],
-    embedder: "voyageai.Client",
-    database: "Index",
-    namespace: str,
+    def changed_contents() -> Iterator[dict[str, str]]:
+        nonlocal last_modified
+        for item in site_contents:
+            progress.add("documents_fetched")
+            item["content_hash"] = _hash(
+                item["title"], item["link"], item["content"]
+            )
+            key = f"{item['type']}s/{item['id']}"
+            if documents is not None:
+                read_keys.add(key)
+                if item["type"] != "comment":
+                    last_modified = max(last_modified, item["modified"])
+            tracker.fetched(key)
+            old = previous.get(key)
+            if key in tracker.documents:
+                # Done before the build was interrupted
+                tracker.skip(key)
+            elif old is None or old.content_hash != item["content_hash"]:
+                yield item
+            else:
+                tracker.skip(key)
+
+    if extract_processes is None:
+        extract_processes = os.cpu_count() or 1
+    pool = _extract_pool(extract_processes) if extract_processes else None
+
+    def extract(items: Iterator[dict[str, str]]) -> Iterator[dict[str, str]]:
+        # Items wait here while their content is in the pool
+        pending: deque[dict[str, str]] = deque()
+
+        def contents() -> Iterator[str]:
+            for item in items:
+                pending.append(item)
+                yield item["content"]
+
+        texts = extract_texts_from_html(
+            contents(), pool, max_pending=2 * extract_processes
+        )
+        for text in texts:
+            item = pending.popleft()
+            item["content"] = text
+            yield item
+
+    def split(items: Iterator[dict[str, str]]) -> Iterator[list[_Chunk]]:
+        batch: list[_Chunk] = []
+        batch_tokens = 0
+        for item in items:
+            key = f"{item['type']}s/{item['id']}"
+            # Extremely short comments are not helpful, hence removing them
+            if len(item["content"]) > 200:
+                texts = splitter.split_text(item["content"])
+            else:
+                texts = []
+            chunks = [_Chunk(key, item["title"], item["link"], i, text)
+                      for i, text in enumerate(texts)]
+            chunk_hashes = [_hash(c.title, c.link, c.text) for c in chunks]
+
+            old_hashes = previous[key].chunk_hashes if key in previous else []
+            changed = [c for c in chunks if c.index >= len(old_hashes)
+                       or old_hashes[c.index] != chunk_hashes[c.index]]
+            tracker.split(DocumentState(key, item["modified"], item["content_hash"],
+                                        chunk_hashes), len(changed))
+            for chunk in changed:
+                tokens = estimate_tokens(_text_to_embed(chunk))
+                if batch and (len(batch) == EMBEDDING_BATCH_SIZE
+                              or batch_tokens + tokens > EMBEDDING_BATCH_TOKENS):
+                    yield batch
+                    batch, batch_tokens = [], 0
+                batch.append(chunk)
+                batch_tokens += tokens
+        if batch:
+            yield batch
+
+    def embed(
+        batches: Iterator[list[_Chunk]],
+    ) -> Iterator[tuple[list[_Chunk], np.ndarray]]:
+        for chunks in batches:
+            if count_tokens is not None:
+                for chunk in chunks:
+                    chunk.tokens = count_tokens(chunk.text)
+            staged: list[np.ndarray | None] = [None] * len(chunks)
+            if checkpoint is not None:
+                staged = [checkpoint.take_staged(c.id, c.metadata()) for c in chunks]
+            unembedded = [c for c, values in zip(chunks, staged) if values is None]
+            embedded = np.empty((0, 0), dtype=np.float32)
+            if unembedded:
+                embedded = _with_retries(lambda: _embed(unembedded, embedder),
+                                         max_retries, backoff)
+                if checkpoint is not None:
+                    checkpoint.stage([
+                        {"id": c.id, "values": values, "metadata": c.metadata()}
+                        for c, values in zip(unembedded, embedded)
+                    ])
+            if len(unembedded) == len(chunks):
+                values = embedded
+            else:
+                # Vectors staged before the build was interrupted
+                rows = iter(embedded)
+                values = np.stack([v if v is not None else next(rows) for v in staged])
+            progress.add("chunks_embedded", len(chunks))
+            # Upserted in parallel by the workers of the next stage
+            yield from _upsert_batches(chunks, values)
+
+    def upload(batches: Iterator[tuple[list[_Chunk], np.ndarray]]) -> Iterator[None]:
+        for chunks, values in batches:
+            # Lists of floats only now, as the database client needs them
+            data = _database_inputs(chunks, values)
+            _with_retries(lambda: database.upsert(data, site_domain),
+                          max_retries, backoff)
+            if sparse_index is not None:
+                sparse_index.upsert(data, site_domain)
+            tracker.upserted([d["id"] for d in data])
+            progress.add("vectors_upserted", len(data))
+        yield from ()
+
+    # Batches a failed build left in the pool are few (see `extract`), so
+    # they are left to finish rather than cancelled
+    try:
+        seconds = run_pipeline(changed_contents(), [
+            Stage(extract),
+            Stage(split),
+            Stage(embed, workers=embed_workers),
+            Stage(upload, workers=upsert_workers),
+        ], queue_size, _observe)
+    except BrokenProcessPool:
+        # A process of the pool died: the next build starts a new one
+        with _extract_pools_lock:
+            if _extract_pools.get(extract_processes) is pool:
+                del _extract_pools[extract_processes]
+        raise
+    for stage, s in seconds.items():
+        progress.add_seconds("fetch" if stage == "source" else stage, s)
+    if documents is not None:
+        removed = [key for key in previous if key not in read_keys]
+        if last_modified:
+            # The items given are a snapshot of the site taken after then
+            next_modified_after = _iso_date(
+                datetime.fromisoformat(last_modified) - MODIFIED_AFTER_MARGIN
+            )
+
+    start = time.perf_counter()
+    orphans = [f"{key}#chunk{i}" for key, doc in tracker.documents.items()
+               if key in previous
+               for i in range(len(doc.chunk_hashes), len(previous[key].chunk_hashes))]
+    for key in removed:
+        orphans.extend(f"{key}#chunk{i}"
+                       for i in range(len(previous[key].chunk_hashes)))
+    for i in range(0, len(orphans), DELETE_BATCH_SIZE):
+        batch_start = time.perf_counter()
+        _with_retries(lambda: database.delete(ids=orphans[i:i+DELETE_BATCH_SIZE],
+                                              namespace=site_domain),
+                      max_retries, backoff)
+        if sparse_index is not None:
+            sparse_index.delete(ids=orphans[i:i+DELETE_BATCH_SIZE],
+                                namespace=site_domain)
+        _observe("delete", time.perf_counter() - batch_start)
+        progress.add("vectors_deleted", len(orphans[i:i+DELETE_BATCH_SIZE]))
+    progress.add_seconds("delete", time.perf_counter() - start)
+    if checkpoint is not None:
+        checkpoint.commit(removed, next_modified_after)
+    if state is not None:
+        state.update(site_domain, tracker.documents.values(), removed,
+                     next_modified_after)
+    if checkpoint is not None:
+        checkpoint.clear()
+
+
+def load_index_bundle(
+    bundle: "IndexBundle",
+    database: "VectorStore",
+    previous: Iterable[DocumentState] = (),
+    sparse_index: "BM25Index | None" = None,
+    max_retries: int = 4,
+    backoff: float = 1.0,
 ) -> None:
+    """
+    Replace the vectors of the namespace of an index bundle with those of
+    the bundle.
+
+    The vectors of the bundle are upserted first, in batches which fit in
+    one request, each retried on failure. Only then are the vectors of the
+    previous documents which aren't in the bundle deleted, so a load that
+    fails part-way leaves the namespace usable, and can just be run again.
+
+    Args:
+        bundle: The index bundle.
+        database: The vector store.
+        previous: Documents indexed in the namespace, e.g. the documents of
+            its sync state. Vectors of documents not among them are kept.
+        sparse_index: Full-text index of the chunks, updated along with the
+            database.
+        max_retries: Retries of a failed upsert or delete request.
+        backoff: Delay (in seconds) before the first retry. It is doubled
+            after every retry.
+    """
+    namespace = bundle.namespace
+    for vectors in bundle.batches(UPSERT_BATCH_SIZE):
+        sizes = [_vector_size(bundle.dimension, sum(
+                     len(str(value)) for value in (v["metadata"] or {}).values()
+                 )) for v in vectors]
+        for start, end in _batch_ranges(sizes):
+            batch = vectors[start:end]
+            _with_retries(lambda: database.upsert(batch, namespace),
+                          max_retries, backoff)
+            if sparse_index is not None:
+                sparse_index.upsert(batch, namespace)
+
+    ids = set(bundle.ids)
+    orphans = [id for doc in previous
+               for id in (f"{doc.key}#chunk{i}" for i in range(len(doc.chunk_hashes)))
+               if id not in ids]
+    for i in range(0, len(orphans), DELETE_BATCH_SIZE):
+        _with_retries(lambda: database.delete(ids=orphans[i:i+DELETE_BATCH_SIZE],
+                                              namespace=namespace),
+                      max_retries, backoff)
+        if sparse_index is not None:
+            sparse_index.delete(ids=orphans[i:i+DELETE_BATCH_SIZE], namespace=namespace)
+
 
-    documents = _stack_chunks_to_embed(chunk_dicts)
+def _extract_pool(processes: int) -> ProcessPoolExecutor:
+    """
+    The pool of `processes` processes extracting text, started on first use.
+    Its processes are started by a fork server (or spawned, where there is
+    none) rather than forked from the server, whose other threads could
+    hold locks that the forked processes would never see released.
+    """
+    with _extract_pools_lock:
+        if processes not in _extract_pools:
+            methods = multiprocessing.get_all_start_methods()
+            method = "forkserver" if "forkserver" in methods else "spawn"
+            _extract_pools[processes] = ProcessPoolExecutor(
+                processes, mp_context=multiprocessing.get_context(method)
+            )
+        return _extract_pools[processes]
+
+
+class _DocumentTracker:
+    """
+    Tracks the documents of a build until their vectors are all upserted,
+    and the pages of every content type whose documents are all done. Both
+    are recorded in the checkpoint, if any.
+    """
+    def __init__(self, start_pages: dict[str, int], checkpoint: BuildCheckpoint | None):
+        self.checkpoint = checkpoint
+        self.documents: dict[str, DocumentState] = {}
+        self._pages: dict[str, int] = {}
+        if checkpoint is not None:
+            self.documents.update(checkpoint.documents)
+            self._pages.update(checkpoint.cursors)
+        self._start_pages = start_pages
+        # Position of the next document fetched, and of the first one not
+        # done, by content type
+        self._fetched: dict[str, int] = {}
+        self._first_pending: dict[str, int] = {}
+        self._done: dict[str, set[int]] = {}
+        self._positions: dict[str, tuple[str, int]] = {}
+        # Documents and their number of vectors not upserted yet
+        self._pending: dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def fetched(self, key: str) -> None:
+        content_type = key.split("/")[0]
+        with self._lock:
+            if content_type not in self._fetched:
+                start = (self._start_pages.get(content_type, 1) - 1) * PER_PAGE
+                self._fetched[content_type] = start
+                self._first_pending[content_type] = start
+                self._done[content_type] = set()
+            self._positions[key] = (content_type, self._fetched[content_type])
+            self._fetched[content_type] += 1
+
+    def skip(self, key: str) -> None:
+        "Mark a document with nothing to index as done."
+        with self._lock:
+            self._mark_done(key)
+
+    def split(self, document: DocumentState, vectors: int) -> None:
+        "Track a document until its `vectors` new vectors are upserted."
+        with self._lock:
+            if vectors:
+                self._pending[document.key] = [document, vectors]
+            else:
+                self._finish([document])
+
+    def upserted(self, ids: list[str]) -> None:
+        with self._lock:
+            finished = []
+            for id in ids:
+                pending = self._pending[id.split("#")[0]]
+                pending[1] -= 1
+                if pending[1] == 0:
+                    del self._pending[pending[0].key]
+                    finished.append(pending[0])
+            if finished:
+                self._finish(finished)
+
+    def _finish(self, documents: list[DocumentState]) -> None:
+        for document in documents:
+            self.documents[document.key] = document
+        # Recorded before the cursors move past them
+        if self.checkpoint is not None:
+            self.checkpoint.add_documents(documents)
+        for document in documents:
+            self._mark_done(document.key)
+
+    def _mark_done(self, key: str) -> None:
+        content_type, position = self._positions.pop(key)
+        done = self._done[content_type]
+        done.add(position)
+        first_pending = self._first_pending[content_type]
+        while first_pending in done:
+            done.remove(first_pending)
+            first_pending += 1
+        self._first_pending[content_type] = first_pending
+        page = first_pending // PER_PAGE + 1
+        if page > self._pages.get(content_type, 1):
+            self._pages[content_type] = page
+            if self.checkpoint is not None:
+                self.checkpoint.set_cursor(content_type, page)
+
+
+def _observe(stage: str, seconds: float) -> None:
+    BUILD_STAGE_SECONDS.labels("fetch" if stage == "source" else stage).observe(seconds)
+
+
+@dataclass(slots=True)
+class _Chunk:
+    """
+    A chunk of a document. The chunks of a document share its title and
+    link instead of copying them.
+    """
+    key: str
+    title: str
+    link: str
+    index: int
+    text: str
+    tokens: int | None = None
+
+    @property
+    def id(self) -> str:
+        return f"{self.key}#chunk{self.index}"
+
+    def metadata(self) -> dict:
+        metadata = {"title": self.title, "link": self.link, "text": self.text}
+        if self.tokens is not None:
+            metadata["tokens"] = self.tokens
+        return metadata
+
+
+def _embed(chunks: list[_Chunk], embedder: "voyageai.Client") -> np.ndarray:
     embeddings = embedder.embed(
-        documents, model="voyage-large-2-instruct", input_type="document"
+        [_text_to_embed(c) for c in chunks], model=EMBEDDING_MODEL,
+        input_type="document",
     ).embeddings
-    data = _create_database_inputs(chunk_dicts, embeddings)
-    database.upsert(data, namespace)
-
-
-def _stack_chunks_to_embed(chunk_dicts: list[dict]) -> list:
-    values = []
-    for d in chunk_dicts:
-        values.append(f"Title=[{d['title']}]\n{d['chunk']}")
-    return values
-
-
-def _create_database_inputs(
-    chunk_dicts: list[dict],
-    embeddings: list[list[float]],
-) -> list[dict]:
-
-    inputs: list[dict] = []
-    for ckd, embedding in zip(chunk_dicts, embeddings):
-        inputs.append({
-            "id": f"{ckd['type']}s/{ckd['id']}#chunk{ckd['chunk_idx']}",
-            "values": embedding,
-            "metadata": {
-                "title": ckd["title"],
-                "link": ckd["link"],
-                "text": ckd["chunk"],
-            },
-        })
-    return inputs
+    return np.asarray(embeddings, dtype=np.float32)
+
+
+def _text_to_embed(chunk: _Chunk) -> str:
+    return f"Title=[{chunk.title}]\n{chunk.text}"
+
+
+def _upsert_batches(
+    chunks: list[_Chunk],
+    values: np.ndarray,
+) -> Iterator[tuple[list[_Chunk], np.ndarray]]:
+    "Split embedded chunks into batches which fit in an upsert request."
+    sizes = [_vector_size(values.shape[1], len(c.title) + len(c.link) + len(c.text))
+             for c in chunks]
+    for start, end in _batch_ranges(sizes):
+        yield chunks[start:end], values[start:end]
+
+
+def _vector_size(dimension: int, metadata_length: int) -> int:
+    "Size of a vector in JSON, with up to 24 characters per value."
+    return 24 * dimension + 100 + 2 * metadata_length
+
+
+def _batch_ranges(sizes: list[int]) -> Iterator[tuple[int, int]]:
+    "Split items of the given sizes (in bytes) into ranges which fit in an upsert request."
+    start = 0
+    batch_bytes = 0
+    for i, size in enumerate(sizes):
+        if i > start and (i - start == UPSERT_BATCH_SIZE
+                          or batch_bytes + size > UPSERT_BATCH_BYTES):
+            yield start, i
+            start, batch_bytes = i, 0
+        batch_bytes += size
+    if start < len(sizes):
+        yield start, len(sizes)
+
+
+def _with_retries(func: Callable[[], T], max_retries: int, backoff: float) -> T:
+    "Call `func`, retrying with exponential backoff if it raises an error."
+    for attempt in range(max_retries + 1):
+        try:
+            return func()
+        except Exception as e:
+            if attempt == max_retries:
+                raise
+            delay = backoff * 2**attempt
+            _logger.warning("Request failed (%s: %s), retrying in %.1f s",
+                            type(e).__name__, e, delay)
+            time.sleep(delay)
+
+
+def _database_inputs(chunks: list[_Chunk], values: np.ndarray) -> list[dict]:
+    return [{"id": c.id, "values": v, "metadata": c.metadata()}
+            for c, v in zip(chunks, values.tolist())]
+
+
+def _iso_date(date: datetime) -> str:
+    "Format a date as the REST API does, e.g. '2024-01-01T12:00:00'."
+    return date.strftime("%Y-%m-%dT%H:%M:%S")
+
+
+def _hash(*texts: str) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    for text in texts:
+        h.update(text.encode())
+        h.update(b"\0")
+    return h.hexdigest()
@@ -0,0 +1,246 @@
+import abc
+import time
+import hashlib
+import sqlite3
+import threading
+from array import array
+from collections import OrderedDict
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import voyageai
+
+
+class EmbeddingCache(abc.ABC):
+    """
+    Base class of embedding caches. Embeddings are stored as float32 and
+    looked up by keys created with `embedding_key`.
+    """
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get_many(self, keys: list[str]) -> dict[str, list[float]]:
+        "Get the cached embeddings of the keys which are present."
+        found = self._get_many(keys)
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items: dict[str, list[float]]) -> None:
+        "Add embeddings to the cache, evicting old ones if it is full."
+        self._put_many({k: array("f", v).tobytes() for k, v in items.items()})
+
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
+
+    @abc.abstractmethod
+    def _get_many(self, keys: list[str]) -> dict[str, list[float]]:
+        "Get the embeddings of the keys which are present."
+
+    @abc.abstractmethod
+    def _put_many(self, items: dict[str, bytes]) -> None:
+        "Store embeddings serialized as float32."
+
+
+class LRUEmbeddingCache(EmbeddingCache):
+    "In-process cache evicting the least recently used embeddings."
+
+    def __init__(self, max_bytes: int = 64 * 2**20):
+        """
+        Args:
+            max_bytes: Maximum total size of the cached embeddings.
+        """
+        super().__init__()
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._data: OrderedDict[str, bytes] = OrderedDict()
+
+    def _get_many(self, keys: list[str]) -> dict[str, list[float]]:
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._data:
+                    self._data.move_to_end(key)
+                    found[key] = _to_list(self._data[key])
+        return found
+
+    def _put_many(self, items: dict[str, bytes]) -> None:
+        with self._lock:
+            for key, value in items.items():
+                if key in self._data:
+                    self.size -= len(self._data.pop(key))
+                self._data[key] = value
+                self.size += len(value)
+            while self.size > self.max_bytes and self._data:
+                _, value = self._data.popitem(last=False)
+                self.size -= len(value)
+
+    def stats(self) -> dict[str, int]:
+        return super().stats() | {"entries": len(self._data), "bytes": self.size}
+
+
+class SQLiteEmbeddingCache(EmbeddingCache):
+    """
+    Persistent cache stored in a SQLite database, evicting the least
+    recently used embeddings.
+    """
+    def __init__(self, path: str, max_bytes: int = 2**30):
+        """
+        Args:
+            path: Path of the SQLite database file.
+            max_bytes: Maximum total size of the cached embeddings.
+        """
+        super().__init__()
+        self.max_bytes = max_bytes
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " key TEXT PRIMARY KEY,"
+                " value BLOB NOT NULL,"
+                " last_used REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS embeddings_last_used"
+                " ON embeddings (last_used)"
+            )
+            self.size = self._conn.execute(
+                "SELECT COALESCE(SUM(LENGTH(value)), 0) FROM embeddings"
+            ).fetchone()[0]
+
+    def _get_many(self, keys: list[str]) -> dict[str, list[float]]:
+        found = {}
+        with self._lock, self._conn:
+            # Stay well under SQLite's limit on the number of parameters
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i+500]
+                rows = self._conn.execute(
+                    "SELECT key, value FROM embeddings WHERE key IN "
+                    f"({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                found.update((key, _to_list(value)) for key, value in rows)
+            now = time.time()
+            self._conn.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                ((now, key) for key in found)
+            )
+        return found
+
+    def _put_many(self, items: dict[str, bytes]) -> None:
+        now = time.time()
+        with self._lock, self._conn:
+            for key, value in items.items():
+                row = self._conn.execute(
+                    "SELECT LENGTH(value) FROM embeddings WHERE key = ?", (key,)
+                ).fetchone()
+                self.size += len(value) - (row[0] if row else 0)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)",
+                    (key, value, now)
+                )
+            if self.size <= self.max_bytes:
+                return
+            evicted = []
+            rows = self._conn.execute(
+                "SELECT key, LENGTH(value) FROM embeddings ORDER BY last_used"
+            )
+            for key, size in rows:
+                if self.size <= self.max_bytes:
+                    break
+                evicted.append((key,))
+                self.size -= size
+            self._conn.executemany("DELETE FROM embeddings WHERE key = ?", evicted)
+
+    def stats(self) -> dict[str, int]:
+        return super().stats() | {"bytes": self.size}
+
+
+class TieredEmbeddingCache(EmbeddingCache):
+    """
+    Combines caches, from the fastest to the slowest. Embeddings found in a
+    slower tier are copied into the faster ones.
+    """
+    def __init__(self, tiers: list[EmbeddingCache]):
+        super().__init__()
+        self.tiers = tiers
+
+    def _get_many(self, keys: list[str]) -> dict[str, list[float]]:
+        found: dict[str, list[float]] = {}
+        for i, tier in enumerate(self.tiers):
+            missing = [k for k in keys if k not in found]
+            if not missing:
+                break
+            tier_found = tier.get_many(missing)
+            for faster_tier in self.tiers[:i]:
+                faster_tier.put_many(tier_found)
+            found.update(tier_found)
+        return found
+
+    def _put_many(self, items: dict[str, bytes]) -> None:
+        for tier in self.tiers:
+            tier._put_many(items)
+
+    def stats(self) -> dict[str, int]:
+        stats = super().stats()
+        for i, tier in enumerate(self.tiers):
+            stats |= {f"tier{i}_{k}": v for k, v in tier.stats().items()}
+        return stats
+
+
+class CachedEmbedder:
+    """
+    Wraps a text embedder so that only texts missing from the cache are sent
+    to it. It can be used in place of a `voyageai.Client`.
+    """
+    class Embeddings:
+        def __init__(self, embeddings: list[list[float]]):
+            self.embeddings = embeddings
+
+    def __init__(self, embedder: "voyageai.Client", cache: EmbeddingCache):
+        """
+        Args:
+            embedder: The text embedder to wrap.
+            cache: Cache storing the embeddings.
+        """
+        self.embedder = embedder
+        self.cache = cache
+
+    def embed(
+        self,
+        texts: list[str],
+        model: str,
+        input_type: str | None = None,
+        **kwargs,
+    ) -> Embeddings:
+        keys = [embedding_key(model, input_type, text) for text in texts]
+        found = self.cache.get_many(keys)
+
+        missing: dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing[key] = text
+        if missing:
+            embeddings = self.embedder.embed(
+                list(missing.values()), model=model,
+                input_type=input_type, **kwargs
+            ).embeddings
+            new = dict(zip(missing.keys(), embeddings))
+            self.cache.put_many(new)
+            found.update(new)
+
+        return CachedEmbedder.Embeddings([found[key] for key in keys])
+
+
+def embedding_key(model: str, input_type: str | None, text: str) -> str:
+    "Create the cache key of the embedding of a text."
+    h = hashlib.sha256(text.encode()).hexdigest()
+    return f"{model}:{input_type}:{h}"
+
+
+def _to_list(value: bytes) -> list[float]:
+    embedding = array("f")
+    embedding.frombytes(value)
+    return embedding.tolist()
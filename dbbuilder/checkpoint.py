@@ -0,0 +1,229 @@
+import os
+import json
+import base64
+import threading
+
+import numpy as np
+
+from .state import DocumentState
+
+
+_COMMIT = b'{"commit":true}\n'
+
+
+class BuildCheckpoint:
+    """
+    Append-only record of the progress of a database build, from which the
+    build resumes if it is interrupted.
+
+    Every line of the file is a JSON record, one of:
+        {"start": {"namespace": ..., "modified_after": ...,
+                   "next_modified_after": ...}}
+        {"cursor": [content_type, page]}: The documents of the pages of the
+            content type before this page are done.
+        {"vectors": [[id, values, metadata], ...]}: Embedded chunks, staged
+            until their documents are done. Values are float32 in base64.
+        {"done": [[key, modified, content_hash, chunk_hashes], ...]}:
+            Documents whose vectors are all upserted.
+        {"removed": [key, ...], "next_modified_after": ...}: Documents
+            deleted from the site, and the date after which the next build
+            fetches modified items.
+        {"commit": true}: The build finished. Only then is the namespace
+            complete.
+
+    Records are flushed as they are written, so they survive a crash of the
+    process. A partially written last line is discarded when loading.
+    """
+    def __init__(self, path: str):
+        """
+        Args:
+            path: Path of the checkpoint file. It is loaded if it exists,
+                and compacted unless it is committed.
+        """
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()
+        self._reset()
+        if os.path.exists(path):
+            self._load()
+            if not self.committed:
+                self._compact()
+
+    @property
+    def started(self) -> bool:
+        return self.namespace is not None
+
+    @staticmethod
+    def is_pending(path: str) -> bool:
+        "Whether the checkpoint file at `path` is of a build which didn't finish."
+        try:
+            with open(path, "rb") as f:
+                f.seek(max(0, os.path.getsize(path) - len(_COMMIT)))
+                return f.read() != _COMMIT
+        except FileNotFoundError:
+            return False
+
+    @staticmethod
+    def remove(path: str) -> None:
+        "Delete the checkpoint file at `path`, if any."
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def start(
+        self,
+        namespace: str,
+        modified_after: str | None,
+        next_modified_after: str | None = None,
+    ) -> None:
+        """
+        Begin a build, unless this checkpoint already has one to resume. The
+        `next_modified_after` of a resumed build is that of its start.
+        """
+        if self.started:
+            if namespace != self.namespace:
+                raise ValueError(f"Checkpoint '{self.path}' is of a build for "
+                                 f"'{self.namespace}', not '{namespace}'")
+            return
+        self.namespace = namespace
+        self.modified_after = modified_after
+        self.next_modified_after = next_modified_after
+        self._write({"start": {"namespace": namespace,
+                               "modified_after": modified_after,
+                               "next_modified_after": next_modified_after}})
+
+    def set_cursor(self, content_type: str, page: int) -> None:
+        self.cursors[content_type] = page
+        self._write({"cursor": [content_type, page]})
+
+    def stage(self, vectors: list[dict]) -> None:
+        "Record embedded chunks, so that they aren't embedded again."
+        self._write({"vectors": [_encode_vector(v) for v in vectors]})
+
+    def take_staged(self, id: str, metadata: dict) -> np.ndarray | None:
+        """
+        Get the values of a vector staged by the interrupted build, if its
+        metadata hasn't changed since.
+        """
+        with self._lock:
+            vector = self._staged.get(id.split("#")[0], {}).pop(id, None)
+        if vector is None or vector["metadata"] != metadata:
+            return None
+        return vector["values"]
+
+    def add_documents(self, documents: list[DocumentState]) -> None:
+        "Record documents whose vectors are all upserted."
+        for d in documents:
+            self.documents[d.key] = d
+        self._write({"done": [
+            [d.key, d.modified, d.content_hash, d.chunk_hashes] for d in documents
+        ]})
+
+    def commit(self, removed: list[str], next_modified_after: str | None = None) -> None:
+        "Mark the build as finished."
+        self.removed = removed
+        self.next_modified_after = next_modified_after
+        self._write({"removed": removed, "next_modified_after": next_modified_after})
+        with self._lock:
+            self._file.write(_COMMIT)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        self.committed = True
+
+    def clear(self) -> None:
+        "Delete the checkpoint, to start a new build."
+        self.close()
+        BuildCheckpoint.remove(self.path)
+        self._reset()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _reset(self) -> None:
+        self.namespace: str | None = None
+        self.modified_after: str | None = None
+        self.next_modified_after: str | None = None
+        self.cursors: dict[str, int] = {}
+        self.documents: dict[str, DocumentState] = {}
+        self.removed: list[str] = []
+        self.committed = False
+        # Staged vectors by document key, then by ID
+        self._staged: dict[str, dict[str, dict]] = {}
+
+    def _write(self, record: dict) -> None:
+        line = json.dumps(record, separators=(",", ":")).encode() + b"\n"
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, "ab")
+            self._file.write(line)
+            self._file.flush()
+
+    def _load(self) -> None:
+        with open(self.path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                self._apply(json.loads(line))
+
+    def _apply(self, record: dict) -> None:
+        if "start" in record:
+            self.namespace = record["start"]["namespace"]
+            self.modified_after = record["start"]["modified_after"]
+            self.next_modified_after = record["start"].get("next_modified_after")
+        elif "cursor" in record:
+            content_type, page = record["cursor"]
+            self.cursors[content_type] = page
+        elif "vectors" in record:
+            for id, values, metadata in record["vectors"]:
+                self._staged.setdefault(id.split("#")[0], {})[id] = {
+                    "id": id, "values": _decode_values(values), "metadata": metadata,
+                }
+        elif "done" in record:
+            for key, modified, content_hash, chunk_hashes in record["done"]:
+                self.documents[key] = DocumentState(
+                    key, modified, content_hash, chunk_hashes
+                )
+                # The vectors of done documents are already upserted
+                self._staged.pop(key, None)
+        elif "removed" in record:
+            self.removed = record["removed"]
+            self.next_modified_after = record.get("next_modified_after")
+        elif "commit" in record:
+            self.committed = True
+
+    def _compact(self) -> None:
+        "Rewrite the file with only the records still needed to resume."
+        records: list[dict] = []
+        if self.started:
+            records.append({"start": {"namespace": self.namespace,
+                                      "modified_after": self.modified_after,
+                                      "next_modified_after": self.next_modified_after}})
+        records.extend({"cursor": list(c)} for c in self.cursors.items())
+        if self.documents:
+            records.append({"done": [
+                [d.key, d.modified, d.content_hash, d.chunk_hashes]
+                for d in self.documents.values()
+            ]})
+        for vectors in self._staged.values():
+            records.append({"vectors": [_encode_vector(v) for v in vectors.values()]})
+
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            for record in records:
+                f.write(json.dumps(record, separators=(",", ":")).encode() + b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+
+def _encode_vector(vector: dict) -> list:
+    values = np.asarray(vector["values"], dtype="<f4").tobytes()
+    return [vector["id"], base64.b64encode(values).decode(), vector["metadata"]]
+
+
+def _decode_values(values: str) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(values), dtype="<f4")
@@ -0,0 +1,38 @@
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+SHARED_SESSION_CONNECTIONS = 16
+
+_shared_session: requests.Session | None = None
+_lock = threading.Lock()
+
+
+def new_session(
+    max_connections: int = 10,
+    max_hosts: int = 100,
+    max_retries: int = 0,
+) -> requests.Session:
+    """
+    Create a session keeping connections alive, with a pool of up to
+    `max_connections` connections for each of the last `max_hosts` hosts.
+    More connections are opened if needed, but they aren't kept. Failed
+    connections are retried up to `max_retries` times.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=max_hosts, pool_maxsize=max_connections,
+                          max_retries=max_retries)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def shared_session() -> requests.Session:
+    "Session shared by all the requests of this process to WordPress sites."
+    global _shared_session
+    with _lock:
+        if _shared_session is None:
+            _shared_session = new_session(SHARED_SESSION_CONNECTIONS)
+        return _shared_session
@@ -1,29 +1,185 @@
+import time
 from urllib.parse import urljoin
-from collections.abc import Iterator
+from collections import deque
+from collections.abc import Callable, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
 
 import requests
 
+from .connections import shared_session
 
-def fetch_wordpress_site_content(api_root: str) -> Iterator[dict[str, str]]:
-    """Fetches and yields all the content of a Wordpress site."""
-    content_types = ["pages", "posts", "comments"]
-    for content_type in content_types:
-        route = urljoin(api_root, f"wp/v2/{content_type}/")
-        res = requests.get(route, {"per_page": 100, "page": 1})
-        total_pages = int(res.headers["X-WP-TotalPages"])
-        for i in range(1, total_pages+1):
-            if i != 1:
-               res = requests.get(route, {"per_page": 100, "page": i})
-            res_json = res.json()
 
+CONTENT_TYPES = ["pages", "posts", "comments"]
+PER_PAGE = 100
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def fetch_wordpress_site_content(
+    api_root: str,
+    max_workers: int = 8,
+    max_retries: int = 4,
+    backoff: float = 0.5,
+    session: requests.Session | None = None,
+    modified_after: str | None = None,
+    on_total: Callable[[int], None] | None = None,
+    start_pages: dict[str, int] | None = None,
+) -> Iterator[dict[str, str]]:
+    """
+    Fetches and yields all the content of a Wordpress site.
+
+    Pages of all content types are requested concurrently, but items are
+    always yielded in the same order: pages, posts and then comments, each
+    in the order of the REST API's pagination.
+
+    Args:
+        api_root: The WordPress REST API root route.
+        max_workers: Maximum number of requests in flight at once.
+        max_retries: Retries for a page which receives a 429 or 5xx response.
+        backoff: Delay (in seconds) before the first retry. It is doubled
+            after every retry. A 'Retry-After' header takes precedence.
+        session: Session used to send the requests. Defaults to the session
+            shared by the process, which keeps connections alive.
+        modified_after: ISO 8601 date in the site's time zone, as the REST
+            API compares it to the local modification date of the items. If
+            given, only pages and posts modified after it are fetched.
+            Comments cannot be filtered by modification date, so all of them
+            are always fetched.
+        on_total: Called with the total number of items of each content
+            type, as reported by the API.
+        start_pages: Page of every content type (e.g. 'posts') to start
+            from, to resume an interrupted fetch. Defaults to the first.
+            A page past the last one yields no items.
+    """
+    params: dict[str, dict[str, str]] = {t: {} for t in CONTENT_TYPES}
+    if modified_after is not None:
+        params["pages"]["modified_after"] = modified_after
+        params["posts"]["modified_after"] = modified_after
+
+    for content_type, item in _fetch_items(
+        api_root, params, max_workers, max_retries, backoff, session, on_total,
+        start_pages or {},
+    ):
+        yield _parse_item(content_type, item)
+
+
+def fetch_wordpress_site_ids(
+    api_root: str,
+    max_workers: int = 8,
+    max_retries: int = 4,
+    backoff: float = 0.5,
+    session: requests.Session | None = None,
+) -> Iterator[str]:
+    """
+    Fetches and yields the keys of all the items of a Wordpress site, in
+    the form '{type}s/{id}'. Only the IDs are requested from the API, which
+    makes this much cheaper than fetching the content.
+    """
+    params = {t: {"_fields": "id"} for t in CONTENT_TYPES}
+    for content_type, item in _fetch_items(
+        api_root, params, max_workers, max_retries, backoff, session
+    ):
+        yield f"{content_type}/{item['id']}"
+
+
+def _fetch_items(
+    api_root: str,
+    params: dict[str, dict[str, str]],
+    max_workers: int,
+    max_retries: int,
+    backoff: float,
+    session: requests.Session | None,
+    on_total: Callable[[int], None] | None = None,
+    start_pages: dict[str, int] | None = None,
+) -> Iterator[tuple[str, dict]]:
+
+    if session is None:
+        session = shared_session()
+
+    def get_page(content_type: str, route: str, page: int) -> requests.Response:
+        page_params = {**params[content_type], "per_page": PER_PAGE, "page": page}
+        return _get_page(session, route, page_params, max_retries, backoff)
+
+    def get_first_page(
+        content_type: str, route: str, page: int
+    ) -> requests.Response | None:
+        try:
+            return get_page(content_type, route, page)
+        except requests.HTTPError as e:
+            # WordPress answers 400 to a page past the last one
+            if page > 1 and e.response.status_code == 400:
+                return None
+            raise
+
+    with ThreadPoolExecutor(max_workers) as executor:
+        first_pages = []
+        for content_type in CONTENT_TYPES:
+            route = urljoin(api_root, f"wp/v2/{content_type}/")
+            start = (start_pages or {}).get(content_type, 1)
+            first_page = executor.submit(get_first_page, content_type, route, start)
+            first_pages.append((content_type, route, start, first_page))
+
+        def page_futures() -> Iterator[tuple[str, Future]]:
+            for content_type, route, start, first_page in first_pages:
+                yield content_type, first_page
+                if first_page.result() is None:
+                    continue
+                headers = first_page.result().headers
+                if on_total is not None and "X-WP-Total" in headers:
+                    on_total(int(headers["X-WP-Total"]))
+                total_pages = int(headers["X-WP-TotalPages"])
+                for i in range(start+1, total_pages+1):
+                    yield content_type, executor.submit(
+                        get_page, content_type, route, i
+                    )
+
+        # Only a bounded window of pages is requested ahead of the consumer.
+        futures = page_futures()
+        window: deque[tuple[str, Future]] = deque()
+        for _ in range(max_workers):
+            if (nxt := next(futures, None)) is None:
+                break
+            window.append(nxt)
+
+        while window:
+            content_type, future = window.popleft()
+            res = future.result()
+            res_json = res.json() if res is not None else []
+            if (nxt := next(futures, None)) is not None:
+                window.append(nxt)
             for item in res_json:
-                if content_type == "comments":
-                    item["title"] = {"rendered": "Comment"}
-
-                yield {
-                    "id": str(item["id"]),
-                    "type" : item["type"],
-                    "title": item["title"]["rendered"],
-                    "link" : item["link"],
-                    "content": item["content"]["rendered"],
-                }
+                yield content_type, item
+
+
+def _get_page(
+    session: requests.Session,
+    route: str,
+    params: dict,
+    max_retries: int,
+    backoff: float,
+) -> requests.Response:
+
+    for attempt in range(max_retries+1):
+        res = session.get(route, params=params)
+        if res.status_code not in RETRY_STATUSES or attempt == max_retries:
+            break
+        retry_after = res.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            time.sleep(int(retry_after))
+        else:
+            time.sleep(backoff * 2**attempt)
+    res.raise_for_status()
+    return res
+
+
+def _parse_item(content_type: str, item: dict) -> dict[str, str]:
+    if content_type == "comments":
+        item["title"] = {"rendered": "Comment"}
+
+    return {
+        "id": str(item["id"]),
+        "type" : item["type"],
+        "title": item["title"]["rendered"],
+        "link" : item["link"],
+        "content": item["content"]["rendered"],
+        "modified": item.get("modified", item.get("date", "")),
+    }
@@ -1,16 +1,25 @@
 import requests
 
+from .connections import shared_session
 
-def find_api_root(site_url: str) -> str:
+
+def find_api_root(site_url: str, session: requests.Session | None = None) -> str:
     """Find the WordPress REST API root route for a given website."""
-    res = requests.get(site_url)
+    res = (session or shared_session()).get(site_url)
     res.raise_for_status()
     return res.links["https://api.w.org/"]['url']
 
 
-def supports_wp_v2(api_root: str) -> bool:
+def supports_wp_v2(api_root: str, session: requests.Session | None = None) -> bool:
     """Check if the API supports core (wp/v2) endpoints."""
-    res = requests.get(api_root)
+    res = (session or shared_session()).get(api_root)
     res.raise_for_status()
     res = res.json()
     return "wp/v2" in res["namespaces"]
+
+
+def get_gmt_offset(api_root: str, session: requests.Session | None = None) -> float:
+    """Get the offset of the site's time zone from UTC, in hours."""
+    res = (session or shared_session()).get(api_root)
+    res.raise_for_status()
+    return float(res.json().get("gmt_offset") or 0)
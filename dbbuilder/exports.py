@@ -0,0 +1,113 @@
+import os
+import json
+from collections.abc import Iterator
+from xml.etree.ElementTree import Element, iterparse
+
+from .data import _parse_item
+
+
+CONTENT_NAMESPACE = "http://purl.org/rss/1.0/modules/content/"
+# Followed by the version of the WXR format, e.g. '1.2/'
+WXR_NAMESPACE = "http://wordpress.org/export/"
+# Types of the items of the REST API endpoints which are indexed
+REST_TYPES = {"page": "pages", "post": "posts", "comment": "comments"}
+
+
+def read_wxr(path: str) -> Iterator[dict[str, str]]:
+    """
+    Read the items of a site from a WordPress export (WXR) file, as
+    `fetch_wordpress_site_content` yields those of its REST API: its
+    published pages and posts, each followed by its approved comments.
+
+    The file is parsed as a stream and every item is discarded once read,
+    so memory use does not grow with the size of the export.
+    """
+    depth = 0
+    channel: Element | None = None
+    for event, elem in iterparse(path, events=("start", "end")):
+        if event == "start":
+            depth += 1
+            if depth == 2:
+                channel = elem
+            continue
+        depth -= 1
+        # Children of the channel: items, authors, terms...
+        if depth == 2:
+            if elem.tag == "item":
+                yield from _parse_wxr_item(elem)
+            channel.remove(elem)
+
+
+def read_rest_dumps(directory: str) -> Iterator[dict[str, str]]:
+    """
+    Read the items of a site from responses of its REST API saved in a
+    directory, e.g. 'posts-1.json' from '/wp/v2/posts?page=1'. Every '.json'
+    file is a list of items, or a single item, of the pages, posts or
+    comments endpoints; items of other types are skipped. Files are read one
+    at a time, in the order of their names.
+    """
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(".json"):
+            continue
+        with open(os.path.join(directory, name)) as f:
+            items = json.load(f)
+        if isinstance(items, dict):
+            items = [items]
+        for item in items:
+            content_type = REST_TYPES.get(item.get("type"))
+            if content_type is not None:
+                yield _parse_item(content_type, item)
+
+
+def _parse_wxr_item(item: Element) -> Iterator[dict[str, str]]:
+    fields: dict[str, str] = {}
+    comments: list[dict[str, str]] = []
+    for child in item:
+        name = _qualified_name(child.tag)
+        if name == "wp:comment":
+            comments.append({_qualified_name(c.tag): c.text or "" for c in child})
+        else:
+            fields[name] = child.text or ""
+
+    # The REST API only lists published content
+    if fields.get("wp:post_type") not in ("page", "post") \
+            or fields.get("wp:status") != "publish":
+        return
+    yield {
+        "id": fields["wp:post_id"],
+        "type": fields["wp:post_type"],
+        "title": fields.get("title", ""),
+        "link": fields.get("link", ""),
+        "content": fields.get("content:encoded", ""),
+        "modified": _iso_date(fields.get("wp:post_modified", "")),
+    }
+    for comment in comments:
+        # Pingbacks and trackbacks aren't listed by the REST API either
+        if comment.get("wp:comment_approved") != "1" \
+                or comment.get("wp:comment_type") not in (None, "", "comment"):
+            continue
+        yield {
+            "id": comment["wp:comment_id"],
+            "type": "comment",
+            "title": "Comment",
+            "link": f"{fields.get('link', '')}#comment-{comment['wp:comment_id']}",
+            "content": comment.get("wp:comment_content", ""),
+            "modified": _iso_date(comment.get("wp:comment_date", "")),
+        }
+
+
+def _qualified_name(tag: str) -> str:
+    "Name of an element with the usual prefix of its namespace, e.g. 'wp:post_id'."
+    if not tag.startswith("{"):
+        return tag
+    namespace, name = tag[1:].split("}")
+    if namespace == CONTENT_NAMESPACE:
+        return "content:" + name
+    if namespace.startswith(WXR_NAMESPACE):
+        return ("excerpt:" if namespace.endswith("/excerpt/") else "wp:") + name
+    return name
+
+
+def _iso_date(date: str) -> str:
+    "Convert a WXR date ('2024-01-01 12:00:00') to the format of the REST API."
+    return date.replace(" ", "T")
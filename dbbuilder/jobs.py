@@ -0,0 +1,106 @@
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+
+from .progress import BuildProgress
+
+
+_logger = logging.getLogger(__name__)
+
+
+class BuildJob:
+    "A database build running in the background."
+
+    def __init__(self, domain: str):
+        self.id = uuid.uuid4().hex
+        self.domain = domain
+        self.progress = BuildProgress()
+
+    @property
+    def done(self) -> bool:
+        return self.progress.status in ("succeeded", "failed")
+
+    def to_dict(self) -> dict:
+        return {"job_id": self.id, "site_domain": self.domain} \
+            | self.progress.to_dict()
+
+
+class BuildJobManager:
+    """
+    Runs database builds on a pool of background threads. Only one build
+    runs at a time for a domain: a build submitted while another one for the
+    same domain is queued or running is merged into it.
+    """
+    def __init__(self, max_concurrent_builds: int = 2, max_finished_jobs: int = 1000):
+        """
+        Args:
+            max_concurrent_builds: Builds running at the same time in this
+                process. Other builds wait in a queue.
+            max_finished_jobs: Number of finished jobs whose status is kept.
+        """
+        self.max_finished_jobs = max_finished_jobs
+        self._executor = ThreadPoolExecutor(
+            max_concurrent_builds, thread_name_prefix="db-build"
+        )
+        self._jobs: OrderedDict[str, BuildJob] = OrderedDict()
+        self._active: dict[str, BuildJob] = {}
+        self._lock = threading.Lock()
+
+    def submit(
+        self,
+        domain: str,
+        build: Callable[[BuildProgress], None],
+    ) -> tuple[BuildJob, bool]:
+        """
+        Queue a build for the domain.
+
+        Args:
+            domain: Domain of the site being built.
+            build: Function performing the build. It receives the progress
+                object to update.
+
+        Returns:
+            The job, and whether it was newly created (False if the build
+            was merged into an active job).
+        """
+        with self._lock:
+            if domain in self._active:
+                return self._active[domain], False
+            job = BuildJob(domain)
+            self._active[domain] = job
+            self._jobs[job.id] = job
+            self._forget_finished_jobs()
+        self._executor.submit(self._run, job, build)
+        return job, True
+
+    def get(self, job_id: str) -> BuildJob | None:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def active_job(self, domain: str) -> BuildJob | None:
+        "Get the queued or running job of the domain, if any."
+        with self._lock:
+            return self._active.get(domain)
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait)
+
+    def _run(self, job: BuildJob, build: Callable[[BuildProgress], None]) -> None:
+        job.progress.start()
+        error = None
+        try:
+            build(job.progress)
+        except Exception as e:
+            _logger.exception("Database build failed for '%s'", job.domain)
+            error = e
+        with self._lock:
+            job.progress.finish(error)
+            del self._active[job.domain]
+
+    def _forget_finished_jobs(self) -> None:
+        finished = [job_id for job_id, job in self._jobs.items() if job.done]
+        for job_id in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+            del self._jobs[job_id]
@@ -0,0 +1,20 @@
+from prometheus_client import Counter, Histogram
+
+
+BUILD_STAGE_SECONDS = Histogram(
+    "wordpress_assistant_build_stage_seconds",
+    "Time a stage of database builds takes to produce one output (a "
+    "document, or a batch of chunks or vectors).",
+    ["stage"],
+)
+BUILD_ITEMS = Counter(
+    "wordpress_assistant_build_items",
+    "Documents, chunks and vectors processed by database builds.",
+    ["kind"],
+)
+BUILD_SECONDS = Histogram(
+    "wordpress_assistant_build_seconds",
+    "Duration of database builds.",
+    ["status"],
+    buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200, float("inf")),
+)
@@ -0,0 +1,200 @@
+import time
+import queue
+import threading
+from collections.abc import Callable, Iterable, Iterator
+from typing import Any
+
+
+class Stage:
+    """
+    A step of a pipeline. `func` receives an iterator over the stage's inputs
+    and yields the outputs to be passed on to the next stage.
+    """
+    def __init__(
+        self,
+        func: Callable[[Iterator[Any]], Iterable[Any]],
+        workers: int = 1,
+        name: str | None = None,
+    ):
+        """
+        Args:
+            func: Generator function run by every worker of the stage.
+                All workers share the same input queue.
+            workers: Number of threads running `func` concurrently.
+            name: Name of the stage in timings. Defaults to that of `func`.
+        """
+        if workers < 1:
+            raise ValueError("A stage needs at least one worker.")
+        self.func = func
+        self.workers = workers
+        self.name = name or func.__name__
+
+
+def run_pipeline(
+    source: Iterable[Any],
+    stages: list[Stage],
+    queue_size: int = 8,
+    observe: Callable[[str, float], None] | None = None,
+) -> dict[str, float]:
+    """
+    Run `stages` concurrently, each one consuming the outputs of the previous
+    one (the first consumes `source`). Stages are connected by queues holding
+    at most `queue_size` items, so a slow stage blocks the ones before it
+    and memory stays bounded. Outputs of the last stage are discarded.
+
+    The first exception raised by any stage stops the whole pipeline and
+    is re-raised here once all the threads have exited.
+
+    Returns the seconds spent in `source` (as "source") and in every stage,
+    summed over its workers. Time spent waiting for inputs or for room in
+    the next queue is not included. `observe` is also called with the name
+    of the stage and the seconds taken to produce every output.
+    """
+    names = ["source"] + [stage.name for stage in stages]
+    run = _PipelineRun(names, queue_size, observe)
+
+    threads = [threading.Thread(
+        target=run.feed, args=(source, stages[0].workers), daemon=True
+    )]
+    for i, stage in enumerate(stages):
+        next_workers = stages[i+1].workers if i+1 < len(stages) else 0
+        pending = _Counter(stage.workers)
+        for _ in range(stage.workers):
+            threads.append(threading.Thread(
+                target=run.work, args=(i, stage.func, pending, next_workers),
+                daemon=True,
+            ))
+
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    if run.errors:
+        raise run.errors[0]
+    return dict(zip(names, run.seconds))
+
+
+_DONE = object()
+
+
+class _Cancelled(Exception):
+    pass
+
+
+class _Counter:
+
+    def __init__(self, value: int):
+        self.value = value
+        self.lock = threading.Lock()
+
+    def decrement(self) -> int:
+        with self.lock:
+            self.value -= 1
+            return self.value
+
+
+class _PipelineRun:
+
+    POLL_INTERVAL = 0.1
+
+    def __init__(
+        self,
+        names: list[str],
+        queue_size: int,
+        observe: Callable[[str, float], None] | None,
+    ):
+        self.names = names
+        self.observe = observe
+        self.queues = [queue.Queue(queue_size) for _ in names]
+        self.stopped = threading.Event()
+        self.errors: list[BaseException] = []
+        self.errors_lock = threading.Lock()
+        # Busy time of the source, followed by that of every stage
+        self.seconds = [0.0] * len(names)
+        self.seconds_lock = threading.Lock()
+        # Time the current thread spent waiting for inputs
+        self._waiting = threading.local()
+
+    def feed(self, source: Iterable[Any], workers: int) -> None:
+        try:
+            for item in self._timed(-1, source):
+                self._put(0, item)
+            for _ in range(workers):
+                self._put(0, _DONE)
+        except _Cancelled:
+            pass
+        except BaseException as e:
+            self._fail(e)
+
+    def work(
+        self,
+        idx: int,
+        func: Callable[[Iterator[Any]], Iterable[Any]],
+        pending: _Counter,
+        next_workers: int,
+    ) -> None:
+        is_last = idx + 1 == len(self.queues) - 1
+        try:
+            for output in self._timed(idx, func(self._inputs(idx))):
+                if not is_last:
+                    self._put(idx + 1, output)
+            # The last worker to finish tells the next stage no more
+            # inputs are coming.
+            if pending.decrement() == 0:
+                for _ in range(next_workers):
+                    self._put(idx + 1, _DONE)
+        except _Cancelled:
+            pass
+        except BaseException as e:
+            self._fail(e)
+
+    def _timed(self, idx: int, outputs: Iterable[Any]) -> Iterator[Any]:
+        "Add the time spent producing the outputs to the stage's time."
+        outputs = iter(outputs)
+        self._waiting.seconds = 0.0
+        while True:
+            start = time.perf_counter()
+            try:
+                output = next(outputs)
+            except StopIteration:
+                return
+            finally:
+                busy = time.perf_counter() - start - self._waiting.seconds
+                self._waiting.seconds = 0.0
+                with self.seconds_lock:
+                    self.seconds[idx + 1] += busy
+            if self.observe is not None:
+                self.observe(self.names[idx + 1], busy)
+            yield output
+
+    def _inputs(self, idx: int) -> Iterator[Any]:
+        q = self.queues[idx]
+        while True:
+            start = time.perf_counter()
+            try:
+                item = q.get(timeout=self.POLL_INTERVAL)
+            except queue.Empty:
+                if self.stopped.is_set():
+                    raise _Cancelled()
+                continue
+            finally:
+                self._waiting.seconds += time.perf_counter() - start
+            if item is _DONE:
+                return
+            yield item
+
+    def _put(self, idx: int, item: Any) -> None:
+        q = self.queues[idx]
+        while True:
+            if self.stopped.is_set():
+                raise _Cancelled()
+            try:
+                q.put(item, timeout=self.POLL_INTERVAL)
+                return
+            except queue.Full:
+                continue
+
+    def _fail(self, error: BaseException) -> None:
+        with self.errors_lock:
+            self.errors.append(error)
+        self.stopped.set()
@@ -0,0 +1,77 @@
+import time
+import threading
+
+from .metrics import BUILD_ITEMS, BUILD_SECONDS
+
+
+class BuildProgress:
+    """
+    Thread-safe counters tracking the progress of a database build, and the
+    time spent in every stage of it.
+    """
+    COUNTERS = [
+        "documents_total",
+        "documents_fetched",
+        "chunks_embedded",
+        "vectors_upserted",
+        "vectors_deleted",
+    ]
+
+    def __init__(self):
+        self.status = "queued"
+        self.error: str | None = None
+        self.started_at: float | None = None
+        self.finished_at: float | None = None
+        self.counts = dict.fromkeys(BuildProgress.COUNTERS, 0)
+        self.stage_seconds: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add(self, counter: str, n: int = 1) -> None:
+        with self._lock:
+            self.counts[counter] += n
+        BUILD_ITEMS.labels(counter).inc(n)
+
+    def add_seconds(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.stage_seconds[stage] = self.stage_seconds.get(stage, 0.0) + seconds
+
+    def start(self) -> None:
+        self.started_at = time.time()
+        self.status = "running"
+
+    def finish(self, error: BaseException | None = None) -> None:
+        self.finished_at = time.time()
+        if error is None:
+            self.status = "succeeded"
+        else:
+            self.status = "failed"
+            self.error = f"{type(error).__name__}: {error}"
+        if self.started_at is not None:
+            BUILD_SECONDS.labels(self.status).observe(
+                self.finished_at - self.started_at
+            )
+
+    def to_dict(self) -> dict:
+        """
+        Get the status and counters, along with the throughput (documents
+        fetched per second) and ETA in seconds of the build. Stage times are
+        known once the stages finish.
+        """
+        with self._lock:
+            counts = self.counts.copy()
+            stage_seconds = self.stage_seconds.copy()
+        output = {"status": self.status, "error": self.error} | counts
+
+        throughput = eta = elapsed = None
+        if self.started_at is not None:
+            elapsed = (self.finished_at or time.time()) - self.started_at
+            if elapsed > 0:
+                throughput = counts["documents_fetched"] / elapsed
+            remaining = counts["documents_total"] - counts["documents_fetched"]
+            if self.status == "running" and throughput and remaining >= 0:
+                eta = remaining / throughput
+        output["elapsed_seconds"] = elapsed
+        output["documents_per_second"] = throughput
+        output["eta_seconds"] = eta
+        output["stage_seconds"] = stage_seconds
+        return output
@@ -0,0 +1,190 @@
+import time
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    import voyageai
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the number of tokens of a text for the embedding model, without
+    its tokenizer. English averages about 4 characters per token, so this
+    overestimates to stay under the API's limits.
+    """
+    return len(text) // 3 + 1
+
+
+class TokenBucket:
+    """
+    Allows `rate` units per second on average, with bursts of up to
+    `capacity` units.
+    """
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount: float = 1) -> None:
+        """
+        Wait until `amount` units are available and take them. An amount
+        larger than the capacity is allowed once the bucket is full.
+        """
+        with self._lock:
+            self._refill()
+            amount = min(amount, self.capacity)
+            # Taking the units right away, even if it leaves a debt, keeps
+            # the callers in the order they arrived
+            self.tokens -= amount
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        time.sleep(wait)
+
+    def try_acquire(self, amount: float = 1) -> float:
+        """
+        Take `amount` units if they are available, without waiting. Returns
+        0 if they were taken, else the seconds until they are available.
+        """
+        with self._lock:
+            self._refill()
+            amount = min(amount, self.capacity)
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return 0.0
+            return (amount - self.tokens) / self.rate
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+class RateLimiter:
+    """
+    Keeps the requests to an API under its limits of requests and tokens per
+    minute. Can be shared by threads and by concurrent builds.
+    """
+    def __init__(
+        self,
+        requests_per_minute: float | None = None,
+        tokens_per_minute: float | None = None,
+    ):
+        """
+        Args:
+            requests_per_minute: Limit of requests. None for no limit.
+            tokens_per_minute: Limit of tokens. None for no limit.
+        """
+        self.requests = None
+        self.tokens = None
+        if requests_per_minute is not None:
+            self.requests = TokenBucket(requests_per_minute / 60, requests_per_minute)
+        if tokens_per_minute is not None:
+            self.tokens = TokenBucket(tokens_per_minute / 60, tokens_per_minute)
+
+    def acquire(self, tokens: int = 0) -> None:
+        "Wait until a request with `tokens` tokens can be sent."
+        if self.requests is not None:
+            self.requests.acquire()
+        if self.tokens is not None and tokens:
+            self.tokens.acquire(tokens)
+
+
+class TenantLimiter:
+    """
+    Limits the requests of every tenant (e.g. the domain of a site) in
+    flight and per minute. Requests over the limits are refused instead of
+    waiting, so that a busy tenant can't tie up the workers serving the
+    others.
+
+    Only the last `max_tenants` tenants are tracked. Those forgotten have no
+    requests in flight, and start again with a full rate limit.
+    """
+    def __init__(
+        self,
+        max_concurrent: int | None = None,
+        requests_per_minute: float | None = None,
+        max_tenants: int = 10_000,
+    ):
+        """
+        Args:
+            max_concurrent: Limit of requests in flight for a tenant. None
+                for no limit.
+            requests_per_minute: Limit of requests of a tenant, in bursts of
+                up to as many. None for no limit.
+            max_tenants: Number of tenants tracked.
+        """
+        self.max_concurrent = max_concurrent
+        self.requests_per_minute = requests_per_minute
+        self.max_tenants = max_tenants
+        # Requests in flight and rate limit by tenant, least recent first
+        self._tenants: OrderedDict[str, _TenantState] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def try_acquire(self, tenant: str) -> float:
+        """
+        Start a request of `tenant` if it is within the limits. Returns 0 if
+        it is, and the request must then be ended with `release`. Otherwise
+        returns the seconds after which to retry it.
+        """
+        with self._lock:
+            state = self._tenant(tenant)
+            if self.max_concurrent is not None \
+                    and state.active >= self.max_concurrent:
+                return 1.0
+            if state.bucket is not None and (wait := state.bucket.try_acquire()) > 0:
+                return wait
+            state.active += 1
+            return 0.0
+
+    def release(self, tenant: str) -> None:
+        "End a request started with `try_acquire`."
+        with self._lock:
+            if tenant in self._tenants:
+                self._tenants[tenant].active -= 1
+
+    def active(self, tenant: str) -> int:
+        "Number of requests of `tenant` in flight."
+        with self._lock:
+            state = self._tenants.get(tenant)
+            return state.active if state is not None else 0
+
+    def _tenant(self, tenant: str) -> "_TenantState":
+        state = self._tenants.get(tenant)
+        if state is not None:
+            self._tenants.move_to_end(tenant)
+            return state
+        if len(self._tenants) >= self.max_tenants:
+            idle = next((t for t, s in self._tenants.items() if s.active == 0), None)
+            if idle is not None:
+                del self._tenants[idle]
+        bucket = None
+        if self.requests_per_minute is not None:
+            bucket = TokenBucket(self.requests_per_minute / 60,
+                                 self.requests_per_minute)
+        state = self._tenants[tenant] = _TenantState(0, bucket)
+        return state
+
+
+@dataclass
+class _TenantState:
+    active: int
+    bucket: TokenBucket | None
+
+
+class RateLimitedEmbedder:
+    """
+    Wraps a text embedder so that its requests stay under the rate limits.
+    It can be used in place of a `voyageai.Client`, e.g. under a
+    `CachedEmbedder` so that only the texts missing from the cache count.
+    """
+    def __init__(self, embedder: "voyageai.Client", limiter: RateLimiter):
+        self.embedder = embedder
+        self.limiter = limiter
+
+    def embed(self, texts: list[str], model: str, **kwargs) -> Any:
+        self.limiter.acquire(sum(estimate_tokens(text) for text in texts))
+        return self.embedder.embed(texts, model=model, **kwargs)
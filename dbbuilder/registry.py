@@ -0,0 +1,165 @@
+import time
+import sqlite3
+import logging
+import threading
+from dataclasses import dataclass, asdict, replace
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from vectorstore import VectorStore
+
+
+_logger = logging.getLogger(__name__)
+
+
+@dataclass
+class NamespaceInfo:
+    """
+    What is known about the database of a site.
+
+    Attributes:
+        namespace: Namespace of the vectors, the domain of the site.
+        vector_count: Number of vectors, as of the last refresh.
+        status: Status of the latest build: 'building', 'complete' or
+            'failed'. Namespaces found in the index without a record of
+            their build are 'complete'.
+        built_at: Unix time at which the last successful build finished.
+        embedding_model: Model which embedded the vectors, if known.
+    """
+    namespace: str
+    vector_count: int
+    status: str
+    built_at: float | None = None
+    embedding_model: str | None = None
+
+    @property
+    def present(self) -> bool:
+        """
+        Whether a build of the namespace finished, or its vectors were found
+        in the index. Vector counts lag behind upserts, so they aren't
+        trusted for the namespaces built here.
+        """
+        return self.built_at is not None or (
+            self.status == "complete" and self.vector_count > 0
+        )
+
+    def to_dict(self) -> dict:
+        return asdict(self) | {"database_present": self.present}
+
+
+class NamespaceRegistry:
+    """
+    Catalog of the namespaces of a vector database and of their builds.
+    Lookups are served from memory, and refreshed when they are older than
+    `ttl` seconds: the catalog is read again from the file, which other
+    processes may have changed, and the vector counts from the index
+    statistics. Every change only writes the fields it is about, so those
+    of other processes aren't overwritten.
+    """
+    def __init__(self, database: "VectorStore", path: str = ":memory:", ttl: float = 300):
+        """
+        Args:
+            database: The vector database.
+            path: Path of the SQLite database file storing the catalog.
+            ttl: Seconds after which the vector counts are refreshed.
+        """
+        self.database = database
+        self.ttl = ttl
+        self.refreshed_at: float | None = None
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS namespaces ("
+                " namespace TEXT PRIMARY KEY,"
+                " vector_count INTEGER NOT NULL,"
+                " status TEXT NOT NULL,"
+                " built_at REAL,"
+                " embedding_model TEXT)"
+            )
+            self._load()
+
+    def get(self, namespace: str) -> NamespaceInfo | None:
+        self._refresh_if_stale()
+        with self._lock:
+            info = self._namespaces.get(namespace)
+            return replace(info) if info is not None else None
+
+    def all(self) -> list[NamespaceInfo]:
+        self._refresh_if_stale()
+        with self._lock:
+            return [replace(info) for _, info in sorted(self._namespaces.items())]
+
+    def refresh(self) -> None:
+        "Read the catalog again, with the vector counts of the index statistics."
+        stats = self.database.describe_index_stats()
+        counts = {name: ns["vector_count"] for name, ns in stats["namespaces"].items()}
+        with self._lock:
+            with self._conn:
+                self._conn.execute("UPDATE namespaces SET vector_count = 0")
+                self._conn.executemany(
+                    "UPDATE namespaces SET vector_count = ? WHERE namespace = ?",
+                    ((count, name) for name, count in counts.items())
+                )
+                # Found in the index without a record of their build
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO namespaces"
+                    " VALUES (?, ?, 'complete', NULL, NULL)",
+                    counts.items()
+                )
+            self._load()
+            self.refreshed_at = time.monotonic()
+
+    def start_build(self, namespace: str, embedding_model: str | None = None) -> None:
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    "INSERT INTO namespaces VALUES (?, 0, 'building', NULL, ?)"
+                    " ON CONFLICT (namespace) DO UPDATE SET status = 'building',"
+                    " embedding_model = excluded.embedding_model",
+                    (namespace, embedding_model)
+                )
+            self._load()
+
+    def finish_build(self, namespace: str, succeeded: bool) -> None:
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    "UPDATE namespaces SET status = ?, built_at = COALESCE(?, built_at)"
+                    " WHERE namespace = ?",
+                    ("complete" if succeeded else "failed",
+                     time.time() if succeeded else None, namespace)
+                )
+            self._load()
+        try:
+            self.refresh()
+        except Exception:
+            _logger.warning("Failed to refresh the namespaces", exc_info=True)
+
+    def remove(self, namespace: str) -> None:
+        with self._lock, self._conn:
+            self._namespaces.pop(namespace, None)
+            self._conn.execute(
+                "DELETE FROM namespaces WHERE namespace = ?", (namespace,)
+            )
+
+    def _refresh_if_stale(self) -> None:
+        if self.refreshed_at is not None \
+                and time.monotonic() - self.refreshed_at < self.ttl:
+            return
+        try:
+            self.refresh()
+        except Exception:
+            # Stale counts are better than no answer
+            _logger.warning("Failed to refresh the namespaces", exc_info=True)
+            with self._lock:
+                self._load()
+                self.refreshed_at = time.monotonic()
+
+    def _load(self) -> None:
+        self._namespaces = {
+            row[0]: NamespaceInfo(*row) for row in self._conn.execute(
+                "SELECT namespace, vector_count, status, built_at,"
+                " embedding_model FROM namespaces"
+            )
+        }
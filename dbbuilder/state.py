@@ -0,0 +1,126 @@
+import json
+import sqlite3
+import threading
+from collections.abc import Iterable
+from dataclasses import dataclass
+
+
+@dataclass
+class DocumentState:
+    """
+    What was indexed for a single WordPress item.
+
+    Attributes:
+        key: Key of the form '{type}s/{id}', the prefix of its vector IDs.
+        modified: 'modified' ('date' for comments) of the item, in the
+            site's time zone.
+        content_hash: Hash of the item's raw title, link and content.
+        chunk_hashes: Hash of every chunk in order. Vector IDs are of the
+            form '{key}#chunk{index}'.
+    """
+    key: str
+    modified: str
+    content_hash: str
+    chunk_hashes: list[str]
+
+
+class SyncState:
+    """
+    Persistent record of the documents indexed for every namespace, used to
+    update a vector database incrementally.
+    """
+    def __init__(self, path: str = ":memory:"):
+        """
+        Args:
+            path: Path of the SQLite database file storing the state.
+        """
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS documents ("
+                " namespace TEXT NOT NULL,"
+                " key TEXT NOT NULL,"
+                " modified TEXT NOT NULL,"
+                " content_hash TEXT NOT NULL,"
+                " chunk_hashes TEXT NOT NULL,"
+                " PRIMARY KEY (namespace, key))"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS builds ("
+                " namespace TEXT PRIMARY KEY,"
+                " modified_after TEXT NOT NULL)"
+            )
+
+    def documents(self, namespace: str) -> dict[str, DocumentState]:
+        "Get the state of every document of the namespace by its key."
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, modified, content_hash, chunk_hashes"
+                " FROM documents WHERE namespace = ?", (namespace,)
+            ).fetchall()
+        return {
+            key: DocumentState(key, modified, content_hash, json.loads(hashes))
+            for key, modified, content_hash, hashes in rows
+        }
+
+    def modified_after(self, namespace: str) -> str | None:
+        """
+        Date after which the items modified are fetched by the next build of
+        the namespace, in the site's time zone. Defaults to the latest
+        modification date of its documents.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT modified_after FROM builds WHERE namespace = ?", (namespace,)
+            ).fetchone()
+        if row is not None:
+            return row[0]
+        return self.last_modified(namespace)
+
+    def last_modified(self, namespace: str) -> str | None:
+        "Latest modification date among the documents of the namespace."
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MAX(modified) FROM documents"
+                " WHERE namespace = ? AND key NOT LIKE 'comments/%'",
+                (namespace,)
+            ).fetchone()
+        return row[0]
+
+    def update(
+        self,
+        namespace: str,
+        documents: Iterable[DocumentState],
+        removed: Iterable[str] = (),
+        modified_after: str | None = None,
+    ) -> None:
+        """
+        Atomically save updated documents and forget removed ones, along with
+        the date after which the next build fetches modified items, if given.
+        """
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?)",
+                ((namespace, d.key, d.modified, d.content_hash,
+                  json.dumps(d.chunk_hashes)) for d in documents)
+            )
+            self._conn.executemany(
+                "DELETE FROM documents WHERE namespace = ? AND key = ?",
+                ((namespace, key) for key in removed)
+            )
+            if modified_after is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO builds VALUES (?, ?)",
+                    (namespace, modified_after)
+                )
+
+    def clear(self, namespace: str) -> None:
+        "Forget all the documents of the namespace."
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM documents WHERE namespace = ?", (namespace,)
+            )
+            self._conn.execute(
+                "DELETE FROM builds WHERE namespace = ?", (namespace,)
+            )
@@ -1,7 +1,74 @@
-from bs4 import BeautifulSoup
+from html.entities import html5
+from html.parser import HTMLParser
+from collections import deque
+from collections.abc import Iterable, Iterator
+from concurrent.futures import Executor, Future
+from itertools import islice
 
 
 def extract_text_from_html(html: str) -> str:
+    """
+    Extract the text of an HTML document, without that of its scripts and
+    styles. The document is parsed as a stream of events, without building
+    a tree, and the text is the same as that of BeautifulSoup's `get_text`.
+    """
+    parser = _TextExtractor()
+    parser.feed(html)
+    parser.close()
+    parser.flush()
+    return _clean_text("".join(parser.texts))
+
+
+def extract_texts_from_html(
+    htmls: Iterable[str],
+    pool: Executor | None = None,
+    batch_size: int = 16,
+    max_pending: int = 32,
+) -> Iterator[str]:
+    """
+    Extract the texts of many HTML documents, yielding them in order.
+
+    Args:
+        htmls: HTML documents. They are consumed lazily.
+        pool: Process pool to spread the documents across. If None, texts
+            are extracted in the current process.
+        batch_size: Number of documents sent to a process at a time.
+        max_pending: Maximum number of batches submitted to the pool ahead
+            of the consumer.
+    """
+    htmls = iter(htmls)
+    if pool is None:
+        yield from map(extract_text_from_html, htmls)
+        return
+
+    pending: deque[Future] = deque()
+    while batch := list(islice(htmls, batch_size)):
+        pending.append(pool.submit(_extract_batch, batch))
+        while pending and (len(pending) >= max_pending or pending[0].done()):
+            yield from pending.popleft().result()
+    while pending:
+        yield from pending.popleft().result()
+
+
+def _extract_batch(htmls: list[str]) -> list[str]:
+    return [extract_text_from_html(html) for html in htmls]
+
+
+def _clean_text(text: str) -> str:
+    "Put every phrase of the text on its own line, stripped of whitespace."
+    phrases = (phrase.strip() for line in text.splitlines()
+               for phrase in line.split("  "))
+    return "\n".join(filter(None, phrases))
+
+
+def _bs4_extract_text_from_html(html: str) -> str:
+    """
+    The original implementation of `extract_text_from_html` with
+    BeautifulSoup, which it must stay identical to. Kept as a reference for
+    tests and benchmarks.
+    """
+    from bs4 import BeautifulSoup
+
     soup = BeautifulSoup(html, features="html.parser")
 
     for script in soup(["script", "style"]):
@@ -13,3 +80,132 @@ def extract_text_from_html(html: str) -> str:
     chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
     text = '\n'.join(chunk for chunk in chunks if chunk)
     return text
+
+
+# Named character references, without their trailing semicolon
+_ENTITIES: dict[str, str] = {}
+for _name, _char in html5.items():
+    _ENTITIES.setdefault(_name.removesuffix(";"), _char)
+
+
+class _TextExtractor(HTMLParser):
+    """
+    Collects the strings of an HTML document as BeautifulSoup does with
+    "html.parser": the tree builder's stack of open tags is mirrored by a
+    stack of names, which decides how every string is treated.
+    """
+    ASCII_SPACES = "\x20\x0a\x09\x0c\x0d"
+    # Closed as soon as they are opened
+    VOID_ELEMENTS = frozenset([
+        "area", "base", "br", "col", "embed", "hr", "img", "input", "keygen",
+        "link", "menuitem", "meta", "param", "source", "track", "wbr",
+        "basefont", "bgsound", "command", "frame", "image", "isindex",
+        "nextid", "spacer",
+    ])
+    # Whitespace-only strings are kept as they are in these
+    PRESERVE_WHITESPACE = frozenset(["pre", "textarea"])
+    # Strings in these aren't part of the text
+    STRING_CONTAINERS = frozenset(["rt", "rp", "style", "script", "template"])
+    # Removed with all their content
+    REMOVED = frozenset(["script", "style"])
+
+    def __init__(self):
+        super().__init__(convert_charrefs=False)
+        self.texts: list[str] = []
+        self._data: list[str] = []
+        self._stack: list[str] = []
+        # Number of open tags of each kind above
+        self._preserving = 0
+        self._containers = 0
+        self._removed = 0
+        self._closed_void_elements: list[str] = []
+
+    def flush(self, cdata: bool = False) -> None:
+        "End the current string, adding it to the text if it belongs there."
+        if not self._data:
+            return
+        data = "".join(self._data)
+        self._data.clear()
+        if not self._preserving and not data.strip(self.ASCII_SPACES):
+            data = "\n" if "\n" in data else " "
+        if self._removed or (self._containers and not cdata):
+            return
+        self.texts.append(data)
+
+    def handle_starttag(self, tag, attrs):
+        self._push(tag)
+        if tag in self.VOID_ELEMENTS:
+            self._pop(tag)
+            self._closed_void_elements.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self._push(tag)
+        self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in self._closed_void_elements:
+            self._closed_void_elements.remove(tag)
+        else:
+            self._pop(tag)
+
+    def handle_data(self, data):
+        self._data.append(data)
+
+    def handle_charref(self, name):
+        if name[0] in "xX":
+            code = int(name[1:], 16)
+        else:
+            code = int(name)
+        data = None
+        if code < 256:
+            try:
+                data = bytes([code]).decode("windows-1252")
+            except UnicodeDecodeError:
+                pass
+        if not data:
+            try:
+                data = chr(code)
+            except (ValueError, OverflowError):
+                pass
+        self._data.append(data or "\N{REPLACEMENT CHARACTER}")
+
+    def handle_entityref(self, name):
+        self._data.append(_ENTITIES.get(name, "&" + name))
+
+    def unknown_decl(self, data):
+        self.flush()
+        if data.upper().startswith("CDATA["):
+            self._data.append(data[len("CDATA["):])
+            self.flush(cdata=True)
+
+    # Comments, doctypes and processing instructions aren't text
+    def handle_comment(self, data):
+        self.flush()
+
+    def handle_decl(self, decl):
+        self.flush()
+
+    def handle_pi(self, data):
+        self.flush()
+
+    def _push(self, tag: str) -> None:
+        self.flush()
+        self._stack.append(tag)
+        self._count(tag, 1)
+
+    def _pop(self, tag: str) -> None:
+        "Close the most recent tag with the name and all the tags in it."
+        self.flush()
+        if tag not in self._stack:
+            return
+        while (name := self._stack.pop()) != tag:
+            self._count(name, -1)
+        self._count(tag, -1)
+
+    def _count(self, tag: str, n: int) -> None:
+        if tag in self.PRESERVE_WHITESPACE:
+            self._preserving += n
+        if tag in self.STRING_CONTAINERS:
+            self._containers += n
+        if tag in self.REMOVED:
+            self._removed += n
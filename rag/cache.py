@@ -0,0 +1,128 @@
+import time
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class SemanticCache:
+    """
+    Cache of chatbot answers, looked up by the similarity of the embedding
+    of a new question to the embeddings of previously answered ones.
+    Answers are kept separately for every namespace (site) and context,
+    where the context identifies the messages preceding the question (e.g.
+    the system prompt).
+    """
+    def __init__(
+        self,
+        threshold: float = 0.95,
+        ttl: float = 24 * 60 * 60,
+        max_entries: int = 1000,
+    ):
+        """
+        Args:
+            threshold: Minimum cosine similarity of two questions for the
+                answer to one to be reused for the other.
+            ttl: Seconds after which an answer expires.
+            max_entries: Maximum number of answers kept per namespace and
+                context. The least recently used ones are evicted.
+        """
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._buckets: dict[tuple[str, str], _Bucket] = {}
+        self._lock = threading.Lock()
+
+    def lookup(
+        self,
+        namespace: str,
+        context: str,
+        embedding: list[float],
+    ) -> str | None:
+        "Get the answer to the most similar question, if similar enough."
+        with self._lock:
+            bucket = self._buckets.get((namespace, context))
+            answer = None
+            if bucket is not None:
+                answer = bucket.lookup(_normalize(embedding), self.threshold, self.ttl)
+            if answer is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return answer
+
+    def store(
+        self,
+        namespace: str,
+        context: str,
+        embedding: list[float],
+        answer: str,
+    ) -> None:
+        with self._lock:
+            key = (namespace, context)
+            if key not in self._buckets:
+                self._buckets[key] = _Bucket()
+            self._buckets[key].store(_normalize(embedding), answer, self.max_entries)
+
+    def invalidate(self, namespace: str) -> None:
+        "Forget all the answers of the namespace, e.g. when it is rebuilt."
+        with self._lock:
+            for key in [k for k in self._buckets if k[0] == namespace]:
+                del self._buckets[key]
+
+    def stats(self) -> dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": sum(len(b.entries) for b in self._buckets.values()),
+            }
+
+
+class _Bucket:
+
+    def __init__(self):
+        # Key: Entry ID. Value: (embedding, answer, creation time)
+        self.entries: OrderedDict[int, tuple[np.ndarray, str, float]] = OrderedDict()
+        self._next_id = 0
+        self._ids: list[int] = []
+        self._matrix: np.ndarray | None = None
+
+    def lookup(self, embedding: np.ndarray, threshold: float, ttl: float) -> str | None:
+        now = time.time()
+        for id in [id for id, e in self.entries.items() if now - e[2] > ttl]:
+            self._remove(id)
+        if not self.entries:
+            return None
+
+        if self._matrix is None:
+            self._ids = list(self.entries)
+            self._matrix = np.stack([self.entries[id][0] for id in self._ids])
+        scores = self._matrix @ embedding
+        best = int(np.argmax(scores))
+        if scores[best] < threshold:
+            return None
+        id = self._ids[best]
+        self.entries.move_to_end(id)
+        return self.entries[id][1]
+
+    def store(self, embedding: np.ndarray, answer: str, max_entries: int) -> None:
+        self.entries[self._next_id] = (embedding, answer, time.time())
+        self._next_id += 1
+        self._matrix = None
+        while len(self.entries) > max_entries:
+            self._remove(next(iter(self.entries)))
+
+    def _remove(self, id: int) -> None:
+        del self.entries[id]
+        self._matrix = None
+
+
+def _normalize(embedding: list[float]) -> np.ndarray:
+    x = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(x)
+    return x / norm if norm else x
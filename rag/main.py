@@ -1,18 +1,37 @@
-from typing import TYPE_CHECKING
+import contextvars
+import logging
+from collections.abc import Callable, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, NamedTuple, TypeVar
 
-from mistral_common.tokens.instruct.normalize import ChatCompletionRequest
-from mistral_common.protocol.instruct.messages import (
-    SystemMessage, UserMessage, AssistantMessage
-)
-from mistral_common.tokens.tokenizers.mistral import MistralTokenizer
 from mistralai.models.chat_completion import ChatMessage
 
+from .cache import SemanticCache
+from .metrics import RETRIEVED_CHUNKS, count_llm_tokens, timed
+from .tokens import TokenCounter
+
 if TYPE_CHECKING:
     from mistralai.client import MistralClient
-    from pinecone import Index
+    from vectorstore import BM25Index, VectorStore
     import voyageai
 
 
+_logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+SUMMARY_PREFIX = "Summary of our conversation so far:\n"
+RAG_PROMPT = "You can use the following data to answer the user query:"
+RAG_SEPARATOR = "\n\n-----\n\n"
+RAG_END = "\n\n----------\n\n"
+COT_PROMPT = "\nLet's think step by step."
+# Retrieved texts are only trimmed if at least this many tokens of them fit
+MIN_TRIMMED_TOKENS = 50
+# Characters two consecutive chunks must have in common to be merged on them
+MIN_CHUNK_OVERLAP = 10
+
+
 class WordPressRAG:
     """
     An interface to perform Retrieval Augmented Generation on WordPress
@@ -23,7 +42,15 @@ class WordPressRAG:
         llm_client: "MistralClient",
         model_name: str,
         embedder: "voyageai.Client",
-        vector_db: "Index"
+        vector_db: "VectorStore",
+        response_cache: SemanticCache | None = None,
+        history_token_budget: int = 1000,
+        summary_length_words: int = 400,
+        sparse_index: "BM25Index | None" = None,
+        rrf_k: int = 60,
+        prompt_token_budget: int = 4000,
+        max_context_chunks: int = 5,
+        min_score: float | None = None,
     ):
         """
         Args:
@@ -31,12 +58,37 @@ class WordPressRAG:
             model_name: Model name to be passed to the client.
             embedder: Model to generate text embeddings to query the database.
             vector_db: Vector database to serve as a knowledge base for the LLM.
+            response_cache: Cache of answers to the first question of chats,
+                reused for similar questions without calling the LLM.
+            history_token_budget: Maximum number of tokens of the chat
+                history. Older messages are summarized when it's exceeded.
+            summary_length_words: Maximum length of the summary.
+            sparse_index: Full-text index of the chunks. If given, texts
+                are retrieved from both indexes and the results are fused.
+            rrf_k: Constant of reciprocal rank fusion. Larger values give
+                more weight to the lower ranks.
+            prompt_token_budget: Maximum number of tokens of the prompt.
+                Retrieved texts fill what the chat leaves of it, the best
+                first, and the last one is trimmed to fit.
+            max_context_chunks: Maximum number of chunks retrieved.
+            min_score: Similarity below which chunks from the vector
+                database are not used. Scores of the sparse index aren't
+                comparable, so its chunks are all kept.
         """
         self.client = llm_client
         self.model = model_name
-        self.tokenizer = MistralTokenizer.v3()
+        self.token_counter = TokenCounter()
         self.embedder = embedder
         self.db = vector_db
+        self.response_cache = response_cache
+        self.history_token_budget = history_token_budget
+        self.summary_length_words = summary_length_words
+        self.sparse_index = sparse_index
+        self.rrf_k = rrf_k
+        self.prompt_token_budget = prompt_token_budget
+        self.max_context_chunks = max_context_chunks
+        self.min_score = min_score
+        self._executor = ThreadPoolExecutor(thread_name_prefix="retrieve")
 
     def generate(
         self,
@@ -57,89 +109,434 @@ class WordPressRAG:
             Dictionary of chat messages with the new message appended.
             History may be modified due to summarization.
         """
-        chat: list[ChatMessage] = []
-        for msg in chat_input:
-            chat.append(ChatMessage(**msg))
+        chat = self._chat_from_dicts(chat_input)
         del chat_input
+        answer, query = self._cached_answer(site_domain, chat)
+        if answer is not None:
+            chat.append(ChatMessage(role="assistant", content=answer))
+            return self._chat_to_dicts(chat)
 
-        if self.count_chat_tokens(chat[:-1]) > 1000:
-            chat = self.summarize_chat(chat[:-1], 400) + [chat[-1]]
+        chat, chat_llm, _ = self._prepare_chat(site_domain, chat, query)
+        with timed("llm"):
+            res = self.client.chat(chat_llm, self.model,
+                                   temperature=temperature,
+                                   safe_prompt=True)
+        count_llm_tokens(res)
+        chat.append(res.choices[0].message)
+        self._cache_answer(site_domain, query, chat[-1].content)
+        return self._chat_to_dicts(chat)
 
+    def generate_stream(
+        self,
+        site_domain: str | None,
+        chat_input: list[dict[str, str]],
+        temperature: float | None = None,
+    ) -> Iterator[tuple[str, Any]]:
+        """
+        Generate response from the chatbot, yielding it as it is generated.
+
+        Args:
+            site_domain: Site's domain name. E.g. "www.example.com".
+                If None, RAG will not be performed.
+            chat_input: Chat with complete history as a dictionary.
+            temperature: Randomness in chatbot output (0 to 1).
+
+        Yields:
+            Events as (name, data) tuples, in this order:
+            - ("context", list of retrieved texts), before generation starts.
+            - ("token", text) for every piece of the response.
+            - ("done", chat), where chat is the dictionary of chat messages
+              with the new message appended, as returned by `generate`.
+            If retrieval or generation fails, the events end with
+            ("error", {"message": ...}) instead of "done", as the response
+            has already started.
+        """
+        try:
+            yield from self._generate_stream(site_domain, chat_input, temperature)
+        except Exception:
+            _logger.exception("Failed to generate a streamed response")
+            yield "error", {"message": "The response could not be generated."}
+
+    def _generate_stream(
+        self,
+        site_domain: str | None,
+        chat_input: list[dict[str, str]],
+        temperature: float | None = None,
+    ) -> Iterator[tuple[str, Any]]:
+        chat = self._chat_from_dicts(chat_input)
+        del chat_input
+        answer, query = self._cached_answer(site_domain, chat)
+        if answer is not None:
+            yield "context", []
+            yield "token", answer
+            chat.append(ChatMessage(role="assistant", content=answer))
+            yield "done", self._chat_to_dicts(chat)
+            return
+
+        chat, chat_llm, retrieved_texts = self._prepare_chat(site_domain, chat, query)
+        yield "context", retrieved_texts
+
+        response = ""
+        with timed("llm"):
+            for res in self.client.chat_stream(chat_llm, self.model,
+                                               temperature=temperature,
+                                               safe_prompt=True):
+                token = res.choices[0].delta.content
+                if token:
+                    response += token
+                    yield "token", token
+                # Only the last chunk reports the usage
+                count_llm_tokens(res)
+        chat.append(ChatMessage(role="assistant", content=response))
+        self._cache_answer(site_domain, query, response)
+        yield "done", self._chat_to_dicts(chat)
+
+    def _prepare_chat(
+        self,
+        site_domain: str | None,
+        chat: list[ChatMessage],
+        query: "_CacheQuery | None" = None,
+    ) -> tuple[list[ChatMessage], list[ChatMessage], list[str]]:
+        """
+        Returns the chat history (possibly summarized), the chat to be sent
+        to the LLM and the texts retrieved for the last message.
+
+        The history is summarized in another thread while the texts are
+        retrieved, as the retrieval only depends on the last message.
+        """
+        history, last_msg = chat[:-1], chat[-1]
+        summary = None
+        if self.count_chat_tokens(history) > self.history_token_budget:
+            summary = self._submit(
+                self.summarize_chat, history, self.summary_length_words
+            )
+
+        contexts: list[_Context] = []
         if site_domain is not None:
-            retrieved_texts = self.retrieve_similar(chat[-1].content, 5, site_domain)
-            rag_msg = "You can use the following data to answer the user query:"
+            contexts = self._retrieve(last_msg.content, self.max_context_chunks,
+                                      site_domain, query and query.embedding)
+        if summary is not None:
+            history = summary.result()
+        chat = history + [last_msg]
+        retrieved_texts = self._fit_contexts(contexts, self._context_budget(chat))
+        return chat, self._create_llm_chat(chat, retrieved_texts), retrieved_texts
+
+    def _cached_answer(
+        self,
+        site_domain: str | None,
+        chat: list[ChatMessage],
+    ) -> tuple[str | None, "_CacheQuery | None"]:
+        """
+        Look up the answer to the first question of a chat in the response
+        cache. Also returns the cache query to store the answer with, whose
+        embedding can be reused for retrieval.
+        """
+        if (self.response_cache is None or site_domain is None
+                or any(msg.role == "user" for msg in chat[:-1])):
+            return None, None
+        context = "\n".join(f"{msg.role}: {msg.content}" for msg in chat[:-1])
+        query = _CacheQuery(context, self.embed_query(chat[-1].content))
+        with timed("response_cache"):
+            answer = self.response_cache.lookup(site_domain, context,
+                                                query.embedding)
+        return answer, query
+
+    def _cache_answer(
+        self,
+        site_domain: str | None,
+        query: "_CacheQuery | None",
+        answer: str,
+    ) -> None:
+        if query is not None:
+            self.response_cache.store(site_domain, query.context,
+                                      query.embedding, answer)
+
+    def _create_llm_chat(
+        self,
+        chat: list[ChatMessage],
+        retrieved_texts: list[str],
+    ) -> list[ChatMessage]:
+
+        if retrieved_texts:
+            rag_msg = RAG_PROMPT
             for text in retrieved_texts:
-                rag_msg += "\n\n-----\n\n" + text
-            msg = rag_msg + "\n\n----------\n\n" + chat[-1].content
+                rag_msg += RAG_SEPARATOR + text
+            msg = rag_msg + RAG_END + chat[-1].content
             chat_llm = chat[:-1] + [ChatMessage(role=chat[-1].role, content=msg)]
         else:
             chat_llm = chat
 
-        chat_llm = chat_llm[:-1] + [self.add_cot_prompt(chat_llm[-1])]
-        res = self.client.chat(chat_llm, self.model,
-                               temperature=temperature,
-                               safe_prompt=True)
-        chat.append(res.choices[0].message)
+        return chat_llm[:-1] + [self.add_cot_prompt(chat_llm[-1])]
+
+    @staticmethod
+    def _chat_from_dicts(chat_input: list[dict[str, str]]) -> list[ChatMessage]:
+        chat: list[ChatMessage] = []
+        for msg in chat_input:
+            chat.append(ChatMessage(**msg))
+        return chat
+
+    @staticmethod
+    def _chat_to_dicts(chat: list[ChatMessage]) -> list[dict[str, str]]:
         chat_output: list[dict[str, str]] = []
         for msg in chat:
             chat_output.append({"role": msg.role, "content": msg.content})
         return chat_output
 
     def count_chat_tokens(self, chat: list[ChatMessage]) -> int:
-        chat_roles = []
-        for msg in chat:
-            if msg.role == "system":
-                chat_roles.append(SystemMessage(content=msg.content))
-            elif msg.role == "user":
-                chat_roles.append(UserMessage(content=msg.content))
-            elif msg.role == "assistant":
-                chat_roles.append(AssistantMessage(content=msg.content))
-
-        if chat_roles[-1].role != "user":
-            chat_roles.append(UserMessage(content=""))
-
-        tokens, _ = self.tokenizer.encode_chat_completion(
-            ChatCompletionRequest(model=self.model, messages=chat_roles)
-        )
-        return len(tokens)
+        with timed("count_tokens"):
+            return self.token_counter.count_chat(chat)
 
     def summarize_chat(
         self,
         chat: list[ChatMessage],
         summmary_length_words: int,
     ) -> list[ChatMessage]:
+        """
+        Fold the oldest messages of the chat into a summary, keeping the most
+        recent ones which fit in half of `history_token_budget`. An existing
+        summary (from an earlier call) is updated rather than summarized
+        again with the whole chat.
+        """
+        with timed("summarize"):
+            head, request, tail = self._summary_request(chat, summmary_length_words)
+            if request is None:
+                return chat
+            res = self.client.chat(request, self.model, temperature=0.3)
+        count_llm_tokens(res)
+        return head + [self._summary_message(res)] + tail
 
-        if chat[0].role == "system":
-            system_prompt = [chat[0]]
-            chat = chat[1:]
+    def _summary_request(
+        self,
+        chat: list[ChatMessage],
+        summmary_length_words: int,
+    ) -> tuple[list[ChatMessage], list[ChatMessage] | None, list[ChatMessage]]:
+        """
+        Returns the system prompt, the chat to send to the LLM to get the new
+        summary (None if there is nothing to summarize) and the recent
+        messages kept as they are.
+        """
+        if chat and chat[0].role == "system":
+            head, chat = [chat[0]], chat[1:]
         else:
-            system_prompt = []
+            head = []
+        summary = None
+        if chat and chat[0].content.startswith(SUMMARY_PREFIX):
+            summary, chat = chat[0].content[len(SUMMARY_PREFIX):], chat[1:]
+
+        keep_from, tokens = len(chat), 0
+        for i in range(len(chat) - 1, -1, -1):
+            tokens += self.token_counter.count_message(chat[i])
+            if tokens > self.history_token_budget // 2:
+                break
+            keep_from = i
+        # The kept messages must start with a user message, to alternate
+        # with the summary.
+        while keep_from < len(chat) and chat[keep_from].role != "user":
+            keep_from += 1
+        fold, tail = chat[:keep_from], chat[keep_from:]
+        if not fold:
+            return head, None, chat
 
         s = summmary_length_words
-        prompt = f"Summarize our conversation till now under {s} words. "
+        if summary is None:
+            prompt = "Here is a conversation between a user and you:\n\n"
+        else:
+            prompt = "Here is a summary of a conversation between a user and "
+            prompt += f"you:\n\n{summary}\n\nThe conversation continued with:\n\n"
+        for msg in fold:
+            prompt += f"{msg.role.capitalize()}: {msg.content}\n\n"
+        prompt += f"Summarize our conversation till now under {s} words. "
         prompt += "Keep any important pieces of information and user queries "
         prompt += "which may be necessary for future conversations."
-        chat.append(ChatMessage(role="user", content=prompt))
-        res = self.client.chat(chat, self.model, temperature=0.3)
-        return system_prompt + [res.choices[0].message]
+        return head, [ChatMessage(role="user", content=prompt)], tail
+
+    @staticmethod
+    def _summary_message(res: Any) -> ChatMessage:
+        summary = res.choices[0].message.content
+        return ChatMessage(role="assistant", content=SUMMARY_PREFIX + summary)
 
     @staticmethod
     def add_cot_prompt(msg: ChatMessage) -> ChatMessage:
         "Add text to the prompt to engage LLM in Zero-shot Chain of Thought."
-        cot_prompt = "\nLet's think step by step."
-        return ChatMessage(role=msg.role, content=msg.content + cot_prompt)
-
-    def retrieve_similar(self, text: str, count: int, namespace: str) -> list[str]:
-        "Retrieve semantically similar chunks of text from the vector database."
-        embedding = self.embedder.embed(
-            [text],
-            model="voyage-large-2-instruct",
-            input_type="query",
-        ).embeddings[0]
-        matches = self.db.query(namespace=namespace, vector=embedding,
-                                top_k=count, include_metadata=True)["matches"]
-        chunks: list[str] = []
-        for match in matches:
-            md = match["metadata"]
-            chunks.append(f"{md['title']}, source: {md['link']}\n{md['text']}")
-        return chunks
+        return ChatMessage(role=msg.role, content=msg.content + COT_PROMPT)
+
+    def embed_query(self, text: str) -> list[float]:
+        with timed("embed"):
+            return self.embedder.embed(
+                [text],
+                model="voyage-large-2-instruct",
+                input_type="query",
+            ).embeddings[0]
+
+    def retrieve_similar(
+        self,
+        text: str,
+        count: int,
+        namespace: str,
+        embedding: list[float] | None = None,
+        token_budget: int | None = None,
+    ) -> list[str]:
+        """
+        Retrieve semantically similar chunks of text from the vector database.
+        `embedding` of the text is computed if not given. If `token_budget`
+        is given, the texts returned are at most this many tokens in total.
+
+        With a sparse index, `4 * count` candidates are retrieved from each
+        index at the same time, and the `count` best of both are chosen with
+        reciprocal rank fusion. Chunks with the same text are only kept
+        once, and adjacent chunks of a document are merged into one text.
+        """
+        contexts = self._retrieve(text, count, namespace, embedding)
+        if token_budget is None:
+            return [context.text for context in contexts]
+        return self._fit_contexts(contexts, token_budget)
+
+    def _retrieve(
+        self,
+        text: str,
+        count: int,
+        namespace: str,
+        embedding: list[float] | None = None,
+    ) -> list["_Context"]:
+        top_k, sparse = count, None
+        if self.sparse_index is not None:
+            top_k = 4 * count
+            sparse = self._submit(self._retrieve_sparse, text, top_k, namespace)
+        if embedding is None:
+            embedding = self.embed_query(text)
+        with timed("retrieve"):
+            matches = self.db.query(namespace=namespace, vector=embedding,
+                                    top_k=top_k, include_metadata=True)["matches"]
+        if self.min_score is not None:
+            matches = [m for m in matches if m["score"] >= self.min_score]
+        if sparse is not None:
+            matches = _reciprocal_rank_fusion([matches, sparse.result()], self.rrf_k)
+        matches = _unique_texts(matches)[:count]
+        RETRIEVED_CHUNKS.inc(len(matches))
+        contexts: list[_Context] = []
+        for group in _adjacent_chunks(matches):
+            md = group[0]["metadata"]
+            header = f"{md['title']}, source: {md['link']}\n"
+            text = md["text"]
+            for match in group[1:]:
+                text = _join_overlapping(text, match["metadata"]["text"])
+            # Chunks indexed with their number of tokens aren't tokenized
+            # again. The overlaps removed by merging are still counted.
+            tokens = self.token_counter.count_text(header) + sum(
+                m["metadata"].get("tokens")
+                or self.token_counter.count_text(m["metadata"]["text"])
+                for m in group
+            )
+            contexts.append(_Context(header + text, tokens))
+        return contexts
+
+    def _submit(self, fn: Callable[..., T], *args: Any) -> Future[T]:
+        "Run `fn` in the executor, in the context of the caller (e.g. timings)."
+        return self._executor.submit(contextvars.copy_context().run, fn, *args)
+
+    def _context_budget(self, chat: list[ChatMessage]) -> int:
+        "Tokens of the prompt left for the retrieved texts."
+        count = self.token_counter.count_text
+        return (self.prompt_token_budget - self.count_chat_tokens(chat)
+                - count(RAG_PROMPT) - count(RAG_END) - count(COT_PROMPT))
+
+    def _fit_contexts(self, contexts: list["_Context"], budget: int) -> list[str]:
+        """
+        Keep the best contexts which fit in `budget` tokens, trimming the
+        first one which doesn't fit if enough of it does.
+        """
+        texts: list[str] = []
+        separator = self.token_counter.count_text(RAG_SEPARATOR)
+        for context in contexts:
+            budget -= separator
+            if context.tokens <= budget:
+                texts.append(context.text)
+                budget -= context.tokens
+                continue
+            if budget >= MIN_TRIMMED_TOKENS:
+                tokenizer = self.token_counter.tokenizer
+                tokens = tokenizer.encode(context.text, bos=False, eos=False)
+                texts.append(tokenizer.decode(tokens[:budget]))
+            break
+        return texts
+
+    def _retrieve_sparse(self, text: str, count: int, namespace: str) -> list[dict]:
+        with timed("retrieve_sparse"):
+            return self.sparse_index.query(text, namespace, count)["matches"]
+
+
+class _CacheQuery(NamedTuple):
+    context: str
+    embedding: list[float]
+
+
+class _Context(NamedTuple):
+    "A retrieved text, and an upper bound of its number of tokens."
+    text: str
+    tokens: int
+
+
+def _reciprocal_rank_fusion(rankings: list[list[dict]], k: int) -> list[dict]:
+    "Merge lists of matches, scoring each one with the sum of 1 / (k + rank)."
+    scores: dict[str, float] = {}
+    matches: dict[str, dict] = {}
+    for ranking in rankings:
+        for rank, match in enumerate(ranking, 1):
+            scores[match["id"]] = scores.get(match["id"], 0.0) + 1 / (k + rank)
+            matches.setdefault(match["id"], match)
+    return [matches[id] for id in sorted(scores, key=scores.get, reverse=True)]
+
+
+def _unique_texts(matches: list[dict]) -> list[dict]:
+    "Drop the matches whose text is the same as a better one's."
+    texts: set[str] = set()
+    unique = []
+    for match in matches:
+        text = " ".join(match["metadata"]["text"].split())
+        if text not in texts:
+            texts.add(text)
+            unique.append(match)
+    return unique
+
+
+def _adjacent_chunks(matches: list[dict]) -> list[list[dict]]:
+    """
+    Group the matches which are consecutive chunks of the same document,
+    in the order of their chunks. Groups are ordered by their best match.
+    """
+    positions: dict[tuple[str, int], int] = {}
+    for i, match in enumerate(matches):
+        key, sep, index = match["id"].rpartition("#chunk")
+        if sep and index.isdigit():
+            positions[key, int(index)] = i
+
+    groups = []
+    grouped: set[int] = set()
+    for i, match in enumerate(matches):
+        if i in grouped:
+            continue
+        key, sep, index = match["id"].rpartition("#chunk")
+        if not (sep and index.isdigit()):
+            groups.append([match])
+            continue
+        first = last = int(index)
+        while (key, first - 1) in positions:
+            first -= 1
+        while (key, last + 1) in positions:
+            last += 1
+        group = [positions[key, j] for j in range(first, last + 1)]
+        grouped.update(group)
+        groups.append([matches[j] for j in group])
+    return groups
+
+
+def _join_overlapping(a: str, b: str) -> str:
+    """
+    Join consecutive chunks, removing the words they have in common: the
+    longest start of `b` which ends `a`, made of whole words in both.
+    """
+    for n in range(min(len(a), len(b)), MIN_CHUNK_OVERLAP - 1, -1):
+        if a.endswith(b[:n]) and (n == len(a) or a[-n - 1].isspace()) \
+                and (n == len(b) or b[n].isspace()):
+            return a + b[n:]
+    return a + " " + b
@@ -0,0 +1,90 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from collections.abc import Iterator
+from typing import Any, Protocol
+
+from prometheus_client import Counter, Histogram
+from prometheus_client.core import CounterMetricFamily
+
+
+CHAT_STAGE_SECONDS = Histogram(
+    "wordpress_assistant_chat_stage_seconds",
+    "Time spent in every stage of answering a chat.",
+    ["stage"],
+)
+LLM_TOKENS = Counter(
+    "wordpress_assistant_llm_tokens",
+    "Tokens of the LLM's prompts and completions.",
+    ["kind"],
+)
+RETRIEVED_CHUNKS = Counter(
+    "wordpress_assistant_retrieved_chunks",
+    "Chunks of text retrieved from the vector database for chats.",
+)
+
+# Stage timings of the current request, if they are being recorded
+_timings: ContextVar[dict[str, float] | None] = ContextVar("timings", default=None)
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    "Time a stage of answering a chat."
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        CHAT_STAGE_SECONDS.labels(stage).observe(seconds)
+        timings = _timings.get()
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def record_timings() -> Iterator[dict[str, float]]:
+    """
+    Collect the seconds spent in every stage timed in the context, including
+    threads and tasks started from it, into the dictionary yielded.
+    """
+    timings: dict[str, float] = {}
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+
+def count_llm_tokens(res: Any) -> None:
+    "Count the tokens of an LLM response, if it reports them."
+    usage = getattr(res, "usage", None)
+    if usage is not None:
+        LLM_TOKENS.labels("prompt").inc(usage.prompt_tokens)
+        LLM_TOKENS.labels("completion").inc(usage.completion_tokens or 0)
+
+
+class _Cache(Protocol):
+    hits: int
+    misses: int
+
+
+class CacheCollector:
+    """
+    Exposes the hits and misses of caches, as counters labelled with the
+    names of the caches. Register it with `prometheus_client.REGISTRY`.
+    """
+    def __init__(self, caches: dict[str, _Cache]):
+        self.caches = caches
+
+    def collect(self) -> Iterator[CounterMetricFamily]:
+        hits = CounterMetricFamily("wordpress_assistant_cache_hits",
+                                   "Lookups which found a cached value.",
+                                   labels=["cache"])
+        misses = CounterMetricFamily("wordpress_assistant_cache_misses",
+                                     "Lookups which found no cached value.",
+                                     labels=["cache"])
+        for name, cache in self.caches.items():
+            hits.add_metric([name], cache.hits)
+            misses.add_metric([name], cache.misses)
+        yield hits
+        yield misses
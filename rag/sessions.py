@@ -0,0 +1,205 @@
+import abc
+import json
+import time
+import secrets
+import sqlite3
+import threading
+from collections import OrderedDict
+
+
+class ConversationStore(abc.ABC):
+    """
+    Base class of stores keeping the chat history of conversation sessions
+    on the server, so that clients only send the new message of every turn.
+    Sessions unused for `ttl` seconds expire, and the least recently used
+    ones are evicted beyond `max_sessions`.
+
+    Every chat stored has a version, so that a turn can be saved only if no
+    other turn changed the session since its chat was read.
+    """
+    def __init__(self, ttl: float, max_sessions: int):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+
+    def create(self, messages: list[dict[str, str]] | None = None) -> str:
+        "Start a session, optionally with initial messages, and get its ID."
+        session_id = secrets.token_hex(16)
+        self.put(session_id, messages or [])
+        return session_id
+
+    def get(self, session_id: str) -> list[dict[str, str]] | None:
+        "Get the chat of a session, or None if it doesn't exist or expired."
+        entry = self.get_versioned(session_id)
+        return None if entry is None else entry[0]
+
+    @abc.abstractmethod
+    def get_versioned(self, session_id: str) -> tuple[list[dict[str, str]], int] | None:
+        "Like `get`, also returning the version of the chat."
+
+    @abc.abstractmethod
+    def put(
+        self,
+        session_id: str,
+        messages: list[dict[str, str]],
+        version: int | None = None,
+    ) -> bool:
+        """
+        Replace the chat of a session. If `version` is given, the chat is
+        only replaced if it is still of this version, and False is returned
+        if it was changed, deleted or expired instead.
+        """
+
+    @abc.abstractmethod
+    def delete(self, session_id: str) -> None:
+        "End a session."
+
+
+class InMemoryConversationStore(ConversationStore):
+    "In-process store, lost when the server restarts."
+
+    def __init__(self, ttl: float = 24 * 60 * 60, max_sessions: int = 10_000):
+        """
+        Args:
+            ttl: Seconds after its last use for a session to expire.
+            max_sessions: Maximum number of sessions kept.
+        """
+        super().__init__(ttl, max_sessions)
+        # Key: Session ID. Value: (messages, last used time, version)
+        self._sessions: OrderedDict[
+            str, tuple[list[dict[str, str]], float, int]
+        ] = OrderedDict()
+
+    def get_versioned(self, session_id: str) -> tuple[list[dict[str, str]], int] | None:
+        with self._lock:
+            entry = self._live_entry(session_id, time.time())
+            if entry is None:
+                return None
+            messages, _, version = entry
+            self._sessions[session_id] = (messages, time.time(), version)
+            self._sessions.move_to_end(session_id)
+            return list(messages), version
+
+    def put(
+        self,
+        session_id: str,
+        messages: list[dict[str, str]],
+        version: int | None = None,
+    ) -> bool:
+        now = time.time()
+        with self._lock:
+            entry = self._live_entry(session_id, now)
+            if version is not None and (entry is None or entry[2] != version):
+                return False
+            new_version = 0 if entry is None else entry[2] + 1
+            self._sessions[session_id] = (list(messages), now, new_version)
+            self._sessions.move_to_end(session_id)
+            # Sessions are ordered by last use, so expired ones come first
+            while self._sessions:
+                oldest_id, (_, last_used, _) = next(iter(self._sessions.items()))
+                if (now - last_used <= self.ttl
+                        and len(self._sessions) <= self.max_sessions):
+                    break
+                del self._sessions[oldest_id]
+        return True
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def _live_entry(
+        self,
+        session_id: str,
+        now: float,
+    ) -> tuple[list[dict[str, str]], float, int] | None:
+        "The entry of a session, or None if it doesn't exist or expired."
+        entry = self._sessions.get(session_id)
+        if entry is not None and now - entry[1] > self.ttl:
+            del self._sessions[session_id]
+            return None
+        return entry
+
+
+class SQLiteConversationStore(ConversationStore):
+    "Store persisted in a SQLite database, shareable by server processes."
+
+    def __init__(
+        self,
+        path: str,
+        ttl: float = 24 * 60 * 60,
+        max_sessions: int = 100_000,
+    ):
+        """
+        Args:
+            path: Path of the SQLite database file.
+            ttl: Seconds after its last use for a session to expire.
+            max_sessions: Maximum number of sessions kept.
+        """
+        super().__init__(ttl, max_sessions)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                " id TEXT PRIMARY KEY,"
+                " messages TEXT NOT NULL,"
+                " last_used REAL NOT NULL,"
+                " version INTEGER NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS sessions_last_used"
+                " ON sessions (last_used)"
+            )
+
+    def get_versioned(self, session_id: str) -> tuple[list[dict[str, str]], int] | None:
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT messages, version FROM sessions"
+                " WHERE id = ? AND last_used >= ?",
+                (session_id, now - self.ttl)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE sessions SET last_used = ? WHERE id = ?", (now, session_id)
+            )
+        return json.loads(row[0]), row[1]
+
+    def put(
+        self,
+        session_id: str,
+        messages: list[dict[str, str]],
+        version: int | None = None,
+    ) -> bool:
+        now = time.time()
+        with self._lock, self._conn:
+            if version is not None:
+                # Checked and written at once, as other processes may write
+                updated = self._conn.execute(
+                    "UPDATE sessions SET messages = ?, last_used = ?,"
+                    " version = version + 1"
+                    " WHERE id = ? AND version = ? AND last_used >= ?",
+                    (json.dumps(messages), now, session_id, version, now - self.ttl)
+                ).rowcount
+                if not updated:
+                    return False
+            else:
+                self._conn.execute(
+                    "INSERT INTO sessions VALUES (?, ?, ?, 0)"
+                    " ON CONFLICT (id) DO UPDATE SET messages = excluded.messages,"
+                    " last_used = excluded.last_used, version = version + 1",
+                    (session_id, json.dumps(messages), now)
+                )
+            self._conn.execute(
+                "DELETE FROM sessions WHERE last_used < ?", (now - self.ttl,)
+            )
+            self._conn.execute(
+                "DELETE FROM sessions WHERE id IN (SELECT id FROM sessions"
+                " ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_sessions,)
+            )
+        return True
+
+    def delete(self, session_id: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
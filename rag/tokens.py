@@ -0,0 +1,93 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from mistral_common.tokens.tokenizers.mistral import MistralTokenizer
+    from mistralai.models.chat_completion import ChatMessage
+
+
+_mistral_tokenizer: "MistralTokenizer | None" = None
+_lock = threading.Lock()
+
+
+def mistral_tokenizer() -> "MistralTokenizer":
+    "The tokenizer of the Mistral models, loaded when first needed and shared."
+    global _mistral_tokenizer
+    with _lock:
+        if _mistral_tokenizer is None:
+            from mistral_common.tokens.tokenizers.mistral import MistralTokenizer
+            _mistral_tokenizer = MistralTokenizer.v3()
+        return _mistral_tokenizer
+
+
+class TokenCounter:
+    """
+    Counts the tokens of chats in the Mistral instruct format, caching the
+    count of every message so that only new messages are tokenized.
+    """
+    # Tokens added around the content of a message by the chat template:
+    # '[INST] {user} [/INST]', '{assistant}</s>', and the system prompt is
+    # joined to a user message with two newlines (about two tokens, as the
+    # tokenizer can merge across the join).
+    MESSAGE_OVERHEAD = {"user": 2, "assistant": 1, "system": 2}
+
+    def __init__(
+        self,
+        tokenizer: "MistralTokenizer | None" = None,
+        max_entries: int = 100_000,
+    ):
+        """
+        Args:
+            tokenizer: Tokenizer of the LLM. Defaults to the shared
+                `mistral_tokenizer()`, loaded when first needed.
+            max_entries: Maximum number of message counts cached.
+        """
+        self._mistral_tokenizer = tokenizer
+        self.max_entries = max_entries
+        self._counts: OrderedDict[bytes, int] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def tokenizer(self):
+        "Tokenizer of the text of messages."
+        if self._mistral_tokenizer is None:
+            self._mistral_tokenizer = mistral_tokenizer()
+        return self._mistral_tokenizer.instruct_tokenizer.tokenizer
+
+    def count_text(self, text: str) -> int:
+        key = hashlib.blake2b(text.encode(), digest_size=16).digest()
+        with self._lock:
+            if key in self._counts:
+                self._counts.move_to_end(key)
+                return self._counts[key]
+        count = len(self.tokenizer.encode(text, bos=False, eos=False))
+        with self._lock:
+            self._counts[key] = count
+            if len(self._counts) > self.max_entries:
+                self._counts.popitem(last=False)
+        return count
+
+    def count_message(self, msg: "ChatMessage") -> int:
+        return self.count_text(msg.content) + self.MESSAGE_OVERHEAD.get(msg.role, 0)
+
+    def count_chat(self, chat: list["ChatMessage"]) -> int:
+        """
+        Count the tokens of a chat, as sent to the LLM for a new response.
+
+        The system messages are joined to the last user message, as in
+        `MistralTokenizer.encode_chat_completion`, and this text is counted
+        as a whole, since the tokenizer merges across the join.
+        """
+        system_prompt = "\n\n".join(msg.content for msg in chat if msg.role == "system")
+        messages = [msg for msg in chat if msg.role != "system"]
+        if messages and messages[-1].role == "user":
+            last_user_msg = messages.pop().content
+        else:
+            # An empty user message is needed to prompt a response
+            last_user_msg = ""
+        if system_prompt:
+            last_user_msg = system_prompt + "\n\n" + last_user_msg
+        return (1 + sum(self.count_message(msg) for msg in messages)
+                + self.count_text(last_user_msg) + self.MESSAGE_OVERHEAD["user"])
@@ -1,3 +1,4 @@
+from datetime import datetime, timedelta, timezone
 from urllib.parse import parse_qs
 from httmock import response, all_requests
 
@@ -35,3 +36,66 @@ def mock_wordpress_api(url, request):
         for item in res_json:
             item["title"] = {"rendered": f"{content_type} mock title"}
     return response(200, res_json, headers={"X-WP-TotalPages": 3})
+
+
+class MockWordPressSite:
+    """
+    A mock WordPress site whose content can be changed between builds.
+    Use `MockWordPressSite.api` as the HTTMock handler.
+    """
+    def __init__(self, gmt_offset: float = -5):
+        """
+        Args:
+            gmt_offset: Offset of the site's time zone from UTC, in hours.
+        """
+        self.gmt_offset = gmt_offset
+        self.items: dict[str, dict[int, dict]] = {
+            "pages": {}, "posts": {}, "comments": {}
+        }
+        self.api = all_requests(self._handle)
+
+    def set_item(self, content_type: str, id: int, content: str,
+                 modified: str | None = None):
+        """
+        Add or change an item, modified at `modified` in the site's time
+        zone. Defaults to now.
+        """
+        offset = timedelta(hours=self.gmt_offset)
+        if modified is None:
+            modified = (datetime.now(timezone.utc) + offset).strftime("%Y-%m-%dT%H:%M:%S")
+        modified_gmt = (datetime.fromisoformat(modified) - offset).isoformat()
+        self.items[content_type + "s"][id] = {
+            "id": id,
+            "type": content_type,
+            "title": {"rendered": f"{content_type} {id}"},
+            "link": f"https://www.example.com/{content_type}/{id}",
+            "content": {"rendered": content},
+            "modified": modified,
+            "modified_gmt": modified_gmt,
+        }
+
+    def remove_item(self, content_type: str, id: int):
+        del self.items[content_type + "s"][id]
+
+    def _handle(self, url, request):
+        if not "/wp-json" in url.path:
+            return mock_wordpress_api(url, request)
+        if not "/wp/v2" in url.path:
+            return response(200, {"namespaces": ["wp/v2"], "gmt_offset": self.gmt_offset})
+
+        qs = parse_qs(url.query)
+        content_type = url.path.rstrip("/").split("/")[-1]
+        items = list(self.items[content_type].values())
+        if "modified_after" in qs:
+            # Compared to the date in the site's time zone, as WordPress does
+            items = [i for i in items if i["modified"] > qs["modified_after"][0]]
+        if "_fields" in qs:
+            fields = qs["_fields"][0].split(",")
+            items = [{f: i[f] for f in fields} for i in items]
+
+        per_page, page = int(qs["per_page"][0]), int(qs["page"][0])
+        total_pages = max(1, -(-len(items) // per_page))
+        if page > total_pages:
+            return response(400, {"code": "rest_post_invalid_page_number"})
+        items = items[(page - 1) * per_page:page * per_page]
+        return response(200, items, headers={"X-WP-TotalPages": total_pages})
@@ -0,0 +1,295 @@
+import os
+import json
+import time
+import tempfile
+import threading
+import unittest as ut
+from unittest import mock
+
+from dbbuilder.ratelimit import TenantLimiter
+
+AUTH_KEY = "test-auth-key"
+
+app = None
+_tmpdir = None
+_environ = None
+
+
+def setUpModule():
+    # The app reads its configuration when it is imported
+    global app, _tmpdir, _environ
+    _tmpdir = tempfile.TemporaryDirectory()
+    paths = {
+        "LOCAL_VECTOR_STORE_PATH": "vector_store",
+        "EMBEDDING_CACHE_PATH": "embedding_cache.db",
+        "SYNC_STATE_PATH": "sync_state.db",
+        "NAMESPACE_REGISTRY_PATH": "namespaces.db",
+        "CHECKPOINT_DIR": "checkpoints",
+    }
+    _environ = mock.patch.dict(os.environ, {
+        "VECTOR_STORE": "local",
+        "VOYAGE_API_KEY": "voyage-key",
+        "MISTRAL_API_KEY": "mistral-key",
+        "AUTH_KEY": AUTH_KEY,
+    } | {key: os.path.join(_tmpdir.name, name) for key, name in paths.items()})
+    _environ.start()
+    import app
+
+
+def tearDownModule():
+    _environ.stop()
+    _tmpdir.cleanup()
+
+
+class AppTestCase(ut.TestCase):
+    "Requests to the app, whose API clients are never created."
+
+    def setUp(self):
+        self.client = app.app.test_client()
+        self.headers = {"Authorization": f"Bearer {AUTH_KEY}"}
+
+    def wait_for_job(self, job_id: str, timeout: float = 5) -> None:
+        deadline = time.monotonic() + timeout
+        while not app.BUILD_JOBS.get(job_id).done:
+            self.assertLess(time.monotonic(), deadline, "The build didn't finish")
+            time.sleep(0.01)
+
+
+class MockChatbot:
+    "Stands in for `WordPressRAG`, answering every chat with the same message."
+
+    def __init__(self, answer: str = "We open at 9 AM."):
+        self.answer = answer
+
+    def generate(self, site_domain, chat_input, temperature=None):
+        return chat_input + [{"role": "assistant", "content": self.answer}]
+
+    def generate_stream(self, site_domain, chat_input, temperature=None):
+        yield "context", []
+        yield "token", self.answer
+        yield "done", self.generate(site_domain, chat_input, temperature)
+
+
+def parse_events(body: str) -> list[tuple[str, object]]:
+    "Parse a stream of server-sent events into (name, data) tuples."
+    events = []
+    for event in body.strip().split("\n\n"):
+        name, data = event.split("\n")
+        events.append((name.removeprefix("event: "),
+                       json.loads(data.removeprefix("data: "))))
+    return events
+
+
+class BlockedBuild:
+    "Stands in for `build_vector_database`, running until it is released."
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.site_urls = []
+
+    def __call__(self, site_url, *args, **kwargs):
+        self.site_urls.append(site_url)
+        self.started.set()
+        self.release.wait(5)
+
+
+class TestDatabaseBuilds(AppTestCase):
+
+    def test_build_jobs(self):
+        site = {"site_url": "https://jobs.example.com"}
+        build = BlockedBuild()
+        with mock.patch.object(app, "build_vector_database", build):
+            res = self.client.post("/db", headers=self.headers,
+                                   json=site | {"create_if_not_present": True})
+            self.assertEqual(res.status_code, 202)
+            job_id = res.json["job_id"]
+            self.assertTrue(build.started.wait(5))
+
+            # Requests for a build while it runs are merged into it
+            res = self.client.post("/db", headers=self.headers,
+                                   json=site | {"update_if_present": True})
+            self.assertEqual(res.status_code, 202)
+            self.assertEqual(res.json["job_id"], job_id)
+            res = self.client.post("/db", headers=self.headers, json=site)
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(res.json["job_id"], job_id)
+
+            res = self.client.get(f"/db/jobs/{job_id}", headers=self.headers)
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(res.json["site_domain"], "jobs.example.com")
+            self.assertEqual(res.json["status"], "running")
+
+            res = self.client.delete("/db", headers=self.headers, json=site)
+            self.assertEqual(res.status_code, 409)
+
+            build.release.set()
+            self.wait_for_job(job_id)
+        self.assertEqual(build.site_urls, [site["site_url"]])
+
+        res = self.client.get(f"/db/jobs/{job_id}", headers=self.headers)
+        self.assertEqual(res.json["status"], "succeeded")
+        res = self.client.post("/db", headers=self.headers, json=site)
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res.json["database_present"])
+        self.assertNotIn("job_id", res.json)
+
+        res = self.client.delete("/db", headers=self.headers, json=site)
+        self.assertEqual(res.status_code, 200)
+        res = self.client.post("/db", headers=self.headers, json=site)
+        self.assertFalse(res.json["database_present"])
+
+    def test_unknown_job(self):
+        res = self.client.get("/db/jobs/unknown", headers=self.headers)
+        self.assertEqual(res.status_code, 404)
+
+    def test_unauthorized(self):
+        res = self.client.get("/db/jobs/unknown")
+        self.assertEqual(res.status_code, 401)
+
+    def test_database_status(self):
+        site = {"site_url": "https://status.example.com"}
+        res = self.client.get("/db", headers=self.headers, query_string=site)
+        self.assertEqual(res.status_code, 404)
+
+        build = BlockedBuild()
+        with mock.patch.object(app, "build_vector_database", build):
+            res = self.client.post("/db", headers=self.headers,
+                                   json=site | {"create_if_not_present": True})
+            job_id = res.json["job_id"]
+            self.assertTrue(build.started.wait(5))
+            res = self.client.get("/db", headers=self.headers, query_string=site)
+            self.assertEqual(res.status_code, 200)
+            [database] = res.json["databases"]
+            self.assertEqual(database["namespace"], "status.example.com")
+            self.assertEqual(database["status"], "building")
+            self.assertFalse(database["database_present"])
+            self.assertEqual(database["job_id"], job_id)
+
+            build.release.set()
+            self.wait_for_job(job_id)
+
+        res = self.client.get("/db", headers=self.headers)
+        databases = {db["namespace"]: db for db in res.json["databases"]}
+        database = databases["status.example.com"]
+        self.assertEqual(database["status"], "complete")
+        self.assertTrue(database["database_present"])
+        self.assertIsNotNone(database["built_at"])
+        self.assertIsNone(database["job_id"])
+
+        res = self.client.get("/db", headers=self.headers,
+                              query_string={"site_url": "not a url"})
+        self.assertEqual(res.status_code, 400)
+
+
+class TestLimits(AppTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.chat = {"site_url": "https://limits.example.com",
+                     "messages": [{"role": "user", "content": "When do you open?"}]}
+
+    def test_concurrent_chats(self):
+        limiter = TenantLimiter(max_concurrent=1)
+        with mock.patch.object(app, "CHAT_LIMITER", limiter), \
+                mock.patch.object(app, "CHATBOT", MockChatbot()):
+            stream = self.client.post("/chat", headers=self.headers,
+                                      json=self.chat | {"stream": True},
+                                      buffered=False)
+            self.assertEqual(stream.status_code, 200)
+            # The streamed chat is in flight until its response is closed
+            self.assertEqual(limiter.active("limits.example.com"), 1)
+            res = self.client.post("/chat", headers=self.headers, json=self.chat)
+            self.assertEqual(res.status_code, 429)
+            self.assertEqual(res.headers["Retry-After"], "1")
+            self.assertIn("limits.example.com", res.json["message"])
+
+            events = parse_events(stream.get_data(as_text=True))
+            self.assertEqual([name for name, _ in events], ["context", "token", "done"])
+            self.assertEqual(limiter.active("limits.example.com"), 1)
+            stream.close()
+            self.assertEqual(limiter.active("limits.example.com"), 0)
+            res = self.client.post("/chat", headers=self.headers, json=self.chat)
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(res.json[-1]["content"], "We open at 9 AM.")
+        self.assertEqual(limiter.active("limits.example.com"), 0)
+
+    def test_database_requests_per_minute(self):
+        site = {"site_url": "https://limits.example.com"}
+        limiter = TenantLimiter(requests_per_minute=1)
+        with mock.patch.object(app, "DB_LIMITER", limiter):
+            res = self.client.post("/db", headers=self.headers, json=site)
+            self.assertEqual(res.status_code, 200)
+            res = self.client.post("/db", headers=self.headers, json=site)
+            self.assertEqual(res.status_code, 429)
+            self.assertEqual(res.headers["Retry-After"], "60")
+            # Other sites have limits of their own
+            res = self.client.post("/db", headers=self.headers,
+                                   json={"site_url": "https://other.example.com"})
+            self.assertEqual(res.status_code, 200)
+
+
+class TestChatSessions(AppTestCase):
+
+    def test_session(self):
+        system = {"role": "system", "content": "Be brief."}
+        question = {"role": "user", "content": "When do you open?"}
+        answer = {"role": "assistant", "content": "We open at 9 AM."}
+        res = self.client.post("/chat/sessions", headers=self.headers,
+                               json={"messages": [system]})
+        self.assertEqual(res.status_code, 201)
+        session_id = res.json["session_id"]
+
+        with mock.patch.object(app, "CHATBOT", MockChatbot()):
+            res = self.client.post("/chat", headers=self.headers,
+                                   json={"session_id": session_id, "message": question})
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(res.json, {"session_id": session_id, "message": answer})
+
+            res = self.client.post("/chat", headers=self.headers,
+                                   json={"session_id": session_id, "message": question,
+                                         "stream": True})
+            events = parse_events(res.get_data(as_text=True))
+            self.assertEqual(events[-1], ("done", {"session_id": session_id,
+                                                   "message": answer}))
+
+            res = self.client.post("/chat", headers=self.headers,
+                                   json={"session_id": session_id})
+            self.assertEqual(res.status_code, 400)
+            res = self.client.post("/chat", headers=self.headers,
+                                   json={"session_id": "unknown", "message": question})
+            self.assertEqual(res.status_code, 404)
+
+        res = self.client.get(f"/chat/sessions/{session_id}", headers=self.headers)
+        self.assertEqual(res.json["messages"], [system] + [question, answer] * 2)
+        res = self.client.delete(f"/chat/sessions/{session_id}", headers=self.headers)
+        self.assertEqual(res.status_code, 200)
+        res = self.client.get(f"/chat/sessions/{session_id}", headers=self.headers)
+        self.assertEqual(res.status_code, 404)
+
+    def test_concurrent_turns(self):
+        question = {"role": "user", "content": "When do you open?"}
+        session_id = self.client.post("/chat/sessions",
+                                      headers=self.headers).json["session_id"]
+        other_turn = [question, {"role": "assistant", "content": "At 9 AM."}]
+
+        class RacedChatbot(MockChatbot):
+            def generate(self, *args, **kwargs):
+                # Another turn of the session is saved while this one runs
+                app.CONVERSATIONS.put(session_id, other_turn)
+                return super().generate(*args, **kwargs)
+
+        with mock.patch.object(app, "CHATBOT", RacedChatbot()):
+            res = self.client.post("/chat", headers=self.headers,
+                                   json={"session_id": session_id, "message": question})
+            self.assertEqual(res.status_code, 409)
+
+            res = self.client.post("/chat", headers=self.headers,
+                                   json={"session_id": session_id, "message": question,
+                                         "stream": True})
+            events = parse_events(res.get_data(as_text=True))
+            self.assertEqual(events[-1][0], "error")
+            self.assertNotIn("done", [name for name, _ in events])
+
+        res = self.client.get(f"/chat/sessions/{session_id}", headers=self.headers)
+        self.assertEqual(res.json["messages"], other_turn)
@@ -1,12 +1,23 @@
+import os
 import re
+import tempfile
 import unittest as ut
 from random import random
+from unittest.mock import patch
 
+import numpy as np
 from httmock import HTTMock
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
-from dbbuilder.build import build_vector_database
-from tests.helpers import mock_wordpress_api
+from dbbuilder.build import (
+    build_vector_database, load_index_bundle, _Chunk, _extract_pool, _upsert_batches
+)
+from dbbuilder.checkpoint import BuildCheckpoint
+from dbbuilder.progress import BuildProgress
+from dbbuilder.ratelimit import estimate_tokens
+from dbbuilder.state import DocumentState, SyncState
+from vectorstore import BM25Index, BundleWriter, IndexBundle
+from tests.helpers import mock_wordpress_api, MockWordPressSite
 
 
 class TestBuildFunctions(ut.TestCase):
@@ -37,6 +48,222 @@ class TestBuildFunctions(ut.TestCase):
 
         self.assertTrue(all(is_present.values()))
 
+    def test_build_vector_database_sync(self):
+        site = MockWordPressSite()
+        paragraphs = [f"Paragraph {i} " + "lorem ipsum " * 10 for i in range(4)]
+        for i in range(3):
+            site.set_item("post", i, "<p>" + "</p><p>".join(paragraphs) + "</p>",
+                          "2024-01-01T00:00:00")
+        # Later than the changes below, as if it was modified during the build
+        site.set_item("page", 4, "<p>" + "</p><p>".join(paragraphs[:2]) + "</p>",
+                      "2100-01-01T00:00:00")
+        site.set_item("comment", 5, "<p>" + paragraphs[0] + "</p>",
+                      "2024-01-01T00:00:00")
+        splitter = RecursiveCharacterTextSplitter(chunk_size=140, chunk_overlap=0)
+        state = SyncState()
+        database = MockDatabase()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        sparse_index = BM25Index(tmp.name)
+
+        def build():
+            with HTTMock(site.api):
+                build_vector_database("https://www.example.com", splitter,
+                                      MockEmbedder(8), database,
+                                      extract_processes=0, state=state,
+                                      sparse_index=sparse_index, count_tokens=len)
+
+        def sparse_ids(text):
+            return sorted(m["id"] for m in sparse_index.query(
+                text, "www.example.com", 100
+            )["matches"])
+
+        build()
+        self.assertEqual(len(database.vectors), 14)
+        for v in database.vectors:
+            self.assertEqual(v["metadata"]["tokens"], len(v["metadata"]["text"]))
+        self.assertEqual(database.deleted, [])
+
+        # Second post loses its last paragraph, and its first one changes
+        changed = ["Changed " + paragraphs[0]] + paragraphs[1:3]
+        site.set_item("post", 1, "<p>" + "</p><p>".join(changed) + "</p>")
+        site.remove_item("post", 2)
+        database.vectors = []
+        build()
+        # Fetched, though modified before the last modification indexed
+        self.assertEqual([v["id"] for v in database.vectors], ["posts/1#chunk0"])
+        self.assertEqual(sorted(database.deleted), [
+            "posts/1#chunk3", "posts/2#chunk0", "posts/2#chunk1",
+            "posts/2#chunk2", "posts/2#chunk3",
+        ])
+        docs = state.documents("www.example.com")
+        self.assertEqual(set(docs), {"pages/4", "posts/0", "posts/1", "comments/5"})
+        self.assertEqual(len(docs["posts/1"].chunk_hashes), 3)
+        self.assertEqual(sparse_ids("Changed"), ["posts/1#chunk0"])
+        self.assertEqual(sparse_ids("3"), ["posts/0#chunk3"])
+
+        # Nothing changed
+        database.vectors, database.deleted = [], []
+        build()
+        self.assertEqual(database.vectors, [])
+        self.assertEqual(database.deleted, [])
+
+    def test_build_vector_database_from_documents(self):
+        documents = [{"id": str(i), "type": "post", "title": f"Post {i}",
+                      "link": f"https://www.example.com/post/{i}/",
+                      "content": f"<p>Post {i} " + "lorem ipsum " * 30 + "</p>",
+                      "modified": "2024-01-01T00:00:00"} for i in range(5)]
+        splitter = RecursiveCharacterTextSplitter(chunk_size=200, chunk_overlap=0)
+        state = SyncState()
+        database = MockDatabase()
+
+        def build(documents):
+            # Without a site to request
+            with HTTMock(lambda url, request: {"status_code": 500}):
+                build_vector_database("https://www.example.com", splitter,
+                                      MockEmbedder(8), database,
+                                      extract_processes=0, state=state,
+                                      documents=[d.copy() for d in documents])
+
+        build(documents)
+        self.assertEqual(database.namespace, "www.example.com")
+        self.assertEqual({v["id"].split("#")[0] for v in database.vectors},
+                         {f"posts/{i}" for i in range(5)})
+        self.assertNotIn("<p>", database.vectors[0]["metadata"]["text"])
+
+        # Documents missing from the export are removed
+        database.vectors = []
+        build(documents[:4])
+        self.assertEqual(database.vectors, [])
+        self.assertEqual(sorted(database.deleted),
+                         ["posts/4#chunk0", "posts/4#chunk1"])
+        self.assertEqual(len(state.documents("www.example.com")), 4)
+
+    def test_build_vector_database_extract_processes(self):
+        documents = [{"id": str(i), "type": "post", "title": f"Post {i}",
+                      "link": f"https://www.example.com/post/{i}/",
+                      "content": f"<p>Post {i} " + "lorem ipsum " * 30 + "</p>",
+                      "modified": "2024-01-01T00:00:00"} for i in range(40)]
+        splitter = RecursiveCharacterTextSplitter(chunk_size=200, chunk_overlap=0)
+        pool = _extract_pool(2)
+        for _ in range(2):
+            database = MockDatabase()
+            build_vector_database("https://www.example.com", splitter,
+                                  MockEmbedder(8), database, extract_processes=2,
+                                  documents=[d.copy() for d in documents])
+            self.assertEqual(len({v["id"].split("#")[0] for v in database.vectors}), 40)
+            self.assertFalse(any("<p>" in v["metadata"]["text"] for v in database.vectors))
+        # Shared by the builds, and not forked from this process
+        self.assertIs(_extract_pool(2), pool)
+        self.assertIn(pool._mp_context.get_start_method(), ["forkserver", "spawn"])
+
+    def test_build_vector_database_batches_and_retries(self):
+        site = MockWordPressSite()
+        for i in range(10):
+            site.set_item("post", i, f"<p>Post {i} " + "lorem ipsum " * 40 + "</p>",
+                          "2024-01-01T00:00:00")
+        splitter = RecursiveCharacterTextSplitter(chunk_size=100, chunk_overlap=0)
+        embedder = FlakyEmbedder(8, failures=2)
+        database = FlakyDatabase(failures=1)
+        # About 40 tokens per chunk, so 3 or 4 chunks per batch
+        with HTTMock(site.api), patch("dbbuilder.build.EMBEDDING_BATCH_TOKENS", 130):
+            build_vector_database("https://www.example.com", splitter, embedder,
+                                  database, extract_processes=0, backoff=0)
+
+        self.assertEqual(len(database.vectors), 60)
+        self.assertEqual(len({v["id"] for v in database.vectors}), 60)
+        for batch in embedder.batches:
+            self.assertLessEqual(sum(map(estimate_tokens, batch)), 130)
+        self.assertGreater(len(embedder.batches), 60 / 5)
+        # Only the failed requests were repeated
+        self.assertEqual(sum(map(len, embedder.batches)), 60)
+
+    def test_build_vector_database_resume(self):
+        site = MockWordPressSite()
+        for i in range(350):
+            site.set_item("post", i, f"<p>Post {i} " + "lorem ipsum " * 20 + "</p>",
+                          "2024-01-01T00:00:00")
+        splitter = RecursiveCharacterTextSplitter(chunk_size=140, chunk_overlap=0)
+        embedder = FlakyEmbedder(8, failures=0)
+        state = SyncState()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = os.path.join(tmp.name, "www.example.com.jsonl")
+
+        def build(database):
+            progress = BuildProgress()
+            checkpoint = BuildCheckpoint(path)
+            try:
+                with HTTMock(site.api):
+                    build_vector_database(
+                        "https://www.example.com", splitter, embedder, database,
+                        extract_processes=0, embed_workers=1, upsert_workers=1,
+                        state=state, progress=progress, max_retries=0,
+                        checkpoint=checkpoint,
+                    )
+            finally:
+                checkpoint.close()
+            return progress
+
+        # 2 chunks per post, in batches of 128: fails after 256 posts are done
+        database = FlakyDatabase(failures=0, successes=4)
+        with self.assertRaises(ConnectionError):
+            build(database)
+        self.assertTrue(BuildCheckpoint.is_pending(path))
+        self.assertEqual(state.documents("www.example.com"), {})
+        self.assertEqual(len(BuildCheckpoint(path).documents), 256)
+
+        resumed = MockDatabase()
+        progress = build(resumed)
+        self.assertFalse(os.path.exists(path))
+        # Only the pages from the one before the first with pending posts
+        self.assertEqual(progress.counts["documents_fetched"], 250)
+        ids = [v["id"] for v in database.vectors + resumed.vectors]
+        self.assertEqual(len(set(ids)), 700)
+        # Chunks embedded before the failure were not embedded again
+        self.assertEqual(sum(map(len, embedder.batches)), 700)
+        self.assertEqual(len(state.documents("www.example.com")), 350)
+
+    def test_upsert_batches(self):
+        chunks = [_Chunk("posts/1", "Post", "link", i, "x" * 500) for i in range(250)]
+        values = np.zeros((250, 1024), dtype=np.float32)
+        batches = list(_upsert_batches(chunks, values))
+        self.assertEqual(sum((b[0] for b in batches), []), chunks)
+        self.assertEqual(sum(len(b[1]) for b in batches), 250)
+        self.assertTrue(all(24 * 1024 * len(b[0]) < 2_000_000 for b in batches))
+        self.assertEqual(len(batches), 4)
+
+
+    def test_load_index_bundle(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        writer = BundleWriter(os.path.join(tmp.name, "bundle"), "www.example.com")
+        writer.upsert([{"id": f"posts/{i}#chunk{j}", "values": [random()] * 1024,
+                        "metadata": {"title": "Post", "link": "link", "text": "x" * 500}}
+                       for i in range(100) for j in range(2)])
+        writer.close()
+        bundle = IndexBundle(writer.path)
+        # Post 0 had 3 chunks, post 100 was removed
+        previous = [DocumentState("posts/0", "", "", ["h"] * 3),
+                    DocumentState("posts/1", "", "", ["h"] * 2),
+                    DocumentState("posts/100", "", "", ["h"])]
+
+        database = FlakyDatabase(failures=0, successes=1)
+        with self.assertRaises(ConnectionError):
+            load_index_bundle(bundle, database, previous, max_retries=1, backoff=0)
+        # Nothing deleted before all the vectors are upserted
+        self.assertEqual(database.deleted, [])
+
+        database = FlakyDatabase(failures=2)
+        sparse_index = BM25Index(os.path.join(tmp.name, "bm25"))
+        load_index_bundle(bundle, database, previous, sparse_index, backoff=0)
+        self.assertEqual(sorted(v["id"] for v in database.vectors), sorted(bundle.ids))
+        self.assertEqual(sorted(database.deleted), ["posts/0#chunk2", "posts/100#chunk0"])
+        self.assertEqual(database.namespace, "www.example.com")
+        # Batches fit in an upsert request
+        self.assertGreater(database.upserts, 1)
+        res = sparse_index.query("x" * 500, "www.example.com", top_k=300)
+        self.assertEqual(len(res["matches"]), 200)
 
 class MockEmbedder:
 
@@ -61,7 +288,47 @@ class MockDatabase:
 
     def __init__(self):
         self.vectors = []
+        self.deleted = []
+        self.upserts = 0
 
     def upsert(self, vectors, namespace, batch_size = None, show_progress = True) -> None:
         self.vectors += vectors
+        self.upserts += 1
+        self.namespace = namespace
+
+    def delete(self, ids = None, delete_all = None, namespace = None) -> None:
+        self.deleted += ids
         self.namespace = namespace
+
+
+class FlakyEmbedder(MockEmbedder):
+    "Fails the first `failures` requests."
+
+    def __init__(self, embedding_size: int, failures: int):
+        super().__init__(embedding_size)
+        self.failures = failures
+        self.batches = []
+
+    def embed(self, texts, model, input_type) -> MockEmbedder.Embeddings:
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("Rate limit exceeded")
+        self.batches.append(texts)
+        return super().embed(texts, model, input_type)
+
+
+class FlakyDatabase(MockDatabase):
+    "Fails the first `failures` requests, and every request after `successes`."
+
+    def __init__(self, failures: int, successes: int | None = None):
+        super().__init__()
+        self.failures = failures
+        self.successes = successes
+
+    def upsert(self, vectors, namespace, batch_size = None, show_progress = True) -> None:
+        if self.failures or self.successes == 0:
+            self.failures = max(0, self.failures - 1)
+            raise ConnectionError("Service unavailable")
+        if self.successes is not None:
+            self.successes -= 1
+        super().upsert(vectors, namespace)
@@ -0,0 +1,76 @@
+import os
+import tempfile
+import unittest as ut
+
+from dbbuilder.cache import (
+    CachedEmbedder, LRUEmbeddingCache, SQLiteEmbeddingCache,
+    TieredEmbeddingCache, embedding_key,
+)
+
+
+class CountingEmbedder:
+
+    class Embeddings:
+        pass
+
+    def __init__(self):
+        self.embedded = []
+
+    def embed(self, texts, model, input_type):
+        self.embedded += texts
+        output = CountingEmbedder.Embeddings()
+        output.embeddings = [[float(len(t)), 0.5] for t in texts]
+        return output
+
+
+class TestCacheFunctions(ut.TestCase):
+
+    def test_cached_embedder(self):
+        embedder = CountingEmbedder()
+        cached = CachedEmbedder(embedder, LRUEmbeddingCache())
+
+        res = cached.embed(["a", "bb", "a"], model="m", input_type="document")
+        self.assertEqual(res.embeddings, [[1.0, 0.5], [2.0, 0.5], [1.0, 0.5]])
+        self.assertEqual(embedder.embedded, ["a", "bb"])
+
+        res = cached.embed(["bb", "ccc"], model="m", input_type="document")
+        self.assertEqual(res.embeddings, [[2.0, 0.5], [3.0, 0.5]])
+        self.assertEqual(embedder.embedded, ["a", "bb", "ccc"])
+
+        # Different input type is a different embedding
+        cached.embed(["a"], model="m", input_type="query")
+        self.assertEqual(embedder.embedded, ["a", "bb", "ccc", "a"])
+        self.assertEqual(cached.cache.hits, 1)
+        self.assertEqual(cached.cache.misses, 5)
+
+    def test_lru_eviction(self):
+        # Two float32 values take 8 bytes
+        cache = LRUEmbeddingCache(max_bytes=16)
+        cache.put_many({"a": [1.0, 1.0], "b": [2.0, 2.0]})
+        cache.get_many(["a"])
+        cache.put_many({"c": [3.0, 3.0]})
+        self.assertEqual(set(cache.get_many(["a", "b", "c"])), {"a", "c"})
+        self.assertEqual(cache.stats()["bytes"], 16)
+
+    def test_sqlite_cache(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "cache.db")
+            cache = SQLiteEmbeddingCache(path, max_bytes=24)
+            key = embedding_key("m", "document", "text")
+            cache.put_many({key: [0.25, -1.5]})
+            cache.put_many({f"k{i}": [float(i), 0.0] for i in range(2)})
+
+            reopened = SQLiteEmbeddingCache(path, max_bytes=24)
+            self.assertEqual(reopened.get_many([key]), {key: [0.25, -1.5]})
+            reopened.put_many({"k2": [2.0, 0.0]})
+            self.assertEqual(reopened.stats()["bytes"], 24)
+            self.assertEqual(len(reopened.get_many([key, "k0", "k1", "k2"])), 3)
+
+    def test_tiered_cache(self):
+        memory, disk = LRUEmbeddingCache(), SQLiteEmbeddingCache(":memory:")
+        cache = TieredEmbeddingCache([memory, disk])
+        disk.put_many({"a": [1.0]})
+        self.assertEqual(cache.get_many(["a", "b"]), {"a": [1.0]})
+        self.assertEqual(memory.get_many(["a"]), {"a": [1.0]})
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 1)
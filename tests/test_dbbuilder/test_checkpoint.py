@@ -0,0 +1,89 @@
+import os
+import tempfile
+import unittest as ut
+
+from dbbuilder.checkpoint import BuildCheckpoint
+from dbbuilder.state import DocumentState
+
+
+class TestBuildCheckpoint(ut.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "www.example.com.jsonl")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_resume(self):
+        self.assertFalse(BuildCheckpoint.is_pending(self.path))
+        checkpoint = BuildCheckpoint(self.path)
+        self.assertFalse(checkpoint.started)
+        checkpoint.start("www.example.com", "2024-01-01T00:00:00",
+                         "2024-03-01T00:00:00")
+        checkpoint.stage([
+            {"id": "posts/1#chunk0", "values": [0.5, 1.0], "metadata": {"text": "a"}},
+            {"id": "posts/2#chunk0", "values": [0.25, 2.0], "metadata": {"text": "b"}},
+            {"id": "posts/2#chunk1", "values": [0.75, 3.0], "metadata": {"text": "c"}},
+        ])
+        checkpoint.add_documents([DocumentState("posts/1", "2024-02-01T00:00:00",
+                                                "h1", ["a"])])
+        checkpoint.set_cursor("posts", 2)
+        checkpoint.close()
+        # Interrupted in the middle of a record
+        with open(self.path, "ab") as f:
+            f.write(b'{"done":[["posts/2"')
+        self.assertTrue(BuildCheckpoint.is_pending(self.path))
+
+        checkpoint = BuildCheckpoint(self.path)
+        self.assertTrue(checkpoint.started)
+        self.assertEqual(checkpoint.modified_after, "2024-01-01T00:00:00")
+        self.assertEqual(checkpoint.next_modified_after, "2024-03-01T00:00:00")
+        self.assertEqual(checkpoint.cursors, {"posts": 2})
+        self.assertEqual(set(checkpoint.documents), {"posts/1"})
+        # Vectors of done documents are no longer staged
+        self.assertIsNone(checkpoint.take_staged("posts/1#chunk0", {"text": "a"}))
+        self.assertEqual(
+            checkpoint.take_staged("posts/2#chunk0", {"text": "b"}).tolist(),
+            [0.25, 2.0]
+        )
+        # The text of the chunk changed
+        self.assertIsNone(checkpoint.take_staged("posts/2#chunk1", {"text": "d"}))
+        with self.assertRaises(ValueError):
+            checkpoint.start("www.other.com", None)
+        # Resumed from the start of the interrupted build
+        checkpoint.start("www.example.com", "2024-01-01T00:00:00", "2024-04-01T00:00:00")
+        self.assertEqual(checkpoint.next_modified_after, "2024-03-01T00:00:00")
+
+        checkpoint.add_documents([DocumentState("posts/2", "2024-02-01T00:00:00",
+                                                "h2", ["b", "c"])])
+        checkpoint.commit(["posts/3"], checkpoint.next_modified_after)
+        checkpoint.close()
+        self.assertFalse(BuildCheckpoint.is_pending(self.path))
+
+        checkpoint = BuildCheckpoint(self.path)
+        self.assertTrue(checkpoint.committed)
+        self.assertEqual(set(checkpoint.documents), {"posts/1", "posts/2"})
+        self.assertEqual(checkpoint.removed, ["posts/3"])
+        self.assertEqual(checkpoint.next_modified_after, "2024-03-01T00:00:00")
+        checkpoint.clear()
+        self.assertFalse(os.path.exists(self.path))
+        self.assertFalse(checkpoint.started)
+
+    def test_compaction(self):
+        checkpoint = BuildCheckpoint(self.path)
+        checkpoint.start("www.example.com", None)
+        for i in range(100):
+            checkpoint.stage([{"id": f"posts/{i}#chunk0", "values": [0.0] * 64,
+                               "metadata": {"text": "x" * 100}}])
+            checkpoint.add_documents([DocumentState(f"posts/{i}", "", "h", ["x"])])
+            checkpoint.set_cursor("posts", i + 1)
+        checkpoint.close()
+        size = os.path.getsize(self.path)
+
+        checkpoint = BuildCheckpoint(self.path)
+        self.assertLess(os.path.getsize(self.path), size / 4)
+        self.assertEqual(len(checkpoint.documents), 100)
+        self.assertEqual(checkpoint.cursors, {"posts": 100})
+        checkpoint.close()
+        self.assertEqual(len(BuildCheckpoint(self.path).documents), 100)
@@ -1,6 +1,9 @@
+import time
 import unittest as ut
+from random import random
+from urllib.parse import parse_qs
 
-from httmock import HTTMock
+from httmock import HTTMock, all_requests, response
 
 from dbbuilder.data import fetch_wordpress_site_content
 from tests.helpers import mock_wordpress_api
@@ -12,9 +15,40 @@ class TestDataFunctions(ut.TestCase):
         with HTTMock(mock_wordpress_api):
             data_fetcher = fetch_wordpress_site_content("https://www.example.com/wp-json/")
             for data in data_fetcher:
-                self.assertEqual(len(data), 5)
-                for key in ["id", "type", "title", "link", "content"]:
+                self.assertEqual(len(data), 6)
+                for key in ["id", "type", "title", "link", "content", "modified"]:
                     self.assertIn(key, data)
                     self.assertIsInstance(data[key], str)
                 self.assertTrue(data["id"].isnumeric())
                 self.assertIn(data["type"], ["page", "post", "comment"])
+
+    def test_fetch_wordpress_site_content_order_and_retries(self):
+        failed_once = set()
+
+        @all_requests
+        def flaky_api(url, request):
+            qs = parse_qs(url.query)
+            content_type = url.path.rstrip("/").split("/")[-1][:-1]
+            page = int(qs["page"][0])
+            if (content_type, page) not in failed_once:
+                failed_once.add((content_type, page))
+                return response(503)
+            time.sleep(random() / 100)
+            res_json = [{
+                "id": page * 100 + i,
+                "type": content_type,
+                "title": {"rendered": "title"},
+                "link": "https://www.example.com/",
+                "content": {"rendered": "content"},
+            } for i in range(100)]
+            return response(200, res_json, headers={"X-WP-TotalPages": 4})
+
+        with HTTMock(flaky_api):
+            data = list(fetch_wordpress_site_content(
+                "https://www.example.com/wp-json/", max_workers=4, backoff=0
+            ))
+
+        expected = [(t, str(page * 100 + i))
+                    for t in ["page", "post", "comment"]
+                    for page in range(1, 5) for i in range(100)]
+        self.assertEqual([(d["type"], d["id"]) for d in data], expected)
@@ -0,0 +1,121 @@
+import os
+import json
+import tempfile
+import unittest as ut
+
+from dbbuilder.exports import read_rest_dumps, read_wxr
+
+
+WXR = """<?xml version="1.0" encoding="UTF-8"?>
+<rss version="2.0"
+    xmlns:excerpt="http://wordpress.org/export/1.2/excerpt/"
+    xmlns:content="http://purl.org/rss/1.0/modules/content/"
+    xmlns:dc="http://purl.org/dc/elements/1.1/"
+    xmlns:wp="http://wordpress.org/export/1.2/">
+<channel>
+    <title>Example</title>
+    <wp:wxr_version>1.2</wp:wxr_version>
+    <wp:author><wp:author_login>admin</wp:author_login></wp:author>
+    <item>
+        <title>Hello world</title>
+        <link>https://www.example.com/hello-world/</link>
+        <dc:creator>admin</dc:creator>
+        <content:encoded><![CDATA[<p>Welcome to the site.</p>]]></content:encoded>
+        <excerpt:encoded><![CDATA[Welcome]]></excerpt:encoded>
+        <wp:post_id>1</wp:post_id>
+        <wp:post_modified>2024-02-01 12:00:00</wp:post_modified>
+        <wp:post_modified_gmt>2024-02-01 10:00:00</wp:post_modified_gmt>
+        <wp:status>publish</wp:status>
+        <wp:post_type>post</wp:post_type>
+        <wp:comment>
+            <wp:comment_id>7</wp:comment_id>
+            <wp:comment_date>2024-02-02 11:30:00</wp:comment_date>
+            <wp:comment_date_gmt>2024-02-02 09:30:00</wp:comment_date_gmt>
+            <wp:comment_content><![CDATA[Nice post!]]></wp:comment_content>
+            <wp:comment_approved>1</wp:comment_approved>
+            <wp:comment_type>comment</wp:comment_type>
+        </wp:comment>
+        <wp:comment>
+            <wp:comment_id>8</wp:comment_id>
+            <wp:comment_content><![CDATA[Buy now]]></wp:comment_content>
+            <wp:comment_approved>spam</wp:comment_approved>
+        </wp:comment>
+        <wp:comment>
+            <wp:comment_id>9</wp:comment_id>
+            <wp:comment_content><![CDATA[Linked]]></wp:comment_content>
+            <wp:comment_approved>1</wp:comment_approved>
+            <wp:comment_type>pingback</wp:comment_type>
+        </wp:comment>
+    </item>
+    <item>
+        <title>Draft</title>
+        <wp:post_id>2</wp:post_id>
+        <wp:status>draft</wp:status>
+        <wp:post_type>post</wp:post_type>
+    </item>
+    <item>
+        <title>Logo</title>
+        <wp:post_id>3</wp:post_id>
+        <wp:status>inherit</wp:status>
+        <wp:post_type>attachment</wp:post_type>
+    </item>
+    <item>
+        <title>About</title>
+        <link>https://www.example.com/about/</link>
+        <content:encoded><![CDATA[<p>About us.</p>]]></content:encoded>
+        <wp:post_id>4</wp:post_id>
+        <wp:post_modified>2024-01-15 10:00:00</wp:post_modified>
+        <wp:post_modified_gmt>2024-01-15 08:00:00</wp:post_modified_gmt>
+        <wp:status>publish</wp:status>
+        <wp:post_type>page</wp:post_type>
+    </item>
+</channel>
+</rss>
+"""
+
+
+class TestExports(ut.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def test_read_wxr(self):
+        path = os.path.join(self.tmp.name, "export.xml")
+        with open(path, "w") as f:
+            f.write(WXR)
+
+        self.assertEqual(list(read_wxr(path)), [
+            {"id": "1", "type": "post", "title": "Hello world",
+             "link": "https://www.example.com/hello-world/",
+             "content": "<p>Welcome to the site.</p>",
+             "modified": "2024-02-01T12:00:00"},
+            {"id": "7", "type": "comment", "title": "Comment",
+             "link": "https://www.example.com/hello-world/#comment-7",
+             "content": "Nice post!", "modified": "2024-02-02T11:30:00"},
+            {"id": "4", "type": "page", "title": "About",
+             "link": "https://www.example.com/about/",
+             "content": "<p>About us.</p>", "modified": "2024-01-15T10:00:00"},
+        ])
+
+    def test_read_rest_dumps(self):
+        pages = [{"id": 4, "type": "page", "title": {"rendered": "About"},
+                  "link": "https://www.example.com/about/",
+                  "content": {"rendered": "<p>About us.</p>"},
+                  "modified": "2024-01-15T10:00:00",
+                  "modified_gmt": "2024-01-15T08:00:00"}]
+        comments = [{"id": 7, "type": "comment", "link": "https://www.example.com/#c",
+                     "content": {"rendered": "<p>Nice post!</p>"},
+                     "date": "2024-02-02T11:30:00", "date_gmt": "2024-02-02T09:30:00"}]
+        media = [{"id": 3, "type": "attachment", "title": {"rendered": "Logo"}}]
+        for name, items in [("pages-1.json", pages), ("comments-1.json", comments),
+                            ("media-1.json", media)]:
+            with open(os.path.join(self.tmp.name, name), "w") as f:
+                json.dump(items, f)
+
+        items = list(read_rest_dumps(self.tmp.name))
+        self.assertEqual([(i["type"], i["id"]) for i in items],
+                         [("comment", "7"), ("page", "4")])
+        self.assertEqual(items[0]["title"], "Comment")
+        # In the site's time zone, as the REST API filters by it
+        self.assertEqual(items[1]["modified"], "2024-01-15T10:00:00")
@@ -0,0 +1,53 @@
+import threading
+import unittest as ut
+
+from dbbuilder.jobs import BuildJobManager
+
+
+class TestBuildJobManager(ut.TestCase):
+
+    def test_submit(self):
+        manager = BuildJobManager(max_concurrent_builds=2)
+        started = threading.Barrier(3)
+        release = threading.Event()
+        builds = []
+
+        def build(progress):
+            builds.append(progress)
+            progress.add("documents_total", 10)
+            progress.add("documents_fetched", 4)
+            started.wait(5)
+            release.wait(5)
+
+        job, created = manager.submit("www.example.com", build)
+        self.assertTrue(created)
+        same_job, created = manager.submit("www.example.com", build)
+        self.assertFalse(created)
+        self.assertIs(same_job, job)
+        other_job, created = manager.submit("www.other.com", build)
+        self.assertTrue(created)
+        self.assertIsNot(other_job, job)
+
+        started.wait(5)
+        status = manager.get(job.id).to_dict()
+        self.assertEqual(status["status"], "running")
+        self.assertEqual(status["documents_fetched"], 4)
+        self.assertIsNotNone(status["eta_seconds"])
+
+        release.set()
+        manager.shutdown()
+        self.assertEqual(manager.get(job.id).to_dict()["status"], "succeeded")
+        self.assertEqual(len(builds), 2)
+        self.assertIsNone(manager.active_job("www.example.com"))
+
+    def test_failed_build(self):
+        manager = BuildJobManager()
+
+        def build(progress):
+            raise ValueError("unreachable site")
+
+        job, _ = manager.submit("www.example.com", build)
+        manager.shutdown()
+        status = job.to_dict()
+        self.assertEqual(status["status"], "failed")
+        self.assertIn("unreachable site", status["error"])
@@ -0,0 +1,107 @@
+import threading
+import time
+import unittest as ut
+
+from dbbuilder.pipeline import Stage, run_pipeline
+
+
+class TestPipelineFunctions(ut.TestCase):
+
+    def test_run_pipeline(self):
+        results = []
+        lock = threading.Lock()
+
+        def double(items):
+            for i in items:
+                yield i * 2
+
+        def pair(items):
+            batch = []
+            for i in items:
+                batch.append(i)
+                if len(batch) == 2:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+
+        def collect(batches):
+            for batch in batches:
+                with lock:
+                    results.extend(batch)
+            yield from ()
+
+        run_pipeline(range(101), [
+            Stage(double, workers=3),
+            Stage(pair),
+            Stage(collect, workers=2),
+        ], queue_size=2)
+        self.assertEqual(sorted(results), [i * 2 for i in range(101)])
+
+    def test_run_pipeline_backpressure(self):
+        consumed = 0
+
+        def source():
+            nonlocal consumed
+            for i in range(50):
+                consumed += 1
+                yield i
+
+        max_ahead = 0
+
+        def slow(items):
+            nonlocal max_ahead
+            for seen, _ in enumerate(items, 1):
+                max_ahead = max(max_ahead, consumed - seen)
+                time.sleep(0.001)
+            yield from ()
+
+        run_pipeline(source(), [Stage(slow)], queue_size=4)
+        self.assertEqual(consumed, 50)
+        # Queue capacity, plus one item blocked in `put`
+        self.assertLessEqual(max_ahead, 5)
+
+    def test_run_pipeline_error(self):
+
+        def fail(items):
+            for i in items:
+                if i == 10:
+                    raise RuntimeError("stage failed")
+                yield i
+
+        def sink(items):
+            for _ in items:
+                pass
+            yield from ()
+
+        with self.assertRaisesRegex(RuntimeError, "stage failed"):
+            run_pipeline(iter(range(10**9)), [
+                Stage(fail, workers=2), Stage(sink)
+            ], queue_size=2)
+
+    def test_stage_timings(self):
+        def source():
+            for i in range(5):
+                time.sleep(0.01)
+                yield i
+
+        def slow(items):
+            for i in items:
+                time.sleep(0.04)
+                yield i
+
+        def fast(items):
+            for i in items:
+                yield i
+
+        observed = []
+        seconds = run_pipeline(source(), [
+            Stage(slow, workers=2),
+            Stage(fast, name="last"),
+        ], observe=lambda stage, s: observed.append(stage))
+        self.assertEqual(list(seconds), ["source", "slow", "last"])
+        self.assertEqual(sorted(observed), ["last"] * 5 + ["slow"] * 5 + ["source"] * 5)
+        self.assertGreaterEqual(seconds["source"], 0.05)
+        self.assertGreaterEqual(seconds["slow"], 0.2)
+        # Waiting for the slow stage is not counted
+        self.assertLess(seconds["last"], 0.05)
@@ -0,0 +1,82 @@
+import time
+import unittest as ut
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from dbbuilder.ratelimit import (
+    RateLimitedEmbedder, RateLimiter, TenantLimiter, TokenBucket
+)
+
+
+class TestRateLimit(ut.TestCase):
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=100, capacity=5)
+        start = time.monotonic()
+        with ThreadPoolExecutor(4) as executor:
+            list(executor.map(lambda _: bucket.acquire(), range(25)))
+        # A burst of 5, then 20 at 100 per second
+        self.assertGreaterEqual(time.monotonic() - start, 0.19)
+
+        start = time.monotonic()
+        bucket.acquire(1000)
+        bucket.acquire(1)
+        self.assertGreaterEqual(time.monotonic() - start, 0.05)
+
+        bucket = TokenBucket(rate=10, capacity=2)
+        self.assertEqual(bucket.try_acquire(), 0)
+        self.assertEqual(bucket.try_acquire(), 0)
+        self.assertGreater(bucket.try_acquire(), 0.05)
+        time.sleep(0.1)
+        self.assertEqual(bucket.try_acquire(), 0)
+
+    def test_tenant_limiter(self):
+        limiter = TenantLimiter(max_concurrent=2, requests_per_minute=3, max_tenants=2)
+        self.assertEqual(limiter.try_acquire("a.com"), 0)
+        self.assertEqual(limiter.try_acquire("a.com"), 0)
+        # Too many requests in flight, but other tenants aren't limited
+        self.assertGreater(limiter.try_acquire("a.com"), 0)
+        self.assertEqual(limiter.try_acquire("b.com"), 0)
+        self.assertEqual(limiter.active("a.com"), 2)
+        limiter.release("a.com")
+        self.assertEqual(limiter.try_acquire("a.com"), 0)
+        limiter.release("a.com")
+        limiter.release("a.com")
+        # Too many requests per minute
+        self.assertAlmostEqual(limiter.try_acquire("a.com"), 20, delta=1)
+        self.assertEqual(limiter.active("a.com"), 0)
+
+        # The least recent idle tenant is forgotten
+        limiter.release("b.com")
+        limiter.try_acquire("c.com")
+        self.assertEqual(limiter.try_acquire("b.com"), 0)
+        self.assertEqual(limiter.try_acquire("a.com"), 0)
+        self.assertEqual(limiter.active("c.com"), 1)
+
+        unlimited = TenantLimiter()
+        for _ in range(100):
+            self.assertEqual(unlimited.try_acquire("a.com"), 0)
+
+    def test_rate_limited_embedder(self):
+        calls = []
+        embedder = SimpleNamespace(embed=lambda texts, model, **kw: calls.append(texts))
+        limiter = RateLimiter(requests_per_minute=6000, tokens_per_minute=60_000)
+        limited = RateLimitedEmbedder(embedder, limiter)
+
+        start = time.monotonic()
+        for _ in range(3):
+            # 334 estimated tokens each
+            limited.embed(["x" * 1000], model="m", input_type="document")
+        self.assertEqual(len(calls), 3)
+        self.assertLess(time.monotonic() - start, 0.1)
+
+        limited.embed(["x" * 3000] * 60, model="m")
+        limited.embed(["x"], model="m")
+        # The second request waits for the tokens of the first
+        self.assertGreaterEqual(time.monotonic() - start, 0.1)
+
+        unlimited = RateLimiter()
+        start = time.monotonic()
+        for _ in range(100):
+            unlimited.acquire(10**6)
+        self.assertLess(time.monotonic() - start, 0.1)
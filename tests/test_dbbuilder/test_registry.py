@@ -0,0 +1,91 @@
+import os
+import tempfile
+import unittest as ut
+
+from dbbuilder.registry import NamespaceRegistry
+
+
+class StatsDatabase:
+
+    def __init__(self, counts):
+        self.counts = counts
+        self.requests = 0
+
+    def describe_index_stats(self):
+        self.requests += 1
+        if self.counts is None:
+            raise ConnectionError("Service unavailable")
+        return {"dimension": 8, "namespaces": {
+            name: {"vector_count": n} for name, n in self.counts.items()
+        }}
+
+
+class TestNamespaceRegistry(ut.TestCase):
+
+    def test_namespace_registry(self):
+        database = StatsDatabase({"www.example.com": 10})
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "namespaces.db")
+            registry = NamespaceRegistry(database, path, ttl=60)
+
+            # Built before the registry existed
+            info = registry.get("www.example.com")
+            self.assertEqual(info.vector_count, 10)
+            self.assertTrue(info.present)
+            self.assertIsNone(registry.get("www.other.com"))
+            self.assertEqual(database.requests, 1)
+
+            registry.start_build("www.other.com", "voyage-large-2-instruct")
+            info = registry.get("www.other.com")
+            self.assertEqual(info.status, "building")
+            self.assertFalse(info.present)
+            database.counts["www.other.com"] = 20
+            registry.finish_build("www.other.com", succeeded=True)
+            info = registry.get("www.other.com")
+            self.assertEqual((info.status, info.vector_count), ("complete", 20))
+            self.assertTrue(info.present)
+            self.assertIsNotNone(info.built_at)
+
+            # A failed update leaves the database present
+            registry.start_build("www.other.com", "voyage-large-2-instruct")
+            registry.finish_build("www.other.com", succeeded=False)
+            self.assertEqual(registry.get("www.other.com").status, "failed")
+            self.assertTrue(registry.get("www.other.com").present)
+            registry.start_build("www.new.com")
+            registry.finish_build("www.new.com", succeeded=False)
+            self.assertFalse(registry.get("www.new.com").present)
+
+            registry.remove("www.new.com")
+            self.assertEqual([n.namespace for n in registry.all()],
+                             ["www.example.com", "www.other.com"])
+            requests = database.requests
+
+            # Served from the file, with stale counts if the index fails
+            database.counts = None
+            registry = NamespaceRegistry(database, path, ttl=60)
+            info = registry.get("www.other.com")
+            self.assertEqual(info.vector_count, 20)
+            self.assertEqual(info.embedding_model, "voyage-large-2-instruct")
+            registry.get("www.example.com")
+            self.assertEqual(database.requests, requests + 1)
+
+    def test_shared_file(self):
+        database = StatsDatabase({"www.example.com": 10})
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "namespaces.db")
+            server = NamespaceRegistry(database, path, ttl=0)
+            self.assertEqual(server.get("www.example.com").status, "complete")
+
+            # Loaded by another process, e.g. from a bundle
+            loader = NamespaceRegistry(database, path)
+            loader.start_build("www.example.com", "voyage-large-2-instruct")
+            self.assertEqual(server.get("www.example.com").status, "building")
+            database.counts["www.example.com"] = 30
+            loader.finish_build("www.example.com", succeeded=True)
+
+            # Refreshing the counts keeps what the other process saved
+            info = server.get("www.example.com")
+            self.assertEqual((info.status, info.vector_count), ("complete", 30))
+            self.assertEqual(info.embedding_model, "voyage-large-2-instruct")
+            self.assertIsNotNone(info.built_at)
+            self.assertEqual(loader.get("www.example.com"), info)
@@ -0,0 +1,44 @@
+import unittest as ut
+
+from dbbuilder.state import DocumentState, SyncState
+
+
+class TestSyncState(ut.TestCase):
+
+    def test_sync_state(self):
+        state = SyncState()
+        self.assertEqual(state.documents("www.example.com"), {})
+        self.assertIsNone(state.last_modified("www.example.com"))
+
+        state.update("www.example.com", [
+            DocumentState("posts/1", "2024-01-01T00:00:00", "h1", ["a", "b"]),
+            DocumentState("posts/2", "2024-03-01T00:00:00", "h2", ["c"]),
+            DocumentState("comments/3", "2024-05-01T00:00:00", "h3", []),
+        ])
+        state.update("www.other.com", [
+            DocumentState("pages/1", "2024-01-01T00:00:00", "h4", ["d"]),
+        ])
+        docs = state.documents("www.example.com")
+        self.assertEqual(set(docs), {"posts/1", "posts/2", "comments/3"})
+        self.assertEqual(docs["posts/1"].chunk_hashes, ["a", "b"])
+        # Comment dates can't be used to filter pages and posts
+        self.assertEqual(state.last_modified("www.example.com"),
+                         "2024-03-01T00:00:00")
+        # Until a date is saved, that of the last modification
+        self.assertEqual(state.modified_after("www.example.com"),
+                         "2024-03-01T00:00:00")
+        state.update("www.example.com", [], modified_after="2024-02-01T00:00:00")
+        self.assertEqual(state.modified_after("www.example.com"),
+                         "2024-02-01T00:00:00")
+
+        state.update("www.example.com",
+                     [DocumentState("posts/1", "2024-04-01T00:00:00", "h5", [])],
+                     removed=["posts/2"])
+        docs = state.documents("www.example.com")
+        self.assertEqual(set(docs), {"posts/1", "comments/3"})
+        self.assertEqual(docs["posts/1"].content_hash, "h5")
+
+        state.clear("www.example.com")
+        self.assertEqual(state.documents("www.example.com"), {})
+        self.assertIsNone(state.modified_after("www.example.com"))
+        self.assertEqual(len(state.documents("www.other.com")), 1)
@@ -1,8 +1,31 @@
+import random
 import unittest as ut
+from concurrent.futures import ProcessPoolExecutor
 
 import requests
 
 from dbbuilder.utils import *
+from dbbuilder.utils import _bs4_extract_text_from_html
+
+
+GOLDEN_CASES = [
+    "<p>Words  spaced   apart</p>",
+    "<p>a</p>   <p>b</p>\n\n<p>c</p>",
+    "a<b> </b>b<i>\t</i>c<u>\n</u>d",
+    "<pre>  x  </pre>a<pre>   </pre>b<textarea>  </textarea>c",
+    "<div><pre>a</div>   b",
+    "<template><p>Hidden</p></template>Shown",
+    "<ruby>漢<rp>(</rp><rt>kan</rt><rp>)</rp></ruby>",
+    "<![CDATA[data]]>text<template><![CDATA[more]]></template><p><![CDATA[]]></p>",
+    "<!-- comment -->a<!DOCTYPE html>b<?php echo 1; ?>c",
+    "&amp; &lt;tag&gt; &nbsp;&foo; &#65;&#x42; &#150; &#0; &#1114112; &copy",
+    "<br>a<br/>b</br>c<pre>\n\n</br>  </pre>d<img src='x'>  <img>e",
+    "<script>var s = '<p>x</p>';</script>a<style>p { color: red; }</style>b",
+    "<script/>a<style/>b",
+    "<p>Unclosed script<script>var a = 1;",
+    "   a  b　c\x0bd\x1ce f  ",
+    "<table><tr><td>1</td><td>2</td></tr></table><ul><li>x<li>y</ul>",
+]
 
 
 class TestUtilsFunctions(ut.TestCase):
@@ -14,3 +37,35 @@ class TestUtilsFunctions(ut.TestCase):
 
         text = extract_text_from_html(html)
         self.assertNotIn("</div>", text)
+        self.assertEqual(text, _bs4_extract_text_from_html(html))
+
+    def test_extract_text_from_html_golden(self):
+        for html in GOLDEN_CASES:
+            with self.subTest(html=html):
+                self.assertEqual(extract_text_from_html(html),
+                                 _bs4_extract_text_from_html(html))
+
+    def test_extract_text_from_html_random(self):
+        pieces = [
+            "<p>", "</p>", "<div>", "</div>", "<pre>", "</pre>", "<br>", "<br/>",
+            "</br>", "<script>", "</script>", "<style>", "</style>", "<template>",
+            "</template>", "<rt>", "</rt>", "<textarea>", "</textarea>", "<img>",
+            "<a href='#'>", "</a>", "<!-- c -->", "<![CDATA[ d ]]>", "<!DOCTYPE html>",
+            "&amp;", "&nbsp;", "&#65;", "&#x80;", "&bogus;", "&", "<", ">", "</",
+            " ", "  ", "\n", "\t", "\r\n", " ", "word", "two words", "é",
+        ]
+        rand = random.Random(0)
+        for _ in range(2000):
+            html = "".join(rand.choices(pieces, k=rand.randint(1, 40)))
+            with self.subTest(html=html):
+                self.assertEqual(extract_text_from_html(html),
+                                 _bs4_extract_text_from_html(html))
+
+    def test_extract_texts_from_html(self):
+        htmls = [f"<h1>Document</h1>\n<p>{i}</p>" for i in range(50)]
+        expected = [f"Document\n{i}" for i in range(50)]
+        self.assertEqual(list(extract_texts_from_html(htmls)), expected)
+        with ProcessPoolExecutor(2) as pool:
+            texts = extract_texts_from_html(iter(htmls), pool,
+                                            batch_size=4, max_pending=3)
+            self.assertEqual(list(texts), expected)
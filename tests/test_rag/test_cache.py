@@ -0,0 +1,35 @@
+import time
+import unittest as ut
+
+from rag.cache import SemanticCache
+
+
+class TestSemanticCache(ut.TestCase):
+
+    def test_lookup(self):
+        cache = SemanticCache(threshold=0.9)
+        cache.store("www.example.com", "system: Hi", [1.0, 0.0], "9 AM")
+        self.assertEqual(cache.lookup("www.example.com", "system: Hi", [0.99, 0.1]), "9 AM")
+        self.assertIsNone(cache.lookup("www.example.com", "system: Hi", [0.5, 0.5]))
+        self.assertIsNone(cache.lookup("www.example.com", "system: Bye", [1.0, 0.0]))
+        self.assertIsNone(cache.lookup("www.other.com", "system: Hi", [1.0, 0.0]))
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 3))
+        self.assertEqual(stats["hit_rate"], 0.25)
+
+    def test_eviction_and_invalidation(self):
+        cache = SemanticCache(threshold=0.9, ttl=0.2, max_entries=2)
+        cache.store("ns", "", [1.0, 0.0, 0.0], "a")
+        cache.store("ns", "", [0.0, 1.0, 0.0], "b")
+        cache.lookup("ns", "", [1.0, 0.0, 0.0])
+        cache.store("ns", "", [0.0, 0.0, 1.0], "c")
+        self.assertEqual(cache.lookup("ns", "", [1.0, 0.0, 0.0]), "a")
+        self.assertIsNone(cache.lookup("ns", "", [0.0, 1.0, 0.0]))
+
+        cache.invalidate("ns")
+        self.assertIsNone(cache.lookup("ns", "", [1.0, 0.0, 0.0]))
+
+        cache.store("ns", "", [1.0, 0.0, 0.0], "a")
+        time.sleep(0.3)
+        self.assertIsNone(cache.lookup("ns", "", [1.0, 0.0, 0.0]))
+        self.assertEqual(cache.stats()["entries"], 0)
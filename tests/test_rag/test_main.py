@@ -0,0 +1,251 @@
+import time
+import tempfile
+import unittest as ut
+from types import SimpleNamespace
+
+from mistralai.models.chat_completion import ChatMessage
+
+from rag.cache import SemanticCache
+from rag.main import WordPressRAG, SUMMARY_PREFIX, _join_overlapping
+from rag.metrics import record_timings
+from vectorstore import BM25Index
+
+
+class MockLLMClient:
+
+    def __init__(self, response: str, latency: float = 0):
+        self.response = response
+        self.latency = latency
+        self.requests = []
+
+    def chat(self, messages, model, temperature = None, safe_prompt = False):
+        time.sleep(self.latency)
+        self.requests.append(messages)
+        message = ChatMessage(role="assistant", content=self.response)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+    def chat_stream(self, messages, model, temperature = None, safe_prompt = False):
+        self.requests.append(messages)
+        for i, token in enumerate(self.response.split(" ")):
+            delta = SimpleNamespace(content=token if i == 0 else " " + token)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+
+
+class MockEmbedder:
+
+    def __init__(self, latency: float = 0):
+        self.latency = latency
+
+    def embed(self, texts, model, input_type):
+        time.sleep(self.latency)
+        return SimpleNamespace(embeddings=[[1.0, 0.0] for _ in texts])
+
+
+class MockDatabase:
+
+    def query(self, namespace, vector, top_k, include_metadata = False):
+        return {"matches": [{
+            "id": f"posts/{i}#chunk0",
+            "score": 1.0 - i / 10,
+            "metadata": {"title": "Post", "link": "https://www.example.com/post",
+                         "text": f"chunk {i}"},
+        } for i in range(top_k)]}
+
+
+class TestWordPressRAG(ut.TestCase):
+
+    def setUp(self):
+        self.llm = MockLLMClient("The shop opens at 9 AM.")
+        self.rag = WordPressRAG(self.llm, "model", MockEmbedder(), MockDatabase())
+        self.chat = [
+            {"role": "system", "content": "You are an assistant."},
+            {"role": "user", "content": "When does the shop open?"},
+        ]
+
+    def test_generate(self):
+        output = self.rag.generate("www.example.com", self.chat)
+        self.assertEqual(output[:2], self.chat)
+        self.assertEqual(output[2], {"role": "assistant",
+                                     "content": "The shop opens at 9 AM."})
+        self.assertIn("chunk 4", self.llm.requests[0][-1].content)
+
+    def test_generate_stream(self):
+        events = list(self.rag.generate_stream("www.example.com", self.chat))
+        self.assertEqual(events[0][0], "context")
+        self.assertEqual(len(events[0][1]), 5)
+        tokens = [data for name, data in events if name == "token"]
+        self.assertEqual("".join(tokens), "The shop opens at 9 AM.")
+        self.assertEqual(events[-1][0], "done")
+        self.assertEqual(events[-1][1],
+                         self.rag.generate("www.example.com", self.chat))
+
+    def test_generate_stream_error(self):
+        class FailingLLMClient(MockLLMClient):
+            def chat_stream(self, *args, **kwargs):
+                yield from list(super().chat_stream(*args, **kwargs))[:2]
+                raise ConnectionError("Connection reset")
+
+        class FailingDatabase:
+            def query(self, *args, **kwargs):
+                raise ConnectionError("Service unavailable")
+
+        for rag in [WordPressRAG(FailingLLMClient("The shop opens at 9 AM."), "model",
+                                 MockEmbedder(), MockDatabase()),
+                    WordPressRAG(self.llm, "model", MockEmbedder(), FailingDatabase())]:
+            with self.assertLogs("rag.main", "ERROR"):
+                events = list(rag.generate_stream("www.example.com", self.chat))
+            self.assertEqual(events[-1], ("error", {
+                "message": "The response could not be generated."
+            }))
+            self.assertNotIn("done", [name for name, _ in events])
+        # Retrieval failed before any other event
+        self.assertEqual([name for name, _ in events], ["error"])
+
+    def test_generate_overlaps_summary_and_retrieval(self):
+        llm = MockLLMClient("Summary.", latency=0.3)
+        rag = WordPressRAG(llm, "model", MockEmbedder(latency=0.3), MockDatabase())
+        chat = self.chat[:1] + [
+            {"role": "user", "content": "Tell me a story."},
+            {"role": "assistant", "content": "Once upon a time " * 300},
+        ] + self.chat[1:]
+
+        start = time.perf_counter()
+        with record_timings() as timings:
+            output = rag.generate("www.example.com", chat)
+        elapsed = time.perf_counter() - start
+        # Summary, then the final response. Retrieval happens meanwhile.
+        self.assertEqual(len(llm.requests), 2)
+        self.assertEqual([msg["role"] for msg in output],
+                         ["system", "assistant", "user", "assistant"])
+        self.assertLess(elapsed, 0.85)
+        # Stages timed in the other thread are recorded too
+        self.assertIn("summarize", timings)
+
+    def test_retrieve_similar_merges_chunks(self):
+        class Database:
+            def query(self, namespace, vector, top_k, include_metadata = False):
+                return {"matches": [match(id, text) for id, text in [
+                    ("posts/1#chunk3", "the garden opens in May."),
+                    ("posts/2#chunk0", "Our shop is on 12 Main Street."),
+                    ("posts/1#chunk2", "Every spring, the garden opens"),
+                    ("comments/5#chunk0", "Our shop  is on 12 Main Street."),
+                    ("posts/1#chunk5", "Tickets cost 5 euros."),
+                ]][:top_k]}
+
+        def match(id, text):
+            return {"id": id, "score": 1.0, "metadata": {
+                "title": id.split("#")[0], "link": "link", "text": text,
+            }}
+
+        rag = WordPressRAG(self.llm, "model", MockEmbedder(), Database())
+        self.assertEqual(rag.retrieve_similar("When?", 5, "www.example.com"), [
+            "posts/1, source: link\nEvery spring, the garden opens in May.",
+            "posts/2, source: link\nOur shop is on 12 Main Street.",
+            "posts/1, source: link\nTickets cost 5 euros.",
+        ])
+
+    def test_join_overlapping(self):
+        self.assertEqual(_join_overlapping("Every spring, the garden opens",
+                                           "the garden opens in May."),
+                         "Every spring, the garden opens in May.")
+        # Overlaps which end in the middle of a word of the second chunk
+        self.assertEqual(_join_overlapping("We sell a", "apple pies and tarts."),
+                         "We sell a apple pies and tarts.")
+        self.assertEqual(_join_overlapping("Open from 9 to 5", "5pm on weekends."),
+                         "Open from 9 to 5 5pm on weekends.")
+        # Too short to be more than a coincidence
+        self.assertEqual(_join_overlapping("Meet us at the", "the park."),
+                         "Meet us at the the park.")
+
+    def test_hybrid_retrieval(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        sparse_index = BM25Index(tmp.name)
+        sparse_index.upsert([{"id": f"pages/{i}#chunk0", "metadata": {
+            "title": "Page", "link": "link", "text": f"Product SKU-{1000 + i}",
+        }} for i in range(20)], "www.example.com")
+
+        rag = WordPressRAG(self.llm, "model", MockEmbedder(), MockDatabase(),
+                           sparse_index=sparse_index)
+        texts = rag.retrieve_similar("Do you sell SKU-1007?", 5, "www.example.com")
+        self.assertEqual(len(texts), 5)
+        # The best of each ranking come first, though absent from the other
+        self.assertEqual({text.split("\n")[1] for text in texts[:2]},
+                         {"Product SKU-1007", "chunk 0"})
+
+    def test_context_token_budget(self):
+        class Database:
+            def query(self, namespace, vector, top_k, include_metadata = False):
+                return {"matches": [{
+                    "id": f"posts/{i}#chunk0",
+                    "score": 0.9 - i / 10,
+                    "metadata": {"title": f"Post {i}", "link": "link",
+                                 "text": f"Text {i} " + "lorem ipsum " * 100},
+                } for i in range(top_k)]}
+
+        rag = WordPressRAG(self.llm, "model", MockEmbedder(), Database(),
+                           prompt_token_budget=1000, min_score=0.55)
+        rag.generate("www.example.com", self.chat)
+        prompt = self.llm.requests[-1][-1].content
+        self.assertLessEqual(rag.count_chat_tokens(self.llm.requests[-1]), 1000)
+        # About 400 tokens per text, the third one trimmed to fit
+        self.assertIn("Text 2", prompt)
+        self.assertLess(prompt.count("lorem"), 250)
+        self.assertNotIn("Post 3", prompt)
+
+        # Below the score floor
+        texts = rag.retrieve_similar("When?", 5, "www.example.com")
+        self.assertEqual([t.split(",")[0] for t in texts],
+                         ["Post 0", "Post 1", "Post 2", "Post 3"])
+        texts = rag.retrieve_similar("When?", 5, "www.example.com", token_budget=300)
+        self.assertEqual(len(texts), 1)
+        self.assertLessEqual(rag.token_counter.count_text(texts[0]), 300)
+
+    def test_response_cache(self):
+        rag = WordPressRAG(self.llm, "model", MockEmbedder(), MockDatabase(),
+                           response_cache=SemanticCache())
+        first = rag.generate("www.example.com", self.chat)
+        self.assertEqual(rag.generate("www.example.com", self.chat), first)
+        events = list(rag.generate_stream("www.example.com", self.chat))
+        self.assertEqual(events[-1], ("done", first))
+        self.assertEqual(len(self.llm.requests), 1)
+        self.assertEqual(rag.response_cache.stats()["hits"], 2)
+
+        # Only the first question of a chat is answered from the cache
+        rag.generate("www.example.com", first + self.chat[1:])
+        self.assertEqual(len(self.llm.requests), 2)
+
+    def test_rolling_summary(self):
+        llm = MockLLMClient("Short summary.")
+        rag = WordPressRAG(llm, "model", MockEmbedder(), MockDatabase(),
+                           history_token_budget=200)
+        turns = []
+        for i in range(6):
+            turns += [ChatMessage(role="user", content=f"Question {i} " * 10),
+                      ChatMessage(role="assistant", content=f"Answer {i} " * 10)]
+        chat = [ChatMessage(role="system", content="You are an assistant.")] + turns
+
+        summarized = rag.summarize_chat(chat, 50)
+        self.assertEqual(summarized[0], chat[0])
+        self.assertEqual(summarized[1].content, SUMMARY_PREFIX + "Short summary.")
+        self.assertEqual(summarized[1].role, "assistant")
+        self.assertEqual(summarized[2].role, "user")
+        kept = summarized[2:]
+        self.assertEqual(kept, chat[-len(kept):])
+        self.assertLessEqual(rag.count_chat_tokens(kept), 100 + 2)
+        self.assertIn("Question 0", llm.requests[0][0].content)
+
+        # Only the summary and the newly overflowing messages are folded
+        more = summarized + [
+            ChatMessage(role="user" if i % 2 == 0 else "assistant",
+                        content=f"Follow-up {i} " * 4)
+            for i in range(4)
+        ]
+        llm.response = "Longer summary."
+        resummarized = rag.summarize_chat(more, 50)
+        request = llm.requests[1][0].content
+        self.assertIn("Short summary.", request)
+        self.assertIn(kept[0].content, request)
+        self.assertNotIn("Question 0", request)
+        self.assertEqual(resummarized[1].content, SUMMARY_PREFIX + "Longer summary.")
+        self.assertEqual(resummarized[2:], more[-4:])
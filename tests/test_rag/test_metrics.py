@@ -0,0 +1,41 @@
+import time
+import asyncio
+import unittest as ut
+from types import SimpleNamespace
+
+from prometheus_client import CollectorRegistry
+
+from rag.metrics import CacheCollector, record_timings, timed
+
+
+class TestMetrics(ut.TestCase):
+
+    def test_record_timings(self):
+        def embed():
+            with timed("embed"):
+                time.sleep(0.02)
+
+        async def generate():
+            await asyncio.gather(asyncio.to_thread(embed), asyncio.to_thread(embed))
+            with timed("llm"):
+                await asyncio.sleep(0.01)
+
+        with record_timings() as timings:
+            asyncio.run(generate())
+        self.assertEqual(set(timings), {"embed", "llm"})
+        self.assertGreaterEqual(timings["embed"], 0.04)
+
+        # Stages timed outside of the context aren't recorded
+        embed()
+        self.assertEqual(set(timings), {"embed", "llm"})
+
+    def test_cache_collector(self):
+        registry = CollectorRegistry()
+        cache = SimpleNamespace(hits=3, misses=1)
+        registry.register(CacheCollector({"response": cache}))
+        labels = {"cache": "response"}
+        self.assertEqual(registry.get_sample_value(
+            "wordpress_assistant_cache_hits_total", labels), 3)
+        cache.misses += 1
+        self.assertEqual(registry.get_sample_value(
+            "wordpress_assistant_cache_misses_total", labels), 2)
@@ -0,0 +1,86 @@
+import os
+import time
+import tempfile
+import unittest as ut
+
+from rag.sessions import (
+    ConversationStore, InMemoryConversationStore, SQLiteConversationStore
+)
+
+
+class ConversationStoreTests:
+    "Tests run for every store type."
+
+    def new_store(self, ttl: float = 60, max_sessions: int = 10) -> ConversationStore:
+        raise NotImplementedError
+
+    def test_sessions(self):
+        store = self.new_store()
+        system = {"role": "system", "content": "Be brief."}
+        session_id = store.create([system])
+        self.assertEqual(store.get(session_id), [system])
+
+        chat = [system, {"role": "user", "content": "Hi"},
+                {"role": "assistant", "content": "Hello"}]
+        store.put(session_id, chat)
+        self.assertEqual(store.get(session_id), chat)
+        self.assertEqual(store.get(store.create()), [])
+        self.assertIsNone(store.get("unknown"))
+
+        store.delete(session_id)
+        self.assertIsNone(store.get(session_id))
+
+    def test_versions(self):
+        store = self.new_store()
+        session_id = store.create()
+        _, version = store.get_versioned(session_id)
+        user = {"role": "user", "content": "Hi"}
+
+        # A concurrent turn saved first
+        self.assertTrue(store.put(session_id, [user], version))
+        self.assertFalse(store.put(session_id, [user, user], version))
+        self.assertEqual(store.get(session_id), [user])
+
+        messages, version = store.get_versioned(session_id)
+        self.assertTrue(store.put(session_id, messages + [user], version))
+        self.assertEqual(store.get(session_id), [user, user])
+
+        store.delete(session_id)
+        self.assertFalse(store.put(session_id, [user], version + 1))
+        self.assertIsNone(store.get(session_id))
+
+    def test_eviction(self):
+        store = self.new_store(ttl=0.2, max_sessions=2)
+        first, second = store.create(), store.create()
+        store.get(first)
+        third = store.create()
+        self.assertIsNotNone(store.get(first))
+        self.assertIsNone(store.get(second))
+        self.assertIsNotNone(store.get(third))
+
+        time.sleep(0.3)
+        self.assertIsNone(store.get(first))
+
+
+class TestInMemoryConversationStore(ConversationStoreTests, ut.TestCase):
+
+    def new_store(self, ttl: float = 60, max_sessions: int = 10) -> ConversationStore:
+        return InMemoryConversationStore(ttl, max_sessions)
+
+
+class TestSQLiteConversationStore(ConversationStoreTests, ut.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "conversations.db")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def new_store(self, ttl: float = 60, max_sessions: int = 10) -> ConversationStore:
+        return SQLiteConversationStore(self.path, ttl, max_sessions)
+
+    def test_persistence(self):
+        session_id = self.new_store().create([{"role": "user", "content": "Hi"}])
+        self.assertEqual(self.new_store().get(session_id),
+                         [{"role": "user", "content": "Hi"}])
@@ -0,0 +1,60 @@
+import unittest as ut
+
+from mistral_common.tokens.tokenizers.mistral import MistralTokenizer
+from mistral_common.tokens.instruct.normalize import ChatCompletionRequest
+from mistral_common.protocol.instruct.messages import (
+    SystemMessage, UserMessage, AssistantMessage
+)
+from mistralai.models.chat_completion import ChatMessage
+
+from rag.tokens import TokenCounter
+
+
+class TestTokenCounter(ut.TestCase):
+
+    def test_count_chat(self):
+        tokenizer = MistralTokenizer.v3()
+        counter = TokenCounter(tokenizer)
+        chat = [
+            ("system", "You are an assistant who helps users of the site."),
+            ("user", "What are your opening hours?"),
+            ("assistant", "We open at 9 AM, from Monday to Saturday."),
+            ("user", "And on Sunday?"),
+            ("assistant", "We're closed on Sundays."),
+        ]
+        message_types = {"system": SystemMessage, "user": UserMessage,
+                         "assistant": AssistantMessage}
+
+        # The tokenizer merges the system prompt with the last user message
+        merged_chat = [
+            ("system", "You are an assistant."),
+            ("user", "opening ? ?"),
+            ("assistant", "? WordPress ."),
+            ("user", "WordPress hello ?"),
+            ("assistant", "hello hello hours"),
+            ("user", "hello ? site"),
+        ]
+
+        for c in [chat[:2], chat[:4], merged_chat, merged_chat[:4]]:
+            messages = [message_types[r](content=text) for r, text in c]
+            expected = tokenizer.encode_chat_completion(
+                ChatCompletionRequest(model="model", messages=messages)
+            ).tokens
+            chat_msgs = [ChatMessage(role=r, content=text) for r, text in c]
+            self.assertEqual(counter.count_chat(chat_msgs), len(expected))
+
+        calls = []
+        encode = counter.tokenizer.encode
+        counter.tokenizer.encode = lambda *a, **kw: calls.append(a) or encode(*a, **kw)
+        chat_msgs = [ChatMessage(role=r, content=c) for r, c in chat]
+        counter.count_chat(chat_msgs)
+        # The messages counted before aren't tokenized again. The previous
+        # last user message is now counted without the system prompt.
+        self.assertEqual(calls, [(chat[3][1],), (chat[4][1],),
+                                 (chat[0][1] + "\n\n",)])
+
+    def test_shared_tokenizer(self):
+        counter = TokenCounter()
+        self.assertEqual(counter.count_text("Hello, world!"),
+                         TokenCounter(MistralTokenizer.v3()).count_text("Hello, world!"))
+        self.assertIs(counter.tokenizer, TokenCounter().tokenizer)
@@ -0,0 +1,51 @@
+import tempfile
+import unittest as ut
+
+from vectorstore.bm25 import BM25Index
+
+
+class TestBM25Index(ut.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def test_upsert_query_and_delete(self):
+        index = BM25Index(self.tmp.name)
+        index.upsert([
+            {"id": "posts/1#chunk0", "values": [1.0],
+             "metadata": {"title": "Opening hours", "link": "a",
+                          "text": "The shop opens at 9 AM on weekdays."}},
+            {"id": "posts/2#chunk0",
+             "metadata": {"title": "Products", "link": "b",
+                          "text": "The XR-200 café grinder is back in stock."}},
+            {"id": "posts/3#chunk0",
+             "metadata": {"title": "News", "link": "c",
+                          "text": "The shop is closed on Sunday."}},
+        ], "www.example.com")
+
+        res = index.query("Is the xr-200 available?", "www.example.com", top_k=2)
+        self.assertEqual(res["matches"][0]["id"], "posts/2#chunk0")
+        self.assertEqual(res["matches"][0]["metadata"]["link"], "b")
+        self.assertGreater(res["matches"][0]["score"], 0)
+        # Accents are ignored
+        self.assertEqual(index.query("cafe", "www.example.com")["matches"][0]["id"],
+                         "posts/2#chunk0")
+        self.assertEqual(index.query("", "www.example.com")["matches"], [])
+        self.assertEqual(index.query("shop", "www.other.com")["matches"], [])
+
+        index.upsert([{"id": "posts/1#chunk0",
+                       "metadata": {"title": "Opening hours", "link": "a",
+                                    "text": "The shop opens at 10 AM."}}],
+                     "www.example.com")
+        index.delete(ids=["posts/3#chunk0"], namespace="www.example.com")
+        res = index.query("shop", "www.example.com")
+        self.assertEqual([m["id"] for m in res["matches"]], ["posts/1#chunk0"])
+        self.assertIn("10 AM", res["matches"][0]["metadata"]["text"])
+        self.assertEqual(index.query("weekdays", "www.example.com")["matches"], [])
+
+        # Persisted
+        index = BM25Index(self.tmp.name)
+        self.assertEqual(len(index.query("shop", "www.example.com")["matches"]), 1)
+        index.delete(delete_all=True, namespace="www.example.com")
+        self.assertEqual(index.query("shop", "www.example.com")["matches"], [])
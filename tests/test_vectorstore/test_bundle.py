@@ -0,0 +1,50 @@
+import os
+import tempfile
+import unittest as ut
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from vectorstore import BundleWriter, IndexBundle
+
+
+class TestIndexBundle(ut.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def test_write_and_load(self):
+        path = os.path.join(self.tmp.name, "bundle")
+        rand = np.random.default_rng(0)
+        vectors = [{"id": f"posts/{i}#chunk0", "values": rand.random(8).tolist(),
+                    "metadata": {"title": f"Post {i}", "link": f"/post/{i}/",
+                                 "text": f"Text of post {i}", "tokens": 4}}
+                   for i in range(250)]
+
+        writer = BundleWriter(path, "www.example.com", {"embedding_model": "m"})
+        with ThreadPoolExecutor(4) as executor:
+            list(executor.map(lambda i: writer.upsert(vectors[i:i+10], "www.example.com"),
+                              range(0, 250, 10)))
+        with self.assertRaises(ValueError):
+            writer.upsert(vectors[:1], "www.other.com")
+        with self.assertRaises(ValueError):
+            IndexBundle(path)
+        writer.close()
+
+        bundle = IndexBundle(path)
+        self.assertEqual((len(bundle), bundle.dimension), (250, 8))
+        self.assertEqual(bundle.namespace, "www.example.com")
+        self.assertEqual(bundle.manifest["embedding_model"], "m")
+        self.assertIsInstance(bundle.vectors, np.memmap)
+        loaded = {v["id"]: v for batch in bundle.batches(100) for v in batch}
+        self.assertEqual(len(loaded), 250)
+        for v in vectors:
+            self.assertEqual(loaded[v["id"]]["metadata"], v["metadata"])
+            np.testing.assert_allclose(loaded[v["id"]]["values"], v["values"],
+                                       rtol=1e-6)
+
+        empty = BundleWriter(os.path.join(self.tmp.name, "empty"), "www.example.com")
+        empty.close()
+        self.assertEqual(len(IndexBundle(empty.path)), 0)
+        self.assertEqual(list(IndexBundle(empty.path).batches()), [])
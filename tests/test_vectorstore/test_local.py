@@ -0,0 +1,119 @@
+import os
+import tempfile
+import unittest as ut
+
+import numpy as np
+
+from vectorstore.local import LocalVectorStore
+
+
+class TestLocalVectorStore(ut.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def test_upsert_and_query(self):
+        store = LocalVectorStore(self.tmp.name)
+        store.upsert([
+            {"id": "a", "values": [1.0, 0.0], "metadata": {"text": "a"}},
+            {"id": "b", "values": [0.0, 2.0], "metadata": {"text": "b"}},
+            {"id": "c", "values": [1.0, 1.0], "metadata": {"text": "c"}},
+        ], "www.example.com")
+
+        res = store.query(namespace="www.example.com", vector=[1.0, 0.1],
+                          top_k=2, include_metadata=True)
+        self.assertEqual([m["id"] for m in res["matches"]], ["a", "c"])
+        self.assertEqual(res["matches"][0]["metadata"], {"text": "a"})
+        self.assertAlmostEqual(res["matches"][0]["score"], 0.995, places=3)
+        self.assertEqual(store.query(namespace="www.other.com", vector=[1.0, 0.0],
+                                     top_k=1)["matches"], [])
+        # Zero vector, as used to check whether a namespace exists
+        self.assertEqual(len(store.query(namespace="www.example.com",
+                                         vector=[0, 0], top_k=1)["matches"]), 1)
+
+    def test_overwrite_delete_and_reload(self):
+        store = LocalVectorStore(self.tmp.name)
+        store.upsert([("a", [1.0, 0.0], {"v": 1}), ("b", [0.0, 1.0], {"v": 1})],
+                     "ns")
+        store.upsert([("a", [0.0, 1.0], {"v": 2})], "ns")
+        store.delete(ids=["b"], namespace="ns")
+        store.upsert([("c", [-1.0, 0.0], {"v": 1})], "ns")
+
+        for s in [store, LocalVectorStore(self.tmp.name)]:
+            res = s.query(namespace="ns", vector=[0.0, 1.0], top_k=5,
+                          include_metadata=True)
+            self.assertEqual([(m["id"], m["metadata"]["v"]) for m in res["matches"]],
+                             [("a", 2), ("c", 1)])
+            stats = s.describe_index_stats()
+            self.assertEqual(stats["namespaces"], {"ns": {"vector_count": 2}})
+            self.assertEqual(stats["dimension"], 2)
+
+        store.delete(delete_all=True, namespace="ns")
+        self.assertEqual(store.describe_index_stats()["namespaces"], {})
+        self.assertEqual(LocalVectorStore(self.tmp.name).query(
+            namespace="ns", vector=[0.0, 1.0], top_k=5)["matches"], [])
+
+    def test_compaction(self):
+        store = LocalVectorStore(self.tmp.name)
+        for i in range(3):
+            store.upsert([(f"v{j}", [np.cos(j / 100), np.sin(j / 100), i], None)
+                          for j in range(1000)], "ns")
+        store.delete(ids=[f"v{j}" for j in range(500)], namespace="ns")
+        self.assertEqual(sorted(os.listdir(store._path("ns"))),
+                         ["manifest.json", "records.2.jsonl", "vectors.2.f32"])
+        reloaded = LocalVectorStore(self.tmp.name)
+        for s in [store, reloaded]:
+            self.assertEqual(s.describe_index_stats()["total_vector_count"], 500)
+            res = s.query(namespace="ns", top_k=1, include_values=True,
+                          vector=[np.cos(9.99), np.sin(9.99), 2])
+            self.assertEqual(res["matches"][0]["id"], "v999")
+            self.assertAlmostEqual(res["matches"][0]["values"][2], 2 / np.sqrt(5),
+                                   places=6)
+
+    def test_reload_after_crash(self):
+        store = LocalVectorStore(self.tmp.name)
+        store.upsert([("a", [1.0, 0.0, 0.0], {"v": 1}),
+                      ("b", [0.0, 1.0, 0.0], {"v": 1})], "ns")
+        path = store._path("ns")
+        # Crashed after writing the vectors of 3 more records, and 1 of them
+        with open(os.path.join(path, "vectors.f32"), "ab") as f:
+            f.write(np.eye(3, dtype=np.float32).tobytes())
+        with open(os.path.join(path, "records.jsonl"), "a") as f:
+            f.write('{"id": "c", "metadata": {"v": 1}}\n{"id": "d", "meta')
+
+        reloaded = LocalVectorStore(self.tmp.name)
+        reloaded.upsert([("e", [0.0, 0.0, 1.0], {"v": 2})], "ns")
+        # The rows loaded aren't copied to append the new ones
+        self.assertIsInstance(reloaded._namespace("ns").blocks()[0], np.memmap)
+        for s in [reloaded, LocalVectorStore(self.tmp.name)]:
+            self.assertEqual(s.describe_index_stats()["dimension"], 3)
+            res = s.query(namespace="ns", vector=[0.0, 0.0, 1.0], top_k=5,
+                          include_metadata=True)
+            self.assertEqual([(m["id"], m["metadata"]["v"]) for m in res["matches"]],
+                             [("e", 2), ("a", 1), ("b", 1), ("c", 1)])
+
+        # Compaction interrupted before the manifest named the new files
+        with open(os.path.join(path, "vectors.1.f32"), "wb") as f:
+            f.write(b"\0" * 12)
+        reloaded = LocalVectorStore(self.tmp.name)
+        self.assertEqual(len(reloaded.query(namespace="ns", vector=[1.0, 0.0, 0.0],
+                                            top_k=5)["matches"]), 4)
+        self.assertFalse(os.path.exists(os.path.join(path, "vectors.1.f32")))
+
+    def test_ivf_search(self):
+        rng = np.random.default_rng(1)
+        centers = rng.normal(size=(20, 32))
+        vectors = centers[rng.integers(0, 20, 5000)] + rng.normal(size=(5000, 32)) * 0.1
+        exact = LocalVectorStore(self.tmp.name)
+        ivf = LocalVectorStore(self.tmp.name, ivf_threshold=1000, ivf_probes=8)
+        exact.upsert([(str(i), v.tolist()) for i, v in enumerate(vectors)], "ns")
+
+        recall = []
+        for query in vectors[:50] + rng.normal(size=(50, 32)) * 0.05:
+            expected = exact.query(namespace="ns", vector=query.tolist(), top_k=10)
+            found = ivf.query(namespace="ns", vector=query.tolist(), top_k=10)
+            expected = {m["id"] for m in expected["matches"]}
+            found = {m["id"] for m in found["matches"]}
+            recall.append(len(expected & found) / 10)
+        self.assertGreater(np.mean(recall), 0.9)
@@ -0,0 +1,4 @@
+from .base import *
+from .local import *
+from .bm25 import *
+from .bundle import *
@@ -0,0 +1,46 @@
+from typing import Any, Protocol
+
+
+class VectorStore(Protocol):
+    """
+    The subset of the Pinecone `Index` API used by this project. A Pinecone
+    `Index` is a valid vector store as is.
+    """
+    def upsert(self, vectors: list[dict], namespace: str | None = None, **kwargs) -> Any:
+        """
+        Insert or overwrite vectors. Each vector is a dictionary with the keys
+        "id", "values" and optionally "metadata".
+        """
+        ...
+
+    def query(
+        self,
+        namespace: str | None = None,
+        vector: list[float] | None = None,
+        top_k: int = 10,
+        include_metadata: bool = False,
+        **kwargs,
+    ) -> Any:
+        """
+        Find the `top_k` vectors most similar to `vector`. The result has a
+        "matches" list of dictionaries with the keys "id", "score" and, if
+        `include_metadata` is True, "metadata".
+        """
+        ...
+
+    def delete(
+        self,
+        ids: list[str] | None = None,
+        delete_all: bool | None = None,
+        namespace: str | None = None,
+        **kwargs,
+    ) -> Any:
+        "Delete vectors by ID, or all the vectors of a namespace."
+        ...
+
+    def describe_index_stats(self, **kwargs) -> Any:
+        """
+        Get the "dimension" of the vectors and the "namespaces", with the
+        "vector_count" of each one.
+        """
+        ...
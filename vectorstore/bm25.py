@@ -0,0 +1,128 @@
+import os
+import re
+import sqlite3
+import threading
+from urllib.parse import quote
+
+
+class BM25Index:
+    """
+    Full-text index of chunks, ranked with BM25, to find exact terms (names,
+    SKUs, addresses) which embeddings miss. Its API mirrors the vector
+    stores': it indexes the "title" and "text" metadata of the vectors
+    upserted, and its matches are dictionaries with the keys "id", "score"
+    and "metadata".
+
+    Every namespace is a SQLite database in a directory, with an FTS5
+    index over a table storing the chunks.
+    """
+    def __init__(self, directory: str):
+        """
+        Args:
+            directory: Directory storing the namespaces. Created if missing.
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._connections: dict[str, sqlite3.Connection] = {}
+        self._lock = threading.RLock()
+
+    def upsert(self, vectors: list[dict], namespace: str | None = None, **kwargs) -> dict:
+        "Index the metadata of vectors, replacing that of the same IDs."
+        rows = [(v["id"], v["metadata"]["title"], v["metadata"]["link"],
+                 v["metadata"]["text"]) for v in vectors]
+        with self._lock:
+            conn = self._connection(namespace, create=True)
+            with conn:
+                conn.executemany(
+                    "DELETE FROM chunks WHERE id = ?", ((r[0],) for r in rows)
+                )
+                conn.executemany(
+                    "INSERT INTO chunks (id, title, link, text) VALUES (?, ?, ?, ?)",
+                    rows
+                )
+        return {"upserted_count": len(rows)}
+
+    def query(self, text: str, namespace: str | None = None, top_k: int = 10) -> dict:
+        "Find the `top_k` chunks which match the terms of `text` best."
+        terms = dict.fromkeys(re.findall(r"\w+", text.lower()))
+        with self._lock:
+            conn = self._connection(namespace)
+            if conn is None or not terms:
+                return {"matches": []}
+            rows = conn.execute(
+                "SELECT chunks.id, chunks.title, chunks.link, chunks.text,"
+                " bm25(chunks_fts) AS rank"
+                " FROM chunks_fts JOIN chunks ON chunks.rowid = chunks_fts.rowid"
+                " WHERE chunks_fts MATCH ? ORDER BY rank LIMIT ?",
+                (" OR ".join(f'"{t}"' for t in terms), top_k)
+            ).fetchall()
+        # FTS5 ranks better matches with lower, negative scores
+        return {"matches": [{
+            "id": id,
+            "score": -rank,
+            "metadata": {"title": title, "link": link, "text": text},
+        } for id, title, link, text, rank in rows]}
+
+    def delete(
+        self,
+        ids: list[str] | None = None,
+        delete_all: bool | None = None,
+        namespace: str | None = None,
+        **kwargs,
+    ) -> dict:
+        with self._lock:
+            if delete_all:
+                conn = self._connections.pop(namespace or "", None)
+                if conn is not None:
+                    conn.close()
+                if os.path.exists(self._path(namespace)):
+                    os.remove(self._path(namespace))
+            elif ids and (conn := self._connection(namespace)) is not None:
+                with conn:
+                    conn.executemany("DELETE FROM chunks WHERE id = ?",
+                                     ((id,) for id in ids))
+        return {}
+
+    def _path(self, namespace: str | None) -> str:
+        return os.path.join(self.directory,
+                            "ns-" + quote(namespace or "", safe="") + ".db")
+
+    def _connection(
+        self,
+        namespace: str | None,
+        create: bool = False,
+    ) -> sqlite3.Connection | None:
+        name = namespace or ""
+        if name not in self._connections:
+            path = self._path(name)
+            if not create and not os.path.exists(path):
+                return None
+            conn = sqlite3.connect(path, check_same_thread=False)
+            with conn:
+                conn.executescript(_SCHEMA)
+            self._connections[name] = conn
+        return self._connections[name]
+
+
+# The FTS5 index only stores the terms; the text is kept in 'chunks'
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    rowid INTEGER PRIMARY KEY,
+    id TEXT NOT NULL UNIQUE,
+    title TEXT NOT NULL,
+    link TEXT NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(
+    title, text, content='chunks', content_rowid='rowid',
+    tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS chunks_insert AFTER INSERT ON chunks BEGIN
+    INSERT INTO chunks_fts (rowid, title, text)
+    VALUES (new.rowid, new.title, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS chunks_delete AFTER DELETE ON chunks BEGIN
+    INSERT INTO chunks_fts (chunks_fts, rowid, title, text)
+    VALUES ('delete', old.rowid, old.title, old.text);
+END;
+"""
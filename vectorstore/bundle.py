@@ -0,0 +1,129 @@
+import os
+import json
+import time
+import threading
+from collections.abc import Iterator
+
+import numpy as np
+
+
+BUNDLE_FORMAT = 1
+
+
+class BundleWriter:
+    """
+    Writes the vectors upserted into it as an index bundle, a directory
+    which can be copied to another machine and loaded into a vector store
+    with `IndexBundle`. It stands in for the vector store of a build, and
+    can be shared by threads. Deleting isn't supported, as a bundle is the
+    whole database of a namespace.
+
+    A bundle has the files:
+        vectors.f32: Values of the vectors, as rows of little-endian float32.
+        ids.txt: ID of the vector of every row, one per line.
+        metadata.jsonl: Metadata of the vector of every row, one per line.
+        manifest.json: Namespace, dimension and number of the vectors.
+            Written by `close`, so a bundle without it is incomplete.
+    """
+    def __init__(self, path: str, namespace: str, info: dict | None = None):
+        """
+        Args:
+            path: Directory of the bundle. Created if missing, and its
+                bundle overwritten if any.
+            namespace: Namespace of the vectors.
+            info: Added to the manifest, e.g. the embedding model.
+        """
+        self.path = path
+        self.namespace = namespace
+        self.info = info or {}
+        self.dimension: int | None = None
+        self.count = 0
+        os.makedirs(path, exist_ok=True)
+        if os.path.exists(os.path.join(path, "manifest.json")):
+            os.remove(os.path.join(path, "manifest.json"))
+        self._vectors = open(os.path.join(path, "vectors.f32"), "wb")
+        self._ids = open(os.path.join(path, "ids.txt"), "w")
+        self._metadata = open(os.path.join(path, "metadata.jsonl"), "w")
+        self._lock = threading.Lock()
+
+    def upsert(self, vectors: list[dict], namespace: str | None = None, **kwargs) -> dict:
+        if namespace not in (None, self.namespace):
+            raise ValueError(f"Bundle '{self.path}' is of namespace "
+                             f"'{self.namespace}', not '{namespace}'")
+        if not vectors:
+            return {"upserted_count": 0}
+        matrix = np.asarray([v["values"] for v in vectors], dtype="<f4")
+        with self._lock:
+            if self.dimension is None:
+                self.dimension = matrix.shape[1]
+            elif matrix.shape[1] != self.dimension:
+                raise ValueError(
+                    f"Vector dimension {matrix.shape[1]} does not match the "
+                    f"dimension {self.dimension} of bundle '{self.path}'."
+                )
+            self._vectors.write(matrix.tobytes())
+            for v in vectors:
+                self._ids.write(v["id"] + "\n")
+                self._metadata.write(json.dumps(v.get("metadata")) + "\n")
+            self.count += len(vectors)
+        return {"upserted_count": len(vectors)}
+
+    def close(self) -> None:
+        "Finish the bundle."
+        with self._lock:
+            for f in (self._vectors, self._ids, self._metadata):
+                f.close()
+            manifest = {
+                "format": BUNDLE_FORMAT,
+                "namespace": self.namespace,
+                "dimension": self.dimension,
+                "count": self.count,
+                "created_at": time.time(),
+            } | self.info
+            with open(os.path.join(self.path, "manifest.json"), "w") as f:
+                json.dump(manifest, f, indent=2)
+
+
+class IndexBundle:
+    """
+    An index bundle written by `BundleWriter`. Its vectors are
+    memory-mapped, so opening it doesn't read them. It is loaded into a
+    vector store with `dbbuilder.load_index_bundle`.
+    """
+    def __init__(self, path: str):
+        """
+        Args:
+            path: Directory of the bundle.
+        """
+        self.path = path
+        try:
+            with open(os.path.join(path, "manifest.json")) as f:
+                self.manifest: dict = json.load(f)
+        except FileNotFoundError:
+            raise ValueError(f"'{path}' is not a bundle, or it is incomplete")
+        if self.manifest["format"] != BUNDLE_FORMAT:
+            raise ValueError(f"Bundle '{path}' is of an unknown format "
+                             f"({self.manifest['format']})")
+        self.namespace: str = self.manifest["namespace"]
+        self.dimension: int | None = self.manifest["dimension"]
+        with open(os.path.join(path, "ids.txt")) as f:
+            self.ids = f.read().splitlines()
+        if len(self.ids) != self.manifest["count"]:
+            raise ValueError(f"Bundle '{path}' has {len(self.ids)} IDs "
+                             f"for {self.manifest['count']} vectors")
+        if self.ids:
+            self.vectors = np.memmap(os.path.join(path, "vectors.f32"), dtype="<f4",
+                                     mode="r", shape=(len(self.ids), self.dimension))
+        else:
+            self.vectors = np.zeros((0, self.dimension or 0), dtype="<f4")
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def batches(self, batch_size: int = 1000) -> Iterator[list[dict]]:
+        "Yield the vectors, as upserted into a vector store, in batches."
+        with open(os.path.join(self.path, "metadata.jsonl")) as f:
+            for start in range(0, len(self.ids), batch_size):
+                values = self.vectors[start:start + batch_size].tolist()
+                yield [{"id": id, "values": v, "metadata": json.loads(next(f))}
+                       for id, v in zip(self.ids[start:start + batch_size], values)]
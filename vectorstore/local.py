@@ -0,0 +1,438 @@
+import os
+import json
+import shutil
+import threading
+from urllib.parse import quote, unquote
+
+import numpy as np
+
+
+class LocalVectorStore:
+    """
+    In-process vector store implementing the `VectorStore` API with cosine
+    similarity. Every namespace is a float32 matrix kept in a directory,
+    which is memory-mapped when loaded.
+
+    Namespaces are searched exhaustively, with a matrix product per block
+    of rows: the rows loaded from the file, which stay memory-mapped, and
+    those upserted since. Namespaces with at least `ivf_threshold` vectors
+    are searched with an inverted file (IVF) index instead, which only
+    scores the vectors of the `ivf_probes` clusters closest to the query.
+
+    The store can be shared by threads, but not by processes: every process
+    keeps its own copy of the namespaces it has loaded, which doesn't see
+    the writes of other processes, and writes from several processes are
+    not synchronized. Serve it from a single process, e.g. with
+    `gunicorn --workers 1 --threads 8`, and stop the server to load a
+    bundle into it.
+    """
+    def __init__(
+        self,
+        directory: str,
+        ivf_threshold: int = 50_000,
+        ivf_probes: int = 8,
+    ):
+        """
+        Args:
+            directory: Directory storing the namespaces. Created if missing.
+            ivf_threshold: Minimum number of vectors in a namespace to
+                search it with an IVF index.
+            ivf_probes: Number of IVF clusters searched per query.
+        """
+        self.directory = directory
+        self.ivf_threshold = ivf_threshold
+        self.ivf_probes = ivf_probes
+        os.makedirs(directory, exist_ok=True)
+        self._namespaces: dict[str, _Namespace] = {}
+        self._lock = threading.RLock()
+
+    def upsert(self, vectors: list, namespace: str | None = None, **kwargs) -> dict:
+        records: list[tuple[str, list[float], dict | None]] = []
+        for v in vectors:
+            if isinstance(v, dict):
+                records.append((v["id"], v["values"], v.get("metadata")))
+            else:
+                records.append((v[0], v[1], v[2] if len(v) > 2 else None))
+        if not records:
+            return {"upserted_count": 0}
+        with self._lock:
+            self._namespace(namespace, create=True).upsert(records)
+        return {"upserted_count": len(records)}
+
+    def query(
+        self,
+        namespace: str | None = None,
+        vector: list[float] | None = None,
+        top_k: int = 10,
+        include_metadata: bool = False,
+        include_values: bool = False,
+        **kwargs,
+    ) -> dict:
+        with self._lock:
+            ns = self._namespace(namespace)
+            if ns is None:
+                return {"matches": [], "namespace": namespace or ""}
+            if len(ns) >= self.ivf_threshold:
+                rows, scores = ns.search_ivf(vector, top_k, self.ivf_probes)
+            else:
+                rows, scores = ns.search(vector, top_k)
+            matches = []
+            for row, score in zip(rows, scores):
+                match = {"id": ns.ids[row], "score": float(score)}
+                if include_metadata:
+                    match["metadata"] = ns.metadata[row] or {}
+                if include_values:
+                    match["values"] = ns.vector(row).tolist()
+                matches.append(match)
+        return {"matches": matches, "namespace": namespace or ""}
+
+    def delete(
+        self,
+        ids: list[str] | None = None,
+        delete_all: bool | None = None,
+        namespace: str | None = None,
+        **kwargs,
+    ) -> dict:
+        with self._lock:
+            if delete_all:
+                self._namespaces.pop(namespace or "", None)
+                path = self._path(namespace)
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+            elif ids and (ns := self._namespace(namespace)) is not None:
+                ns.delete(ids)
+        return {}
+
+    def describe_index_stats(self, **kwargs) -> dict:
+        namespaces: dict[str, dict] = {}
+        dimension = None
+        with self._lock:
+            for name in os.listdir(self.directory):
+                if not name.startswith("ns-"):
+                    continue
+                ns = self._namespace(unquote(name[3:]))
+                if ns is not None and len(ns):
+                    namespaces[ns.name] = {"vector_count": len(ns)}
+                    dimension = ns.dimension
+        return {
+            "dimension": dimension,
+            "namespaces": namespaces,
+            "total_vector_count": sum(n["vector_count"] for n in namespaces.values()),
+        }
+
+    def _path(self, namespace: str | None) -> str:
+        return os.path.join(self.directory, "ns-" + quote(namespace or "", safe=""))
+
+    def _namespace(self, namespace: str | None, create: bool = False) -> "_Namespace | None":
+        name = namespace or ""
+        if name not in self._namespaces:
+            path = self._path(name)
+            if not create and not os.path.isdir(path):
+                return None
+            self._namespaces[name] = _Namespace(name, path)
+        return self._namespaces[name]
+
+
+class _Namespace:
+    """
+    Vectors are appended to 'vectors.f32' (raw, normalized float32 rows) and
+    their IDs and metadata to 'records.jsonl', which also records deletions.
+    Overwritten or deleted rows are dropped when the files are compacted,
+    into files of a new generation, e.g. 'vectors.2.f32'.
+
+    'manifest.json' holds the dimension of the vectors and the generation
+    of the files, and is replaced atomically. The number of rows is that of
+    the records: rows or records left over by a crash between the writes of
+    the two files are truncated when the namespace is loaded.
+    """
+    def __init__(self, name: str, path: str):
+        self.name = name
+        self.path = path
+        self.dimension: int | None = None
+        self.generation = 0
+        self.ids: list[str] = []
+        self.metadata: list[dict | None] = []
+        self.alive: list[bool] = []
+        self.rows: dict[str, int] = {}
+        # Rows loaded from the file, memory-mapped, followed by the rows
+        # upserted since, in a buffer grown by doubling
+        self._base = np.zeros((0, 0), dtype=np.float32)
+        self._tail = np.zeros((0, 0), dtype=np.float32)
+        self._tail_rows = 0
+        self._alive_mask: np.ndarray | None = None
+        self._ivf: _IVFIndex | None = None
+        os.makedirs(path, exist_ok=True)
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def upsert(self, records: list[tuple[str, list[float], dict | None]]) -> None:
+        matrix = np.asarray([values for _, values, _ in records], dtype=np.float32)
+        if self.dimension is None:
+            self.dimension = matrix.shape[1]
+            self._save_manifest()
+        elif matrix.shape[1] != self.dimension:
+            raise ValueError(
+                f"Vector dimension {matrix.shape[1]} does not match the "
+                f"dimension {self.dimension} of namespace '{self.name}'."
+            )
+        matrix = _normalize(matrix)
+
+        vectors_path, records_path = self._files(self.generation)
+        with open(vectors_path, "ab") as f:
+            f.write(matrix.tobytes())
+        with open(records_path, "a") as f:
+            for id, _, metadata in records:
+                f.write(json.dumps({"id": id, "metadata": metadata}) + "\n")
+
+        self._append(matrix, [(id, metadata) for id, _, metadata in records])
+        self._compact_if_needed()
+
+    def delete(self, ids: list[str]) -> None:
+        ids = [id for id in ids if id in self.rows]
+        if not ids:
+            return
+        with open(self._files(self.generation)[1], "a") as f:
+            f.write(json.dumps({"delete": ids}) + "\n")
+        self._delete(ids)
+        self._compact_if_needed()
+
+    def blocks(self) -> list[np.ndarray]:
+        "The rows, in blocks, which are not copied into one matrix."
+        return [block for block in (self._base, self._tail[:self._tail_rows]) if len(block)]
+
+    def vector(self, row: int) -> np.ndarray:
+        return _take(self.blocks(), np.array([row]))[0]
+
+    def alive_mask(self) -> np.ndarray:
+        if self._alive_mask is None or len(self._alive_mask) != len(self.alive):
+            self._alive_mask = np.array(self.alive, dtype=bool)
+        return self._alive_mask
+
+    def search(self, vector: list[float], top_k: int) -> tuple[np.ndarray, np.ndarray]:
+        query = _normalize(np.asarray(vector, dtype=np.float32))
+        scores = np.concatenate([np.zeros(0, dtype=np.float32)]
+                                + [block @ query for block in self.blocks()])
+        return _top_k(np.arange(len(scores)), scores, self.alive_mask(), top_k)
+
+    def search_ivf(
+        self,
+        vector: list[float],
+        top_k: int,
+        probes: int,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        blocks = self.blocks()
+        # Rows added since the index was built are searched exhaustively,
+        # until they are numerous enough to be worth rebuilding it.
+        if self._ivf is None or len(self.ids) > 1.1 * self._ivf.rows:
+            self._ivf = _IVFIndex(blocks)
+
+        query = _normalize(np.asarray(vector, dtype=np.float32))
+        candidates = np.concatenate([
+            self._ivf.candidates(query, probes),
+            np.arange(self._ivf.rows, len(self.ids)),
+        ])
+        scores = _take(blocks, candidates) @ query
+        return _top_k(candidates, scores, self.alive_mask()[candidates], top_k)
+
+    def _load(self) -> None:
+        if os.path.exists(self._file("manifest.json")):
+            with open(self._file("manifest.json")) as f:
+                manifest = json.load(f)
+            self.dimension, self.generation = manifest["dimension"], manifest["generation"]
+        vectors_path, records_path = self._files(self.generation)
+        # Files of another generation, left by an interrupted compaction
+        for name in os.listdir(self.path):
+            if name.startswith(("vectors.", "records.")) \
+                    and self._file(name) not in (vectors_path, records_path):
+                os.remove(self._file(name))
+        if not os.path.exists(records_path):
+            return
+
+        rows = None
+        if self.dimension is not None:
+            rows = os.path.getsize(vectors_path) // (4 * self.dimension)
+        records: list[tuple[str, dict | None]] = []
+        deleted: list[tuple[int, list[str]]] = []
+        # End of the last record read
+        end = 0
+        with open(records_path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # Partially written line, after a crash
+                    break
+                record = json.loads(line)
+                if "delete" in record:
+                    deleted.append((len(records), record["delete"]))
+                elif len(records) == rows:
+                    # Record whose vector wasn't written, after a crash
+                    break
+                else:
+                    records.append((record["id"], record["metadata"]))
+                end += len(line)
+        if end < os.path.getsize(records_path):
+            os.truncate(records_path, end)
+        if self.dimension is None and records:
+            # Namespace saved before the dimension was in the manifest
+            self.dimension = os.path.getsize(vectors_path) // 4 // len(records)
+            self._save_manifest()
+        size = 4 * (self.dimension or 0) * len(records)
+        if os.path.getsize(vectors_path) > size:
+            # Vectors whose records weren't written, after a crash
+            os.truncate(vectors_path, size)
+        if not records:
+            return
+
+        self._base = np.memmap(vectors_path, dtype=np.float32, mode="r",
+                               shape=(len(records), self.dimension))
+        start = 0
+        for end, ids in deleted + [(len(records), [])]:
+            self._add_records(records[start:end])
+            self._delete(ids)
+            start = end
+
+    def _append(self, matrix: np.ndarray, records: list[tuple[str, dict | None]]) -> None:
+        rows = self._tail_rows + len(matrix)
+        if rows > len(self._tail):
+            tail = np.empty((max(rows, 2 * len(self._tail)), self.dimension),
+                            dtype=np.float32)
+            if self._tail_rows:
+                tail[:self._tail_rows] = self._tail[:self._tail_rows]
+            self._tail = tail
+        self._tail[self._tail_rows:rows] = matrix
+        self._tail_rows = rows
+        self._add_records(records)
+
+    def _add_records(self, records: list[tuple[str, dict | None]]) -> None:
+        for id, metadata in records:
+            if id in self.rows:
+                self.alive[self.rows[id]] = False
+            self.rows[id] = len(self.ids)
+            self.ids.append(id)
+            self.metadata.append(metadata)
+            self.alive.append(True)
+        self._alive_mask = None
+
+    def _delete(self, ids: list[str]) -> None:
+        for id in ids:
+            if id in self.rows:
+                self.alive[self.rows.pop(id)] = False
+        self._alive_mask = None
+
+    def _compact_if_needed(self) -> None:
+        dead = len(self.ids) - len(self.rows)
+        if dead < max(1000, len(self.rows)):
+            return
+        rows = np.flatnonzero(self.alive_mask())
+        matrix = _take(self.blocks(), rows)
+        records = [(self.ids[r], self.metadata[r]) for r in rows]
+
+        old_files = self._files(self.generation)
+        vectors_path, records_path = self._files(self.generation + 1)
+        with open(vectors_path, "wb") as f:
+            f.write(matrix.tobytes())
+        with open(records_path, "w") as f:
+            for id, metadata in records:
+                f.write(json.dumps({"id": id, "metadata": metadata}) + "\n")
+        # The new files replace the old ones at once, when the manifest does
+        self.generation += 1
+        self._save_manifest()
+        for path in old_files:
+            os.remove(path)
+
+        self.ids, self.metadata, self.alive, self.rows = [], [], [], {}
+        self._base = np.memmap(vectors_path, dtype=np.float32, mode="r",
+                               shape=matrix.shape) if len(matrix) else matrix
+        self._tail = np.zeros((0, self.dimension), dtype=np.float32)
+        self._tail_rows, self._ivf = 0, None
+        self._add_records(records)
+
+    def _save_manifest(self) -> None:
+        with open(self._file("manifest.json.tmp"), "w") as f:
+            json.dump({"dimension": self.dimension, "generation": self.generation}, f)
+        os.replace(self._file("manifest.json.tmp"), self._file("manifest.json"))
+
+    def _files(self, generation: int) -> tuple[str, str]:
+        "Paths of the vectors and the records files of a generation."
+        if generation == 0:
+            return self._file("vectors.f32"), self._file("records.jsonl")
+        return (self._file(f"vectors.{generation}.f32"),
+                self._file(f"records.{generation}.jsonl"))
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+
+class _IVFIndex:
+    "Clusters the rows of a matrix of normalized vectors with k-means."
+
+    ITERATIONS = 10
+    SAMPLES_PER_CLUSTER = 64
+    ASSIGN_BATCH_SIZE = 65536
+
+    def __init__(self, blocks: list[np.ndarray]):
+        self.rows = sum(map(len, blocks))
+        n_lists = max(1, int(np.sqrt(self.rows)))
+        rng = np.random.default_rng(0)
+        sample_size = min(self.rows, n_lists * _IVFIndex.SAMPLES_PER_CLUSTER)
+        sample = _take(blocks, np.sort(rng.choice(self.rows, sample_size, replace=False)))
+
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)]
+        for _ in range(_IVFIndex.ITERATIONS):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            empty = ~sums.any(axis=1)
+            sums[empty] = centroids[empty]
+            centroids = _normalize(sums)
+        self.centroids = centroids
+
+        assignment = np.concatenate([
+            np.argmax(block[i:i+_IVFIndex.ASSIGN_BATCH_SIZE] @ centroids.T, axis=1)
+            for block in blocks
+            for i in range(0, len(block), _IVFIndex.ASSIGN_BATCH_SIZE)
+        ])
+        self.order = np.argsort(assignment, kind="stable")
+        self.offsets = np.concatenate(
+            [[0], np.cumsum(np.bincount(assignment, minlength=n_lists))]
+        )
+
+    def candidates(self, query: np.ndarray, probes: int) -> np.ndarray:
+        "Rows of the clusters closest to the query."
+        probes = min(probes, len(self.centroids))
+        lists = np.argpartition(-(self.centroids @ query), probes - 1)[:probes]
+        return np.concatenate(
+            [self.order[self.offsets[i]:self.offsets[i+1]] for i in lists]
+        )
+
+
+def _normalize(x: np.ndarray) -> np.ndarray:
+    norm = np.linalg.norm(x, axis=-1, keepdims=True)
+    return x / np.where(norm == 0, 1, norm)
+
+
+def _take(blocks: list[np.ndarray], rows: np.ndarray) -> np.ndarray:
+    "Rows of the concatenation of blocks, without concatenating them."
+    taken = np.empty((len(rows), blocks[0].shape[1]), dtype=np.float32)
+    start = 0
+    for block in blocks:
+        selected = (rows >= start) & (rows < start + len(block))
+        taken[selected] = block[rows[selected] - start]
+        start += len(block)
+    return taken
+
+
+def _top_k(
+    rows: np.ndarray,
+    scores: np.ndarray,
+    alive: np.ndarray,
+    k: int,
+) -> tuple[np.ndarray, np.ndarray]:
+    rows, scores = rows[alive], scores[alive]
+    k = min(k, len(scores))
+    if k == 0:
+        return rows[:0], scores[:0]
+    best = np.argpartition(-scores, k - 1)[:k]
+    best = best[np.argsort(-scores[best], kind="stable")]
+    return rows[best], scores[best]